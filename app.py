@@ -6,13 +6,24 @@ from werkzeug.utils import secure_filename
 from datetime import datetime, timedelta
 import json
 from sqlalchemy import func, and_, or_, text
+from sqlalchemy.orm import contains_eager, selectinload
 from dotenv import load_dotenv
 
 # 載入環境變數
 load_dotenv()
 
 # 添加這個重要的導入
-from models import db, Session, Segment, Tag, Attachment, QueryRelation, session_tags, segment_tags
+from models import db, Session, Segment, Tag, Attachment, QueryRelation, IndexOutbox, session_tags, segment_tags
+from search_filters import SearchFilters
+from fulltext_service import start_fulltext_warmup, fulltext_available, fulltext_search, highlight
+from bm25_index import start_keyword_index, get_keyword_index_status, keyword_search_rows
+from suggestion_index import get_suggestion_index
+from tag_matcher import get_tag_dictionary
+from relation_graph import get_relation_graph_cache, build_tag_graph, GRAPH_MAX_NODES, GRAPH_MAX_LINKS, GRAPH_MAX_DEPTH
+from graph_layout import layout_graph, DEFAULT_LAYOUT, LAYOUT_METHODS
+from tag_associations import ASSOCIATION_RULES, get_tag_association_store, start_tag_association_maintenance
+from change_tracking import get_data_version
+from caching import LRUCache
 
 # 添加缺失的導入
 from collections import Counter
@@ -20,10 +31,19 @@ from collections import Counter
 # 配置日誌
 logger = logging.getLogger(__name__)
 
-# 導入向量搜尋服務
+# 統一搜尋結果快取的條目上限
+SEARCH_RESULT_CACHE_SIZE = int(os.environ.get('SEARCH_RESULT_CACHE_SIZE', 512))
+
+# 導入向量搜尋服務（模型和 Chroma 客戶端在背景線程中預熱，不阻塞啟動）
 try:
-    from vector_service import get_chroma_manager, get_hybrid_search_engine, initialize_vector_db
-    VECTOR_SEARCH_ENABLED = True
+    from vector_service import (
+        get_chroma_manager, get_hybrid_search_engine,
+        start_vector_warmup, is_vector_ready, get_warmup_status, vector_dependencies_available
+    )
+    from indexing_service import start_indexing_worker, notify_indexing_worker, get_indexing_stats
+    VECTOR_SEARCH_ENABLED = vector_dependencies_available()
+    if not VECTOR_SEARCH_ENABLED:
+        print("將使用傳統搜尋功能，請安裝必要的依賴：chromadb, sentence-transformers")
 except ImportError as e:
     print(f"向量搜尋服務導入失敗: {e}")
     print("將使用傳統搜尋功能，請安裝必要的依賴：chromadb, sentence-transformers")
@@ -33,14 +53,18 @@ except ImportError as e:
 class UnifiedSearchService:
     """無感知的智能搜尋服務 - 自動決定最佳搜尋策略"""
     
-    def __init__(self):
-        self.vector_enabled = VECTOR_SEARCH_ENABLED
-        if self.vector_enabled:
-            try:
-                self.search_engine = get_hybrid_search_engine()
-            except Exception as e:
-                logger.warning(f"向量搜尋引擎初始化失敗: {e}")
-                self.vector_enabled = False
+    def __init__(self, cache_size=SEARCH_RESULT_CACHE_SIZE):
+        # 搜尋結果快取：鍵包含資料版本號，任何寫入提交後舊條目自然失效並被 LRU 淘汰
+        self.result_cache = LRUCache(max_size=cache_size)
+    
+    @property
+    def vector_enabled(self):
+        """向量搜尋是否可用（預熱完成前為 False，搜尋降級為關鍵字模式）"""
+        return VECTOR_SEARCH_ENABLED and is_vector_ready()
+    
+    @property
+    def search_engine(self):
+        return get_hybrid_search_engine()
     
     def search(self, query, context=None, limit=10, **kwargs):
         """
@@ -50,7 +74,7 @@ class UnifiedSearchService:
             query: 搜尋關鍵字
             context: 搜尋上下文 (quick_search, tag_search, advanced_search等)
             limit: 結果數量限制
-            **kwargs: 其他搜尋參數
+            **kwargs: 其他搜尋參數（filters: SearchFilters 過濾條件）
         
         Returns:
             統一格式的搜尋結果
@@ -66,6 +90,12 @@ class UnifiedSearchService:
         query = query.strip()
         search_strategy = self._determine_search_strategy(query, context)
         
+        cache_key = self._cache_key(query, context, limit, kwargs.get('filters'))
+        cached = self.result_cache.get_with_age(cache_key)
+        if cached is not None:
+            response, age = cached
+            return {**response, 'query': query, 'cached': True, 'cache_age_seconds': round(age, 3)}
+        
         try:
             if search_strategy == 'vector_enhanced' and self.vector_enabled:
                 results = self._vector_enhanced_search(query, limit, **kwargs)
@@ -77,17 +107,22 @@ class UnifiedSearchService:
             # 統一結果格式
             formatted_results = self._format_unified_results(results, search_strategy)
             
-            return {
+            response = {
                 'results': formatted_results,
                 'total_count': len(formatted_results),
                 'search_strategy': search_strategy,
                 'query': query,
                 'vector_enabled': self.vector_enabled
             }
+            if kwargs.get('filters') is not None:
+                response['filters'] = kwargs['filters'].to_dict()
+            # 快取成功的回應；命中時只替換查詢字串與快取資訊
+            self.result_cache.set(cache_key, response)
+            return {**response, 'cached': False}
             
         except Exception as e:
             logger.error(f"搜尋失敗: {e}")
-            # 降級到傳統搜尋
+            # 降級到傳統搜尋；降級結果不快取，待服務恢復後重新計算
             try:
                 results = self._traditional_search(query, limit, **kwargs)
                 formatted_results = self._format_unified_results(results, 'traditional_fallback')
@@ -108,6 +143,15 @@ class UnifiedSearchService:
                     'error': str(fallback_error)
                 }
     
+    def _cache_key(self, query, context, limit, filters):
+        """快取鍵：正規化查詢、上下文、數量、過濾條件、向量可用狀態與資料版本號"""
+        normalized = ' '.join(query.split()).casefold()
+        filters_key = json.dumps(filters.to_dict(), sort_keys=True) if filters is not None else None
+        return (normalized, context, limit, filters_key, self.vector_enabled, get_data_version())
+    
+    def cache_stats(self):
+        return {**self.result_cache.stats(), 'data_version': get_data_version()}
+    
     def _determine_search_strategy(self, query, context):
         """智能決定搜尋策略"""
         if not self.vector_enabled:
@@ -139,7 +183,7 @@ class UnifiedSearchService:
             traditional_results = self._traditional_search(query, limit // 2, **kwargs)
             
             # 向量搜尋補充
-            vector_results = self.search_engine.search(query, 'semantic', limit // 2)
+            vector_results = self.search_engine.search(query, 'semantic', limit // 2, filters=kwargs.get('filters'))
             
             # 合併結果，去重
             combined_results = self._merge_results(traditional_results, vector_results)
@@ -153,7 +197,7 @@ class UnifiedSearchService:
         """向量主導搜尋 - 主要用向量搜尋，傳統搜尋作為補充"""
         try:
             # 向量搜尋
-            vector_results = self.search_engine.search(query, 'hybrid', limit)
+            vector_results = self.search_engine.search(query, 'hybrid', limit, filters=kwargs.get('filters'))
             
             # 如果結果不足，用傳統搜尋補充
             if len(vector_results) < limit // 2:
@@ -170,22 +214,21 @@ class UnifiedSearchService:
     def _traditional_search(self, query, limit, **kwargs):
         """傳統搜尋 - 基於資料庫查詢"""
         results = []
+        filters = kwargs.get('filters') or SearchFilters()
         
-        # 搜尋課程
-        sessions = Session.query.filter(
-            or_(
-                Session.title.contains(query),
-                Session.overview.contains(query)
-            )
-        ).limit(limit // 2).all()
+        # 搜尋課程（BM25 索引或全文索引，依相關度排序）
+        # 標籤以 selectinload 一次載入，避免每筆結果各查詢一次
+        session_query = filters.apply_to_session_query(Session.query.options(selectinload(Session.tags)))
+        sessions = keyword_search_rows(Session, query, limit // 2, session_query) if session_query is not None else []
         
-        for session in sessions:
+        for session, relevance in sessions:
             results.append({
                 'type': 'traditional',
                 'content_type': 'session',
                 'title': session.title,
                 'content': session.overview or '',
-                'score': 0.8,  # 傳統搜尋給固定分數
+                'score': relevance,
+                'highlight': highlight(session.overview, query),
                 'metadata': {
                     'session_id': session.id,
                     'date': session.date.isoformat() if session.date else None,
@@ -194,20 +237,19 @@ class UnifiedSearchService:
             })
         
         # 搜尋段落
-        segments = Segment.query.filter(
-            or_(
-                Segment.title.contains(query),
-                Segment.content.contains(query)
-            )
-        ).join(Session).limit(limit // 2).all()
+        segment_query = filters.apply_to_segment_query(
+            Segment.query.join(Session).options(contains_eager(Segment.session), selectinload(Segment.tags))
+        )
+        segments = keyword_search_rows(Segment, query, limit // 2, segment_query) if segment_query is not None else []
         
-        for segment in segments:
+        for segment, relevance in segments:
             results.append({
                 'type': 'traditional',
                 'content_type': 'segment',
                 'title': segment.title or f'段落 {segment.id}',
                 'content': segment.content or '',
-                'score': 0.7,
+                'score': relevance,
+                'highlight': highlight(segment.content, query),
                 'metadata': {
                     'segment_id': segment.id,
                     'session_id': segment.session_id,
@@ -217,11 +259,14 @@ class UnifiedSearchService:
             })
         
         # 搜尋標籤
-        tags = Tag.query.filter(Tag.name.contains(query)).limit(5).all()
+        tags = Tag.query.filter(Tag.name.contains(query)).limit(5).all() if filters.includes('segment') else []
         
         for tag in tags:
-            # 找到使用此標籤的內容
-            tagged_segments = Segment.query.join(Segment.tags).filter(Tag.id == tag.id).limit(3).all()
+            # 找到使用此標籤的內容（所屬課程與標籤一併載入）
+            tagged_segments = filters.apply_to_segment_query(
+                Segment.query.join(Segment.tags).filter(Tag.id == tag.id)
+                .options(*_segment_hydration_options())
+            ).limit(3).all()
             
             for segment in tagged_segments:
                 if len(results) >= limit:
@@ -289,6 +334,10 @@ class UnifiedSearchService:
                 'search_type': result.get('type', search_strategy),
                 'metadata': result.get('metadata', {})
             }
+            # 全文檢索的摘要與命中位置
+            if result.get('highlight'):
+                formatted_result['snippet'] = result['highlight']['snippet']
+                formatted_result['snippet_offsets'] = result['highlight']['offsets']
             
             # 根據內容類型添加特定字段
             if result.get('content_type') == 'session':
@@ -334,6 +383,70 @@ ALLOWED_EXTENSIONS = {'png', 'jpg', 'jpeg', 'gif', 'mp4', 'avi', 'pdf', 'doc', '
 db.init_app(app)
 migrate = Migrate(app, db)
 
+# 註冊命令列維護工具（flask vector-rebuild 等）
+from commands import register_commands
+register_commands(app)
+
+def start_vector_services():
+    """啟動向量搜尋的背景預熱和索引工作線程（重複呼叫無副作用）"""
+    if VECTOR_SEARCH_ENABLED:
+        start_vector_warmup(app)
+        start_indexing_worker(app)
+
+_search_indexes_prepared = False
+
+def prepare_search_indexes():
+    """
+    在背景線程中檢查全文索引（缺少時建立並回填）、啟動 BM25 索引與標籤關聯表的維護，每個進程只執行一次；
+    回填完成前關鍵字搜尋使用 LIKE，不阻塞啟動或第一個請求
+    """
+    global _search_indexes_prepared
+    if not _search_indexes_prepared:
+        _search_indexes_prepared = True
+        start_fulltext_warmup(db.engine)
+        start_keyword_index(app)
+        start_tag_association_maintenance(app)
+
+@app.before_request
+def ensure_search_indexes_ready():
+    prepare_search_indexes()
+
+@app.before_request
+def ensure_vector_services():
+    """首個請求到達時（伺服器已綁定端口）啟動向量搜尋的背景服務"""
+    start_vector_services()
+
+def queue_vector_index(entity_type, entity_id, operation='upsert'):
+    """在當前交易中登記向量索引事件，由背景工作線程處理"""
+    if VECTOR_SEARCH_ENABLED:
+        IndexOutbox.enqueue(entity_type, entity_id, operation)
+
+def notify_vector_index():
+    """提交後喚醒索引工作線程"""
+    if VECTOR_SEARCH_ENABLED:
+        notify_indexing_worker()
+
+def touch_tagged_rows(tag_id):
+    """
+    更新使用此標籤的課程和段落的修改時間，並在同一交易中登記向量索引事件，
+    使其向量元數據（標籤名稱、標籤 ID）在提交後由索引工作線程刷新
+    """
+    now = datetime.utcnow()
+    session_ids = [row_id for (row_id,) in db.session.query(session_tags.c.session_id)
+                   .filter(session_tags.c.tag_id == tag_id).distinct()]
+    segment_ids = [row_id for (row_id,) in db.session.query(segment_tags.c.segment_id)
+                   .filter(segment_tags.c.tag_id == tag_id).distinct()]
+    if session_ids:
+        Session.query.filter(Session.id.in_(session_ids))\
+            .update({Session.updated_at: now}, synchronize_session=False)
+    if segment_ids:
+        Segment.query.filter(Segment.id.in_(segment_ids))\
+            .update({Segment.updated_at: now}, synchronize_session=False)
+    for session_id in session_ids:
+        queue_vector_index('session', session_id)
+    for segment_id in segment_ids:
+        queue_vector_index('segment', segment_id)
+
 def allowed_file(filename):
     return '.' in filename and filename.rsplit('.', 1)[1].lower() in ALLOWED_EXTENSIONS
 
@@ -393,15 +506,13 @@ def new_session():
                     session.tags.append(tag)
             
             db.session.add(session)
+            db.session.flush()  # 確保session有ID
+            queue_vector_index('session', session.id)
+            # 段落的向量元數據包含課程標題與日期，需一併重新索引
+            for segment in session.segments:
+                queue_vector_index('segment', segment.id)
             db.session.commit()
-            
-            # 自動同步到向量數據庫（如果啟用）
-            if VECTOR_SEARCH_ENABLED:
-                try:
-                    chroma_manager = get_chroma_manager()
-                    chroma_manager.add_session(session)
-                except Exception as e:
-                    logger.warning(f"向量數據庫同步失敗: {e}")
+            notify_vector_index()
             
             return jsonify({'success': True, 'session_id': session.id})
             
@@ -432,6 +543,8 @@ def edit_session(session_id):
                     return jsonify({'success': False, 'error': 'Invalid date format'}), 400
                 
             session.tags.clear() 
+            # 標籤變更不會觸發 onupdate，手動更新修改時間以便增量同步
+            session.updated_at = datetime.utcnow()
             tag_names = data.get('tags', [])
             tag_category = data.get('tag_category', '領域') 
             
@@ -448,15 +561,12 @@ def edit_session(session_id):
                         db.session.flush()  # 確保tag有ID
                     session.tags.append(tag)
                 
+            queue_vector_index('session', session.id)
+            # 段落的向量元數據包含課程標題與日期，需一併重新索引
+            for segment in session.segments:
+                queue_vector_index('segment', segment.id)
             db.session.commit()
-            
-            # 自動同步到向量數據庫（如果啟用）
-            if VECTOR_SEARCH_ENABLED:
-                try:
-                    chroma_manager = get_chroma_manager()
-                    chroma_manager.add_session(session)
-                except Exception as e:
-                    logger.warning(f"向量數據庫同步失敗: {e}")
+            notify_vector_index()
             
             return jsonify({'success': True, 'session_id': session.id})
             
@@ -486,16 +596,12 @@ def delete_session(session_id):
                 db.session.delete(attachment)
             db.session.delete(segment)
         
-        # 從向量數據庫中刪除（如果啟用）
-        if VECTOR_SEARCH_ENABLED:
-            try:
-                chroma_manager = get_chroma_manager()
-                chroma_manager.delete_session(session_id)
-            except Exception as e:
-                logger.warning(f"向量數據庫刪除失敗: {e}")
+        # 課程及其段落的向量由索引工作線程以 session_id 一次刪除
+        queue_vector_index('session', session_id, 'delete')
         
         db.session.delete(session)
         db.session.commit()
+        notify_vector_index()
         return redirect(url_for('index'))
     except Exception as e:
         db.session.rollback()
@@ -539,17 +645,18 @@ def add_segment(session_id):
                 segment.tags.append(tag)
         
         db.session.add(segment)
+        db.session.flush()  # 確保segment有ID
+        segment_id = segment.id
+        attached_tag_ids = [tag.id for tag in segment.tags]
+        queue_vector_index('segment', segment_id)
         db.session.commit()
+        notify_vector_index()
         
-        # 自動同步到向量數據庫（如果啟用）
-        if VECTOR_SEARCH_ENABLED:
-            try:
-                chroma_manager = get_chroma_manager()
-                chroma_manager.add_segment(segment)
-            except Exception as e:
-                logger.warning(f"向量數據庫同步失敗: {e}")
+        # 內容中提到但尚未加上的標籤，供前端提示
+        suggested_tags = suggest_tags_for_text(data.get('title', ''), data.get('content', ''),
+                                               exclude_ids=attached_tag_ids)
         
-        return jsonify({'success': True, 'segment_id': segment.id})
+        return jsonify({'success': True, 'segment_id': segment_id, 'suggested_tags': suggested_tags})
         
     except Exception as e:
         db.session.rollback()
@@ -666,52 +773,69 @@ def search_tags():
         if not q:
             return jsonify([])
         
-        # 構建基礎查詢
-        query = Tag.query.filter(Tag.name.contains(q))
-        
         # 根據上下文智能過濾分類
+        categories = None
         if context == 'symptom_to_cause':
             # 症狀診斷：優先顯示症狀、位置相關標籤
-            preferred_categories = ['症狀', '位置', '施術位置', '治療位置']
-            query = query.filter(Tag.category.in_(preferred_categories))
+            categories = ['症狀', '位置', '施術位置', '治療位置']
         elif context == 'cause_to_treatment':
             # 治療方案：優先顯示病因、治療相關標籤
-            preferred_categories = ['病因', '手法', '治療', '領域']
-            query = query.filter(Tag.category.in_(preferred_categories))
+            categories = ['病因', '手法', '治療', '領域']
         elif context == 'method_analysis':
             # 手法分析：優先顯示手法相關標籤
-            preferred_categories = ['手法', '治療']
-            query = query.filter(Tag.category.in_(preferred_categories))
+            categories = ['手法', '治療']
         elif category_filter:
             # 如果指定了分類過濾
-            query = query.filter(Tag.category == category_filter)
+            categories = [category_filter]
         
-        # 執行查詢，按使用頻率排序
-        tags = query.outerjoin(segment_tags, Tag.id == segment_tags.c.tag_id)\
-                   .group_by(Tag.id)\
-                   .order_by(func.count(segment_tags.c.tag_id).desc(), Tag.name)\
-                   .limit(15)\
-                   .all()
+        # 記憶體索引：前綴匹配優先，再以中綴匹配補齊，按使用頻率排序
+        index = get_suggestion_index()
+        tags = index.search_tags(q, limit=15, categories=categories)
         
         # 如果上下文查詢結果太少，補充其他相關標籤
         if len(tags) < 5 and context:
-            additional_query = Tag.query.filter(Tag.name.contains(q))
+            additional_categories = None
             if context == 'symptom_to_cause':
                 # 補充病因標籤（因為症狀可能對應病因）
-                additional_query = additional_query.filter(Tag.category == '病因')
+                additional_categories = ['病因']
             elif context == 'cause_to_treatment':
                 # 補充症狀標籤（幫助更好理解病因）
-                additional_query = additional_query.filter(Tag.category == '症狀')
+                additional_categories = ['症狀']
             
-            additional_tags = additional_query.limit(5).all()
+            additional_tags = index.search_tags(q, limit=5 + len(tags), categories=additional_categories)
             # 避免重複
             existing_ids = {tag.id for tag in tags}
-            tags.extend([tag for tag in additional_tags if tag.id not in existing_ids])
+            tags.extend([tag for tag in additional_tags if tag.id not in existing_ids][:5])
         
         return jsonify([tag.to_dict() for tag in tags])
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
+def suggest_tags_for_text(*texts, exclude_ids=(), limit=10):
+    """以標籤詞典找出文字中提到的標籤（不查詢資料庫），依提及次數排序"""
+    try:
+        return [{
+            'id': mention.tag_id,
+            'name': mention.name,
+            'category': mention.category,
+            'mentions': count
+        } for mention, count in get_tag_dictionary().suggest_tags(*texts, exclude_ids=exclude_ids, limit=limit)]
+    except Exception as e:
+        logger.warning(f"標籤建議失敗: {e}")
+        return []
+
+@app.route('/api/tags/suggest', methods=['POST'])
+def suggest_tags():
+    """撰寫段落時，根據標題與內容建議標籤"""
+    data = request.get_json() or {}
+    try:
+        exclude_ids = [int(tag_id) for tag_id in data.get('exclude_tag_ids', [])]
+        limit = int(data.get('limit', 10))
+    except (TypeError, ValueError):
+        return jsonify({'error': 'Invalid exclude_tag_ids or limit'}), 400
+    return jsonify(suggest_tags_for_text(data.get('title'), data.get('content'),
+                                         exclude_ids=exclude_ids, limit=limit))
+
 @app.route('/api/tag/<int:tag_id>/update', methods=['POST'])
 def update_tag(tag_id):
     try:
@@ -737,12 +861,18 @@ def update_tag(tag_id):
                     'error': f"Tag name '{new_name}' already exists in category '{new_category}'."
                 }), 400
 
+        renamed = new_name != tag.name or new_category != tag.category
         tag.name = new_name
         tag.category = new_category
         tag.color = data.get('color', tag.color)
         tag.description = data.get('description', tag.description)
         
+        if renamed:
+            touch_tagged_rows(tag.id)
+        
         db.session.commit()
+        if renamed:
+            notify_vector_index()
         return jsonify({'success': True, 'tag': tag.to_dict()})
         
     except Exception as e:
@@ -756,8 +886,10 @@ def delete_tag(tag_id):
         if not tag: 
             return jsonify({'error': 'Tag not found'}), 404
             
+        touch_tagged_rows(tag.id)
         db.session.delete(tag)
         db.session.commit()
+        notify_vector_index()
         return jsonify({'success': True, 'message': 'Tag deleted'})
         
     except Exception as e:
@@ -801,6 +933,7 @@ def update_segment_detail(segment_id):
         
         if 'tags' in data: 
             segment.tags.clear()
+            segment.updated_at = datetime.utcnow()
             tag_data_list = data.get('tags', [])
             for tag_info in tag_data_list:
                 if isinstance(tag_info, dict) and tag_info.get('name'):
@@ -814,15 +947,9 @@ def update_segment_detail(segment_id):
                         db.session.flush()  # 確保tag有ID
                     segment.tags.append(tag)
                     
+        queue_vector_index('segment', segment.id)
         db.session.commit()
-        
-        # 自動同步到向量數據庫（如果啟用）
-        if VECTOR_SEARCH_ENABLED:
-            try:
-                chroma_manager = get_chroma_manager()
-                chroma_manager.add_segment(segment)
-            except Exception as e:
-                logger.warning(f"向量數據庫同步失敗: {e}")
+        notify_vector_index()
         
         return jsonify({'success': True, 'segment_id': segment.id})
         
@@ -837,16 +964,10 @@ def delete_segment_detail(segment_id):
         if not segment: 
             return jsonify({'error': 'Segment not found'}), 404
         
-        # 從向量數據庫中刪除（如果啟用）
-        if VECTOR_SEARCH_ENABLED:
-            try:
-                chroma_manager = get_chroma_manager()
-                chroma_manager.delete_segment(segment_id)
-            except Exception as e:
-                logger.warning(f"向量數據庫刪除失敗: {e}")
-                
+        queue_vector_index('segment', segment_id, 'delete')
         db.session.delete(segment)
         db.session.commit()
+        notify_vector_index()
         return jsonify({'success': True, 'message': 'Segment deleted'})
         
     except Exception as e:
@@ -906,7 +1027,19 @@ def export_session_json(session_id):
 def vector_status():
     """向量數據庫狀態檢查"""
     if not VECTOR_SEARCH_ENABLED:
-        return jsonify({'enabled': False, 'message': 'Vector search dependencies not installed'})
+        return jsonify({'enabled': False, 'message': 'Vector search dependencies not installed',
+                        'keyword_index': get_keyword_index_status()})
+    
+    warmup = get_warmup_status()
+    if not is_vector_ready():
+        # 預熱中或失敗時不觸發同步載入，搜尋以關鍵字模式運作
+        return jsonify({
+            'enabled': True,
+            'status': 'error' if warmup['state'] == 'failed' else 'warming_up',
+            'search_mode': 'keyword_only',
+            'warmup': warmup,
+            'keyword_index': get_keyword_index_status()
+        })
     
     try:
         chroma_manager = get_chroma_manager()
@@ -914,12 +1047,16 @@ def vector_status():
         return jsonify({
             'enabled': True,
             'status': 'healthy',
+            'search_mode': 'hybrid',
+            'warmup': warmup,
+            'keyword_index': get_keyword_index_status(),
             'stats': stats
         })
     except Exception as e:
         return jsonify({
             'enabled': True,
             'status': 'error',
+            'warmup': warmup,
             'error': str(e)
         })
 
@@ -929,14 +1066,59 @@ def sync_vector_db():
     """同步數據到向量數據庫"""
     if not VECTOR_SEARCH_ENABLED:
         return jsonify({'success': False, 'error': 'Vector search not enabled'}), 503
+    if not is_vector_ready():
+        return jsonify({'success': False, 'error': 'Vector search is warming up', 'warmup': get_warmup_status()}), 503
+    
+    try:
+        from vector_service import sync_existing_data, count_stale_rows
+        data = request.get_json(silent=True) or {}
+        
+        # 試運行：只回報需要同步的資料列數量
+        if data.get('dry_run'):
+            return jsonify({'success': True, 'dry_run': True, 'stale': count_stale_rows()})
+        
+        stats = sync_existing_data(
+            batch_size=int(data['batch_size']) if data.get('batch_size') else None,
+            full=bool(data.get('full', False))
+        )
+        if stats.get('error'):
+            return jsonify({'success': False, 'error': stats['error'], 'stats': stats}), 500
+        return jsonify({'success': True, 'message': '數據同步完成', 'stats': stats})
+    except Exception as e:
+        return jsonify({'success': False, 'error': str(e)}), 500
+
+# 孤立向量對帳 API
+@app.route('/api/vector/reconcile', methods=['POST'])
+def reconcile_vector_db():
+    """刪除資料庫中已不存在的課程和段落所遺留的向量"""
+    if not VECTOR_SEARCH_ENABLED:
+        return jsonify({'success': False, 'error': 'Vector search not enabled'}), 503
+    if not is_vector_ready():
+        return jsonify({'success': False, 'error': 'Vector search is warming up', 'warmup': get_warmup_status()}), 503
     
     try:
-        from vector_service import sync_existing_data
-        sync_existing_data()
-        return jsonify({'success': True, 'message': '數據同步完成'})
+        from vector_service import reconcile_orphans
+        data = request.get_json(silent=True) or {}
+        stats = reconcile_orphans(
+            batch_size=int(data['batch_size']) if data.get('batch_size') else None,
+            dry_run=bool(data.get('dry_run', False))
+        )
+        return jsonify({'success': True, 'stats': stats})
     except Exception as e:
         return jsonify({'success': False, 'error': str(e)}), 500
 
+# 向量索引延遲 API
+@app.route('/api/vector/outbox')
+def vector_outbox_stats():
+    """向量索引事件的待處理數量與延遲"""
+    if not VECTOR_SEARCH_ENABLED:
+        return jsonify({'enabled': False, 'message': 'Vector search dependencies not installed'})
+    
+    try:
+        return jsonify({'enabled': True, 'stats': get_indexing_stats()})
+    except Exception as e:
+        return jsonify({'enabled': True, 'error': str(e)}), 500
+
 # 統一搜尋 API 端點
 @app.route('/api/search/unified', methods=['POST'])
 def unified_search_api():
@@ -953,11 +1135,18 @@ def unified_search_api():
         if not query.strip():
             return jsonify({'results': [], 'message': 'Please provide a search query'})
         
+        # 過濾條件：tags / tag_ids / tag_match / session_ids / segment_types / date_from / date_to / content_type
+        try:
+            filters = SearchFilters.from_dict(data.get('filters'))
+        except (TypeError, ValueError) as e:
+            return jsonify({'results': [], 'error': f'Invalid filters: {e}'}), 400
+        
         # 使用統一搜尋服務
         search_results = unified_search.search(
             query=query,
             context=context,
-            limit=limit
+            limit=limit,
+            filters=None if filters.is_empty() else filters
         )
         
         return jsonify(search_results)
@@ -1034,28 +1223,22 @@ def search_suggestions():
         if len(query) < 2:
             return jsonify([])
         
-        # 基於標籤名稱的建議
-        tag_suggestions = Tag.query.filter(
-            Tag.name.contains(query)
-        ).limit(5).all()
+        index = get_suggestion_index()
         
+        # 基於標籤名稱的建議
         suggestions = []
-        for tag in tag_suggestions:
+        for tag in index.search_tags(query, limit=5):
             suggestions.append({
-                'text': tag.name,
+                'text': tag.text,
                 'type': 'tag',
                 'category': tag.category,
                 'color': tag.color
             })
         
         # 基於課程標題的建議
-        session_suggestions = Session.query.filter(
-            Session.title.contains(query)
-        ).limit(3).all()
-        
-        for session in session_suggestions:
+        for session in index.search_sessions(query, limit=3):
             suggestions.append({
-                'text': session.title,
+                'text': session.text,
                 'type': 'session',
                 'id': session.id
             })
@@ -1065,6 +1248,16 @@ def search_suggestions():
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
+@app.route('/api/search/stats', methods=['GET'])
+def search_stats():
+    """搜尋結果、關聯圖譜快取命中率與關鍵字索引狀態"""
+    return jsonify({
+        'result_cache': unified_search.cache_stats(),
+        'relation_graph_cache': get_relation_graph_cache(app).stats(),
+        'tag_associations': get_tag_association_store(app).stats(),
+        'keyword_index': get_keyword_index_status()
+    })
+
 # 新增智能搜索 API
 @app.route('/api/search/smart', methods=['POST'])
 def smart_search():
@@ -1105,79 +1298,156 @@ def smart_search():
         return jsonify({'error': str(e)}), 500
 
 def smart_tag_matching(query, context):
-    """智能標籤匹配 - 根據關鍵詞和上下文匹配相關標籤"""
-    matched_tags = []
+    """
+    智能標籤匹配 - 根據關鍵詞和上下文匹配相關標籤
     
-    # 1. 精確匹配
-    exact_matches = Tag.query.filter(Tag.name.ilike(f'%{query}%')).all()
+    名稱匹配與使用次數都來自記憶體中的搜尋建議索引，
+    整個流程只需固定次數的查詢（全文檢索補充、最後載入標籤物件）
+    """
+    index = get_suggestion_index()
+    preferred_categories = None
     
-    # 2. 根據上下文過濾和排序
+    # 1. 根據上下文決定優先的分類
     if context == 'symptom_to_cause':
         # 症狀診斷：優先症狀標籤，然後是位置
         preferred_categories = ['症狀', '位置', '施術位置', '治療位置']
-        exact_matches = [tag for tag in exact_matches if tag.category in preferred_categories]
-        
     elif context == 'cause_to_treatment':
         # 治療方案：優先病因標籤，然後是手法
         preferred_categories = ['病因', '手法', '治療']
-        exact_matches = [tag for tag in exact_matches if tag.category in preferred_categories]
-        
     elif context == 'method_analysis':
         # 手法分析：優先手法標籤
         preferred_categories = ['手法', '治療']
-        exact_matches = [tag for tag in exact_matches if tag.category in preferred_categories]
     
-    matched_tags.extend(exact_matches[:5])  # 限制數量
+    # 2. 精確匹配（標籤名稱包含查詢字串）
+    matched_ids = [tag.id for tag in index.search_tags(query, limit=5, categories=preferred_categories)]
     
-    # 3. 如果精確匹配結果不足，進行語義匹配
-    if len(matched_tags) < 3:
-        # 分詞搜索 - 將查詢分解為關鍵詞
-        keywords = extract_keywords(query)
-        for keyword in keywords:
-            if len(keyword) >= 2:  # 忽略太短的詞
-                semantic_matches = Tag.query.filter(Tag.name.contains(keyword)).limit(3).all()
-                for tag in semantic_matches:
-                    if tag not in matched_tags:
-                        matched_tags.append(tag)
+    # 3. 如果精確匹配結果不足，以標籤詞典一次掃描找出查詢中提到的所有標籤
+    if len(matched_ids) < 3:
+        for mention in get_tag_dictionary().find(query):
+            if mention.tag_id not in matched_ids:
+                matched_ids.append(mention.tag_id)
     
-    # 4. 按使用頻率排序
-    if matched_tags:
-        tag_usage = {}
-        for tag in matched_tags:
-            usage_count = db.session.query(func.count(segment_tags.c.tag_id))\
-                .filter(segment_tags.c.tag_id == tag.id).scalar() or 0
-            tag_usage[tag.id] = usage_count
-        
-        matched_tags.sort(key=lambda x: tag_usage.get(x.id, 0), reverse=True)
+    # 4. 仍然不足時，取全文檢索命中段落上最常見的標籤
+    if len(matched_ids) < 3 and fulltext_available():
+        tag_counter = Counter()
+        base_query = Segment.query.options(selectinload(Segment.tags))
+        for segment, _ in fulltext_search(Segment, query, 20, base_query):
+            tag_counter.update(
+                tag.id for tag in segment.tags
+                if tag.id not in matched_ids and (not preferred_categories or tag.category in preferred_categories)
+            )
+        matched_ids.extend(tag_id for tag_id, _ in tag_counter.most_common(5 - len(matched_ids)))
     
-    return matched_tags[:5]  # 最多返回5個標籤
-
-def extract_keywords(query):
-    """從查詢中提取關鍵詞"""
-    import re
+    if not matched_ids:
+        return []
     
-    # 移除常見的停用詞
-    stop_words = {'的', '了', '是', '在', '有', '和', '與', '或', '但', '會', '能', '可以', '應該', '需要'}
+    # 5. 按使用頻率排序（穩定排序，同次數時保留匹配順序）
+    tag_usage = index.tag_usage(matched_ids)
+    matched_ids.sort(key=lambda tag_id: tag_usage.get(tag_id, 0), reverse=True)
+    matched_ids = matched_ids[:5]  # 最多返回5個標籤
     
-    # 簡單的中文分詞（可以使用更高級的分詞庫如 jieba）
-    # 這裡使用簡單的字符分割
-    keywords = []
+    tags_by_id = {tag.id: tag for tag in Tag.query.filter(Tag.id.in_(matched_ids))}
+    return [tags_by_id[tag_id] for tag_id in matched_ids if tag_id in tags_by_id]
+
+def _segment_hydration_options():
+    """段落結果的預先載入策略：段落標籤與所屬課程各以一次 IN 查詢載入，查詢數不隨結果數增加"""
+    return (selectinload(Segment.tags), selectinload(Segment.session))
+
+# 診斷查詢的候選標籤欄位、來源標籤欄位與智能搜索結果類型
+ASSOCIATION_RESULT_FIELDS = {
+    'symptom_to_cause': ('potential_cause_tags', 'matched_symptoms', 'smart_symptom_diagnosis'),
+    'cause_to_treatment': ('potential_treatment_tags', 'matched_causes', 'smart_treatment_search'),
+}
+
+def association_search(relation, source_tag_ids, smart=False, limit=20, segment_ids=None):
+    """
+    以物化關聯表查詢候選標籤（一次索引查詢），依支持段落數排序
     
-    # 按標點符號分割
-    parts = re.split(r'[，。！？、\s]+', query)
+    每個候選附帶支持段落數、強度與例子段落 ID；段落欄位取自第一個例子段落，供前端顯示與連結。
+    segment_ids（段落 ID 查詢）限定只統計這些段落，例如帶有位置或領域條件的診斷查詢
+    """
+    candidates = get_tag_association_store(app).lookup(relation, source_tag_ids, limit, segment_ids=segment_ids)
+    if not candidates:
+        return []
     
-    for part in parts:
-        if part and len(part) >= 2 and part not in stop_words:
-            keywords.append(part)
-            
-            # 也添加部分子字符串
-            if len(part) > 3:
-                for i in range(len(part) - 1):
-                    sub = part[i:i+2]
-                    if sub not in stop_words:
-                        keywords.append(sub)
+    tag_ids = {c.tag_id for c in candidates} | {tag_id for c in candidates for tag_id in c.source_tag_ids}
+    tags = {tag.id: tag for tag in Tag.query.filter(Tag.id.in_(tag_ids))}
+    example_ids = {c.example_segment_ids[0] for c in candidates if c.example_segment_ids}
+    examples = {
+        segment.id: segment for segment in
+        Segment.query.filter(Segment.id.in_(example_ids)).options(selectinload(Segment.session))
+    } if example_ids else {}
     
-    return list(set(keywords))  # 去重
+    candidate_key, source_key, search_type = ASSOCIATION_RESULT_FIELDS[relation]
+    results = []
+    for candidate in candidates:
+        tag = tags.get(candidate.tag_id)
+        if tag is None:
+            continue
+        example = examples.get(candidate.example_segment_ids[0]) if candidate.example_segment_ids else None
+        result = {
+            "candidate_tag": tag.to_dict(),
+            "support": candidate.support,
+            "strength": candidate.strength,
+            candidate_key: [tag.to_dict()],
+            source_key: [tags[tag_id].to_dict() for tag_id in candidate.source_tag_ids if tag_id in tags],
+            "example_segment_ids": candidate.example_segment_ids,
+            "segment_id": example.id if example else None,
+            "segment_title": example.title if example else None,
+            "segment_content_preview": (example.content[:100] + "...") if example and example.content else "",
+            "segment_type": example.segment_type if example else None,
+            "session_id": example.session_id if example else None,
+            "session_title": example.session.title if example and example.session else "N/A"
+        }
+        if smart:
+            result["search_type"] = search_type
+        results.append(result)
+    return results
+
+def ranked_location_tags(method_tag_id, limit=10):
+    """手法常用的施術位置，依物化關聯表的支持段落數排序"""
+    candidates = get_tag_association_store(app).lookup('method_to_location', [method_tag_id], limit)
+    tags = {tag.id: tag for tag in Tag.query.filter(Tag.id.in_([c.tag_id for c in candidates]))} if candidates else {}
+    return [tags[c.tag_id].to_dict() for c in candidates if c.tag_id in tags]
+
+def bounded_int_param(data, key, default, upper):
+    """讀取 JSON 中的整數參數並限制在 1..upper 之間；未提供時使用預設值，不是整數時拋出 ValueError"""
+    value = data.get(key)
+    if value is None or value == '':
+        return default
+    if isinstance(value, bool) or (isinstance(value, float) and not value.is_integer()):
+        raise ValueError(f"{key} 必須為整數")
+    try:
+        number = int(value)
+    except (TypeError, ValueError):
+        raise ValueError(f"{key} 必須為整數")
+    return max(1, min(number, upper))
+
+def general_tag_search(matched_tag_ids):
+    """列出帶有任一匹配標籤的段落"""
+    results = []
+    query = db.session.query(Segment).distinct().join(Segment.tags).filter(
+        Tag.id.in_(matched_tag_ids)
+    ).options(*_segment_hydration_options())
+    found_segments = query.all()
+    
+    for segment in found_segments:
+        matched_tags_info = []
+        for tag in segment.tags:
+            if tag.id in matched_tag_ids:
+                matched_tags_info.append(tag.to_dict())
+        
+        if matched_tags_info:
+            results.append({
+                "segment_id": segment.id,
+                "segment_title": segment.title,
+                "segment_content_preview": (segment.content[:100] + "...") if segment.content else "",
+                "session_id": segment.session_id,
+                "session_title": segment.session.title if segment.session else "N/A",
+                "matched_tags": matched_tags_info,
+                "search_type": "smart_general_search"
+            })
+    return results
 
 def execute_smart_search(matched_tags, context, original_query):
     """根據匹配的標籤執行搜索"""
@@ -1187,71 +1457,15 @@ def execute_smart_search(matched_tags, context, original_query):
     results = []
     matched_tag_ids = [tag.id for tag in matched_tags]
     
-    if context == 'symptom_to_cause':
-        # 症狀診斷搜索 - 使用任何匹配的標籤
-        query = db.session.query(Segment).distinct().join(Segment.tags).filter(
-            Tag.id.in_(matched_tag_ids)
-        )
-        
-        found_segments = query.all()
-        
-        for segment in found_segments:
-            potential_cause_tags = []
-            matched_symptoms = []
-            
-            for tag in segment.tags:
-                if tag.category == '病因':
-                    potential_cause_tags.append(tag.to_dict())
-                if tag.id in matched_tag_ids:
-                    matched_symptoms.append(tag.to_dict())
-            
-            if segment.session:
-                for tag in segment.session.tags:
-                    if tag.category == '病因' and not any(pct['id'] == tag.id for pct in potential_cause_tags):
-                        potential_cause_tags.append(tag.to_dict())
-            
-            if potential_cause_tags or matched_symptoms:
-                results.append({
-                    "segment_id": segment.id,
-                    "segment_title": segment.title,
-                    "segment_content_preview": (segment.content[:100] + "...") if segment.content else "",
-                    "session_id": segment.session_id,
-                    "session_title": segment.session.title if segment.session else "N/A",
-                    "potential_cause_tags": potential_cause_tags,
-                    "matched_symptoms": matched_symptoms,
-                    "search_type": "smart_symptom_diagnosis"
-                })
-    
-    elif context == 'cause_to_treatment':
-        # 治療方案搜索 - 使用任何匹配的標籤
-        query = db.session.query(Segment).distinct().join(Segment.tags).filter(
-            Tag.id.in_(matched_tag_ids)
-        )
-        
-        found_segments = query.all()
-        
-        for segment in found_segments:
-            potential_treatment_tags = []
-            matched_causes = []
-            
-            for tag in segment.tags:
-                if tag.category in ['治療', '手法']:
-                    potential_treatment_tags.append(tag.to_dict())
-                if tag.id in matched_tag_ids:
-                    matched_causes.append(tag.to_dict())
-            
-            if potential_treatment_tags or segment.segment_type == '治療' or matched_causes:
-                results.append({
-                    "segment_id": segment.id,
-                    "segment_title": segment.title,
-                    "segment_content_preview": (segment.content[:100] + "...") if segment.content else "",
-                    "segment_type": segment.segment_type,
-                    "session_id": segment.session_id,
-                    "session_title": segment.session.title if segment.session else "N/A",
-                    "potential_treatment_tags": potential_treatment_tags,
-                    "matched_causes": matched_causes,
-                    "search_type": "smart_treatment_search"
-                })
+    if context in ASSOCIATION_RESULT_FIELDS:
+        # 症狀診斷 / 治療方案搜索：以匹配標籤中屬於來源分類者查詢物化關聯表
+        source_categories = ASSOCIATION_RULES[context].source_categories
+        source_tag_ids = [tag.id for tag in matched_tags if tag.category in source_categories]
+        if source_tag_ids:
+            results = association_search(context, source_tag_ids, smart=True)
+        if not results:
+            # 沒有可作為來源的標籤或沒有關聯時，列出帶有匹配標籤的段落
+            results = general_tag_search(matched_tag_ids)
     
     elif context == 'method_analysis':
         # 手法分析搜索 - 使用匹配的手法標籤
@@ -1260,8 +1474,9 @@ def execute_smart_search(matched_tags, context, original_query):
         if method_tags:
             method_tag = method_tags[0]  # 使用第一個匹配的手法
             
-            segments_using_method = Segment.query.join(Segment.tags).filter(Tag.id == method_tag.id).all()
-            unique_symptom_tags, unique_cause_tags, unique_location_tags = {}, {}, {}
+            segments_using_method = Segment.query.join(Segment.tags).filter(Tag.id == method_tag.id)\
+                .options(*_segment_hydration_options()).all()
+            unique_symptom_tags, unique_cause_tags = {}, {}
             
             for seg in segments_using_method:
                 for tag in seg.tags:
@@ -1269,8 +1484,6 @@ def execute_smart_search(matched_tags, context, original_query):
                         unique_symptom_tags[tag.id] = tag
                     elif tag.category == '病因':
                         unique_cause_tags[tag.id] = tag
-                    elif tag.category in ['位置', '施術位置', '治療位置']:
-                        unique_location_tags[tag.id] = tag
             
             results.append({
                 "method_name": method_tag.name,
@@ -1278,7 +1491,7 @@ def execute_smart_search(matched_tags, context, original_query):
                 "description": method_tag.description,
                 "applicable_symptoms": [t.to_dict() for t in unique_symptom_tags.values()],
                 "treated_causes": [t.to_dict() for t in unique_cause_tags.values()],
-                "common_locations": [t.to_dict() for t in unique_location_tags.values()],
+                "common_locations": ranked_location_tags(method_tag.id),
                 "example_segments": [{
                     "segment_id": s.id,
                     "segment_title": s.title,
@@ -1289,27 +1502,7 @@ def execute_smart_search(matched_tags, context, original_query):
             })
         else:
             # 如果沒有手法標籤，但有其他相關標籤，嘗試通用搜索
-            query = db.session.query(Segment).distinct().join(Segment.tags).filter(
-                Tag.id.in_(matched_tag_ids)
-            )
-            found_segments = query.all()
-            
-            for segment in found_segments:
-                matched_tags_info = []
-                for tag in segment.tags:
-                    if tag.id in matched_tag_ids:
-                        matched_tags_info.append(tag.to_dict())
-                
-                if matched_tags_info:
-                    results.append({
-                        "segment_id": segment.id,
-                        "segment_title": segment.title,
-                        "segment_content_preview": (segment.content[:100] + "...") if segment.content else "",
-                        "session_id": segment.session_id,
-                        "session_title": segment.session.title if segment.session else "N/A",
-                        "matched_tags": matched_tags_info,
-                        "search_type": "smart_general_search"
-                    })
+            results = general_tag_search(matched_tag_ids)
     
     return results
 
@@ -1363,42 +1556,15 @@ def search():
                 
                 if not symptom_tag_names: 
                     return jsonify({'results': [], 'message': 'Please provide at least one symptom tag.'})
-                    
-                query = db.session.query(Segment).distinct().join(Segment.tags).filter(
-                    Tag.category == '症狀', 
-                    Tag.name.in_(symptom_tag_names)
-                )
                 
-                if location_name: 
-                    query = query.filter(
-                        Segment.tags.any(and_(Tag.category == '位置', Tag.name.contains(location_name)))
-                    )
-                    
-                found_segments = query.all()
-                
-                for segment in found_segments:
-                    potential_cause_tags, matched_symptoms_on_segment = [], []
-                    for tag in segment.tags:
-                        if tag.category == '病因': 
-                            potential_cause_tags.append(tag.to_dict())
-                        if tag.name in symptom_tag_names and tag.category == '症狀': 
-                            matched_symptoms_on_segment.append(tag.to_dict())
-                            
-                    if segment.session:
-                        for tag in segment.session.tags:
-                            if tag.category == '病因' and not any(pct['id'] == tag.id for pct in potential_cause_tags):
-                                potential_cause_tags.append(tag.to_dict())
-                                
-                    if potential_cause_tags: 
-                        results.append({
-                            "segment_id": segment.id, 
-                            "segment_title": segment.title,
-                            "segment_content_preview": (segment.content[:100] + "...") if segment.content else "",
-                            "session_id": segment.session_id, 
-                            "session_title": segment.session.title if segment.session else "N/A",
-                            "potential_cause_tags": potential_cause_tags, 
-                            "matched_symptoms": matched_symptoms_on_segment
-                        })
+                symptom_tag_ids = [tag_id for (tag_id,) in db.session.query(Tag.id).filter(
+                    Tag.category == '症狀', Tag.name.in_(symptom_tag_names)
+                )]
+                # 位置條件下推為段落範圍：只統計帶有該位置標籤的段落，回應格式與無條件時相同
+                segment_ids = db.session.query(Segment.id).filter(
+                    Segment.tags.any(and_(Tag.category == '位置', Tag.name.contains(location_name)))
+                ) if location_name else None
+                results = association_search('symptom_to_cause', symptom_tag_ids, segment_ids=segment_ids)
                 
             elif query_type == 'cause_to_treatment':
                 cause_tag_names = data.get('cause_tags', [])
@@ -1406,37 +1572,15 @@ def search():
                 
                 if not cause_tag_names: 
                     return jsonify({'results': [], 'message': 'Please provide at least one cause tag.'})
-                    
-                query = db.session.query(Segment).distinct().join(Segment.tags).filter(
-                    Tag.category == '病因', 
-                    Tag.name.in_(cause_tag_names)
-                )
                 
-                if preferred_domain_name:
-                    query = query.join(Session, Segment.session_id == Session.id)\
-                                 .filter(Session.tags.any(and_(Tag.category == '領域', Tag.name == preferred_domain_name)))
-                                 
-                found_segments = query.all()
-                
-                for segment in found_segments:
-                    potential_treatment_tags, matched_causes_on_segment = [], []
-                    for tag in segment.tags:
-                        if tag.category in ['治療', '手法']: 
-                            potential_treatment_tags.append(tag.to_dict())
-                        if tag.name in cause_tag_names and tag.category == '病因': 
-                            matched_causes_on_segment.append(tag.to_dict())
-                            
-                    if potential_treatment_tags or segment.segment_type == '治療':
-                        results.append({
-                            "segment_id": segment.id, 
-                            "segment_title": segment.title,
-                            "segment_content_preview": (segment.content[:100] + "...") if segment.content else "",
-                            "segment_type": segment.segment_type, 
-                            "session_id": segment.session_id,
-                            "session_title": segment.session.title if segment.session else "N/A",
-                            "potential_treatment_tags": potential_treatment_tags, 
-                            "matched_causes": matched_causes_on_segment
-                        })
+                cause_tag_ids = [tag_id for (tag_id,) in db.session.query(Tag.id).filter(
+                    Tag.category == '病因', Tag.name.in_(cause_tag_names)
+                )]
+                # 領域條件下推為段落範圍：只統計所屬課程帶有該領域標籤的段落
+                segment_ids = db.session.query(Segment.id).join(Session, Segment.session_id == Session.id).filter(
+                    Session.tags.any(and_(Tag.category == '領域', Tag.name == preferred_domain_name))
+                ) if preferred_domain_name else None
+                results = association_search('cause_to_treatment', cause_tag_ids, segment_ids=segment_ids)
             
             elif query_type == 'method_analysis':
                 method_name = data.get('method_name', None)
@@ -1447,8 +1591,9 @@ def search():
                 if not method_tag: 
                     return jsonify({'results': [], 'message': f"Method tag '{method_name}' not found."})
                     
-                segments_using_method = Segment.query.join(Segment.tags).filter(Tag.id == method_tag.id).all()
-                unique_symptom_tags, unique_cause_tags, unique_cooccurring_methods, unique_location_tags = {}, {}, {}, {}
+                segments_using_method = Segment.query.join(Segment.tags).filter(Tag.id == method_tag.id)\
+                    .options(*_segment_hydration_options()).all()
+                unique_symptom_tags, unique_cause_tags, unique_cooccurring_methods = {}, {}, {}
                 
                 for seg in segments_using_method:
                     for tag in seg.tags:
@@ -1458,8 +1603,6 @@ def search():
                             unique_cause_tags[tag.id] = tag
                         elif tag.category == '手法' and tag.id != method_tag.id: 
                             unique_cooccurring_methods[tag.id] = tag
-                        elif tag.category == '位置': 
-                            unique_location_tags[tag.id] = tag
                             
                 results.append({
                     "method_name": method_tag.name, 
@@ -1467,7 +1610,7 @@ def search():
                     "description": method_tag.description,
                     "applicable_symptoms": [t.to_dict() for t in unique_symptom_tags.values()],
                     "treated_causes": [t.to_dict() for t in unique_cause_tags.values()],
-                    "common_locations": [t.to_dict() for t in unique_location_tags.values()],
+                    "common_locations": ranked_location_tags(method_tag.id),
                     "related_methods": [t.to_dict() for t in unique_cooccurring_methods.values()],
                     "example_segments": [{
                         "segment_id": s.id, 
@@ -1479,13 +1622,21 @@ def search():
             
             elif query_type == 'relation_map':
                 start_point = data.get('start_point', None)
-                depth = data.get('depth', 2)
+                try:
+                    depth = bounded_int_param(data, 'depth', 2, GRAPH_MAX_DEPTH)
+                    max_nodes = bounded_int_param(data, 'max_nodes', GRAPH_MAX_NODES, GRAPH_MAX_NODES * 4)
+                    max_links = bounded_int_param(data, 'max_links', GRAPH_MAX_LINKS, GRAPH_MAX_LINKS * 4)
+                except ValueError as e:
+                    return jsonify({'results': [], 'error': str(e)}), 400
+                layout = data.get('layout') or DEFAULT_LAYOUT
+                if layout not in LAYOUT_METHODS:
+                    return jsonify({'results': [], 'error': f"layout 必須為 {' / '.join(LAYOUT_METHODS)}"}), 400
                 
                 if not start_point:
                     return jsonify({'results': [], 'message': 'Please provide a start point.'})
                 
                 # 構建關聯圖數據
-                graph_data = build_relation_graph(start_point, depth)
+                graph_data = build_relation_graph(start_point, depth, max_nodes, max_links, layout)
                 return jsonify(graph_data)
 
             return jsonify({'results': results})
@@ -1688,13 +1839,20 @@ def batch_add_tags():
         
         # 批量添加標籤到段落
         added_count = 0
+        now = datetime.utcnow()
         for segment in segments:
+            tagged = False
             for tag in processed_tags:
                 if tag not in segment.tags:
                     segment.tags.append(tag)
+                    segment.updated_at = now
                     added_count += 1
+                    tagged = True
+            if tagged:
+                queue_vector_index('segment', segment.id)
         
         db.session.commit()
+        notify_vector_index()
         
         return jsonify({
             'success': True,
@@ -1737,10 +1895,13 @@ def batch_delete_segments():
                     print(f"Error deleting file {attachment.filename}: {str(e)}")
                 db.session.delete(attachment)
             
+            # 同一批事件由索引工作線程合併為一次刪除
+            queue_vector_index('segment', segment.id, 'delete')
             db.session.delete(segment)
             deleted_count += 1
         
         db.session.commit()
+        notify_vector_index()
         
         return jsonify({
             'success': True,
@@ -1848,13 +2009,9 @@ def batch_operations_page():
     return render_template('batch_operations.html')
 
 # 關聯圖譜構建函數
-def build_relation_graph(start_point, depth=2):
-    """構建關聯圖譜數據"""
+def build_relation_graph(start_point, depth=2, max_nodes=None, max_links=None, layout=None):
+    """構建關聯圖譜數據（max_nodes / max_links 為節點與連線數上限，layout 為伺服器端佈局方式）"""
     try:
-        nodes = {}  # 存儲節點，避免重複
-        links = []  # 存儲連接
-        visited = set()  # 已處理的節點
-        
         # 查找起始點
         start_tag = Tag.query.filter(
             or_(Tag.name.contains(start_point), Tag.name == start_point)
@@ -1887,175 +2044,24 @@ def build_relation_graph(start_point, depth=2):
                 
             start_tag = start_tags[0]  # 使用第一個標籤作為起始點
         
-        # 構建圖譜
-        def add_node(tag, node_type='tag', level=0):
-            node_id = f"{node_type}_{tag.id}"
-            if node_id not in nodes:
-                nodes[node_id] = {
-                    'id': node_id,
-                    'name': tag.name,
-                    'category': tag.category,
-                    'color': tag.color or CATEGORY_COLORS.get(tag.category, '#6c757d'),
-                    'type': node_type,
-                    'level': level,
-                    'size': 10 + level * 5  # 節點大小隨層級變化
-                }
-            return node_id
-        
-        def add_link(source_id, target_id, relation_type, strength=1.0):
-            link_id = f"{source_id}_{target_id}"
-            reverse_link_id = f"{target_id}_{source_id}"
-            
-            # 避免重複連接
-            if not any(l['id'] == link_id or l['id'] == reverse_link_id for l in links):
-                links.append({
-                    'id': link_id,
-                    'source': source_id,
-                    'target': target_id,
-                    'relation_type': relation_type,
-                    'strength': strength,
-                    'value': strength * 10  # 用於可視化中的連線粗細
-                })
-        
-        def explore_relations(tag, current_depth, max_depth):
-            if current_depth > max_depth or tag.id in visited:
-                return
-            
-            visited.add(tag.id)
-            current_node_id = add_node(tag, 'tag', current_depth)
-            
-            # 查找與此標籤共現的其他標籤
-            related_tags = find_related_tags(tag)
-            
-            for related_tag, relation_info in related_tags.items():
-                if related_tag.id != tag.id:
-                    related_node_id = add_node(related_tag, 'tag', current_depth + 1)
-                    add_link(
-                        current_node_id, 
-                        related_node_id, 
-                        relation_info['type'],
-                        relation_info['strength']
-                    )
-                    
-                    # 遞迴探索下一層
-                    if current_depth < max_depth:
-                        explore_relations(related_tag, current_depth + 1, max_depth)
-        
-        def find_related_tags(tag):
-            """找到與指定標籤相關的標籤"""
-            related_tags = {}
-            
-            # 1. 在同一段落中共現的標籤
-            segments_with_tag = Segment.query.join(Segment.tags).filter(Tag.id == tag.id).all()
-            
-            for segment in segments_with_tag:
-                for other_tag in segment.tags:
-                    if other_tag.id != tag.id:
-                        if other_tag not in related_tags:
-                            related_tags[other_tag] = {
-                                'type': get_relation_type(tag, other_tag),
-                                'strength': 0.1,
-                                'co_occurrence': 0
-                            }
-                        related_tags[other_tag]['co_occurrence'] += 1
-                        related_tags[other_tag]['strength'] += 0.1
-            
-            # 2. 在同一課程中的標籤
-            sessions_with_tag = Session.query.join(Session.tags).filter(Tag.id == tag.id).all()
-            
-            for session in sessions_with_tag:
-                for other_tag in session.tags:
-                    if other_tag.id != tag.id:
-                        if other_tag not in related_tags:
-                            related_tags[other_tag] = {
-                                'type': get_relation_type(tag, other_tag),
-                                'strength': 0.05,
-                                'co_occurrence': 0
-                            }
-                        related_tags[other_tag]['strength'] += 0.05
-            
-            # 3. 根據分類關係
-            same_category_tags = Tag.query.filter(
-                Tag.category == tag.category,
-                Tag.id != tag.id
-            ).limit(3).all()
-            
-            for other_tag in same_category_tags:
-                if other_tag not in related_tags:
-                    related_tags[other_tag] = {
-                        'type': 'same_category',
-                        'strength': 0.3,
-                        'co_occurrence': 0
-                    }
-            
-            # 4. 特定關係邏輯
-            if tag.category == '症狀':
-                # 症狀 -> 病因 -> 治療
-                cause_tags = find_tags_by_pattern(tag, '病因')
-                for cause_tag in cause_tags:
-                    related_tags[cause_tag] = {
-                        'type': 'symptom_to_cause',
-                        'strength': 0.8,
-                        'co_occurrence': 0
-                    }
-                    
-            elif tag.category == '病因':
-                # 病因 -> 治療方法
-                treatment_tags = find_tags_by_pattern(tag, '手法')
-                for treatment_tag in treatment_tags:
-                    related_tags[treatment_tag] = {
-                        'type': 'cause_to_treatment',
-                        'strength': 0.7,
-                        'co_occurrence': 0
-                    }
-            
-            return related_tags
-        
-        def get_relation_type(tag1, tag2):
-            """根據標籤分類確定關係類型"""
-            if tag1.category == '症狀' and tag2.category == '病因':
-                return 'symptom_to_cause'
-            elif tag1.category == '病因' and tag2.category == '手法':
-                return 'cause_to_treatment'
-            elif tag1.category == '手法' and tag2.category == '位置':
-                return 'method_to_location'
-            elif tag1.category == tag2.category:
-                return 'same_category'
-            else:
-                return 'co_occurrence'
-        
-        def find_tags_by_pattern(source_tag, target_category):
-            """找到與源標籤在同一段落中出現的特定分類標籤"""
-            segments = Segment.query.join(Segment.tags).filter(Tag.id == source_tag.id).all()
-            found_tags = []
-            
-            for segment in segments:
-                for tag in segment.tags:
-                    if tag.category == target_category and tag not in found_tags:
-                        found_tags.append(tag)
-            
-            return found_tags[:5]  # 限制數量
-        
-        # 開始構建圖譜
-        explore_relations(start_tag, 0, depth)
-        
-        # 轉換為前端需要的格式
-        nodes_list = list(nodes.values())
-        
-        # 計算節點的重要性（連接數）
-        for node in nodes_list:
-            connections = len([link for link in links if link['source'] == node['id'] or link['target'] == node['id']])
-            node['importance'] = connections
-            node['size'] = max(10, min(30, 10 + connections * 2))
-        
-        return {
-            'nodes': nodes_list,
-            'links': links,
-            'center_node': f"tag_{start_tag.id}",
-            'total_nodes': len(nodes_list),
-            'total_links': len(links),
-            'max_depth': depth
-        }
+        # 關聯來自記憶體中的標籤共現矩陣；以最佳優先順序展開，節點與連線數有上限
+        max_nodes = max_nodes or GRAPH_MAX_NODES
+        max_links = max_links or GRAPH_MAX_LINKS
+        layout = layout or DEFAULT_LAYOUT
+        graph_cache = get_relation_graph_cache(app)
+        graph_data, age = graph_cache.get_or_build(
+            start_tag.id, depth, max_nodes, max_links,
+            lambda: layout_graph(
+                build_tag_graph(graph_cache.cooccurrence, start_tag.id, depth,
+                                max_nodes=max_nodes, max_links=max_links,
+                                default_colors=CATEGORY_COLORS),
+                layout
+            ),
+            layout=layout
+        )
+        if age is None:
+            return {**graph_data, 'cached': False}
+        return {**graph_data, 'cached': True, 'cache_age_seconds': round(age, 3)}
         
     except Exception as e:
         logger.error(f"構建關聯圖失敗: {e}")
@@ -2180,16 +2186,7 @@ def save_llm_course():
         # 保存課程
         from llm_service import LLMCourseService
         session_id = LLMCourseService.save_processed_course(data, course_info)
-        
-        # 自動同步到向量數據庫（如果啟用）
-        if VECTOR_SEARCH_ENABLED:
-            try:
-                chroma_manager = get_chroma_manager()
-                session = Session.query.get(session_id)
-                if session:
-                    chroma_manager.add_session(session)
-            except Exception as e:
-                logger.warning(f"向量數據庫同步失敗: {e}")
+        notify_vector_index()
         
         return jsonify({
             'success': True,
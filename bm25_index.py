@@ -0,0 +1,466 @@
+"""
+BM25 倒排索引模組
+在進程內以 jieba 分詞建立課程（標題 + 概述）與段落（標題 + 內容）的倒排索引，
+不依賴 SQLite 的 FTS5 編譯選項。
+
+- 倒排列表以 array 儲存（文檔序號 uint32、詞頻 uint16），記憶體緊湊
+- 透過 change_tracking 的提交通知增量更新；刪除先標記，累積到一定比例後壓縮
+- 定期快照到磁碟，重啟時載入快照並只補上快照之後的變更
+"""
+
+import os
+import math
+import atexit
+import time
+import heapq
+import pickle
+import hashlib
+import logging
+import threading
+import queue
+from array import array
+from collections import Counter
+from datetime import datetime, timedelta
+from typing import Any, Dict, List, Optional, Tuple
+
+import jieba
+
+from change_tracking import ChangeSet, bump_data_version, subscribe
+from fulltext_service import _WORD_PATTERN, search_rows
+from models import Session, Segment, db
+
+logger = logging.getLogger(__name__)
+
+# 關鍵字搜尋引擎：fts（SQLite FTS5，預設）/ bm25（進程內倒排索引）
+KEYWORD_SEARCH_ENGINE = os.environ.get('KEYWORD_SEARCH_ENGINE', 'fts')
+BM25_INDEX_PATH = os.environ.get('BM25_INDEX_PATH', './chroma_db/bm25_index.pickle')
+# 累積多少筆變更後寫入快照
+BM25_SNAPSHOT_EVERY = int(os.environ.get('BM25_SNAPSHOT_EVERY', 200))
+# 沒有達到變更數時，最長多久寫入一次快照（秒）
+BM25_SNAPSHOT_INTERVAL = float(os.environ.get('BM25_SNAPSHOT_INTERVAL', 300))
+
+# 快照格式版本；修改索引結構或分詞規則時需遞增
+SNAPSHOT_FORMAT = 1
+# 標題中的詞計入詞頻的倍數
+TITLE_WEIGHT = 2
+# 已刪除文檔佔比超過此值時壓縮倒排列表
+COMPACT_RATIO = 0.2
+
+CONTENT_TYPES = ('session', 'segment')
+
+
+def tokenize(value: Optional[str]) -> List[str]:
+    """以 jieba 搜尋引擎模式分詞，轉為小寫並去除標點"""
+    if not value:
+        return []
+    return [token.lower() for token in jieba.cut_for_search(value) if _WORD_PATTERN.search(token)]
+
+
+class BM25Index:
+    """以 array 儲存倒排列表的 BM25 索引（執行緒安全）"""
+
+    def __init__(self, k1: float = 1.5, b: float = 0.75):
+        self.k1 = k1
+        self.b = b
+        self._lock = threading.RLock()
+        self._reset()
+
+    def _reset(self):
+        # 文檔序號 -> 內容類型代碼、資料列 ID、長度、包含的詞
+        self._doc_type = array('B')
+        self._doc_row = array('I')
+        self._doc_len = array('I')
+        self._doc_terms: List[Optional[array]] = []
+        self._alive = array('B')
+        # (內容類型, 資料列 ID) -> 文檔序號 / 內容雜湊
+        self._doc_of: Dict[Tuple[str, int], int] = {}
+        self._doc_hash: Dict[Tuple[str, int], str] = {}
+        # 詞 -> 詞序號；詞序號 -> 倒排列表與文檔頻率
+        self._term_of: Dict[str, int] = {}
+        self._post_docs: List[array] = []
+        self._post_tfs: List[array] = []
+        self._df = array('I')
+        self._total_len = 0
+        self._deleted = 0
+
+    def __len__(self) -> int:
+        return len(self._doc_of)
+
+    def add(self, content_type: str, row_id: int, title: Optional[str], body: Optional[str]):
+        """新增或更新文檔；內容未變時不做任何事"""
+        key = (content_type, row_id)
+        digest = hashlib.sha1(f"{title or ''}\x00{body or ''}".encode('utf-8')).hexdigest()
+
+        with self._lock:
+            if self._doc_hash.get(key) == digest:
+                return
+            self._remove(key)
+
+            counts = Counter(tokenize(body))
+            for token in tokenize(title):
+                counts[token] += TITLE_WEIGHT
+            if not counts:
+                return
+
+            doc = len(self._doc_row)
+            self._doc_type.append(CONTENT_TYPES.index(content_type))
+            self._doc_row.append(row_id)
+            self._doc_len.append(sum(counts.values()))
+            self._alive.append(1)
+            term_ids = array('I')
+            for term, tf in counts.items():
+                term_id = self._term_of.get(term)
+                if term_id is None:
+                    term_id = self._term_of[term] = len(self._post_docs)
+                    self._post_docs.append(array('I'))
+                    self._post_tfs.append(array('H'))
+                    self._df.append(0)
+                self._post_docs[term_id].append(doc)
+                self._post_tfs[term_id].append(min(tf, 65535))
+                self._df[term_id] += 1
+                term_ids.append(term_id)
+            self._doc_terms.append(term_ids)
+
+            self._doc_of[key] = doc
+            self._doc_hash[key] = digest
+            self._total_len += self._doc_len[doc]
+
+    def remove(self, content_type: str, row_id: int):
+        with self._lock:
+            self._remove((content_type, row_id))
+            if self._deleted > COMPACT_RATIO * max(1, len(self._doc_row)):
+                self.compact()
+
+    def _remove(self, key: Tuple[str, int]):
+        doc = self._doc_of.pop(key, None)
+        self._doc_hash.pop(key, None)
+        if doc is None:
+            return
+        for term_id in self._doc_terms[doc]:
+            self._df[term_id] -= 1
+        self._total_len -= self._doc_len[doc]
+        self._doc_terms[doc] = None
+        self._alive[doc] = 0
+        self._deleted += 1
+
+    def compact(self):
+        """移除倒排列表中已刪除的文檔並重新編號"""
+        with self._lock:
+            remap = {}
+            for old_doc in range(len(self._doc_row)):
+                if self._alive[old_doc]:
+                    remap[old_doc] = len(remap)
+
+            for term_id in range(len(self._post_docs)):
+                docs, tfs = array('I'), array('H')
+                for doc, tf in zip(self._post_docs[term_id], self._post_tfs[term_id]):
+                    new_doc = remap.get(doc)
+                    if new_doc is not None:
+                        docs.append(new_doc)
+                        tfs.append(tf)
+                self._post_docs[term_id] = docs
+                self._post_tfs[term_id] = tfs
+
+            keep = list(remap)
+            self._doc_type = array('B', (self._doc_type[doc] for doc in keep))
+            self._doc_row = array('I', (self._doc_row[doc] for doc in keep))
+            self._doc_len = array('I', (self._doc_len[doc] for doc in keep))
+            self._doc_terms = [self._doc_terms[doc] for doc in keep]
+            self._alive = array('B', [1]) * len(keep)
+            self._doc_of = {key: remap[doc] for key, doc in self._doc_of.items()}
+            self._deleted = 0
+
+    def search(self, query: str, limit: int = 10,
+               content_type: Optional[str] = None) -> List[Tuple[str, int, float]]:
+        """
+        BM25 檢索
+
+        Returns:
+            [(內容類型, 資料列 ID, 分數)]，分數以最佳結果為 1.0 正規化，供排名融合使用
+        """
+        terms = set(tokenize(query))
+        type_code = CONTENT_TYPES.index(content_type) if content_type else None
+
+        with self._lock:
+            live = len(self._doc_of)
+            if not terms or not live:
+                return []
+            avgdl = self._total_len / live
+            k1, b = self.k1, self.b
+
+            scores: Dict[int, float] = {}
+            for term in terms:
+                term_id = self._term_of.get(term)
+                if term_id is None or not self._df[term_id]:
+                    continue
+                df = self._df[term_id]
+                idf = math.log(1 + (live - df + 0.5) / (df + 0.5))
+                for doc, tf in zip(self._post_docs[term_id], self._post_tfs[term_id]):
+                    if not self._alive[doc] or (type_code is not None and self._doc_type[doc] != type_code):
+                        continue
+                    norm = k1 * (1 - b + b * self._doc_len[doc] / avgdl)
+                    scores[doc] = scores.get(doc, 0.0) + idf * tf * (k1 + 1) / (tf + norm)
+
+            top = heapq.nlargest(limit, scores.items(), key=lambda item: item[1])
+            best = top[0][1] if top else 0.0
+            return [
+                (CONTENT_TYPES[self._doc_type[doc]], self._doc_row[doc], round(score / best, 4) if best else 0.0)
+                for doc, score in top
+            ]
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            postings = sum(len(docs) for docs in self._post_docs)
+            return {
+                "documents": len(self._doc_of),
+                "terms": len(self._term_of),
+                "postings": postings,
+                "deleted": self._deleted,
+                # 倒排列表本體：每筆 4 位元組文檔序號 + 2 位元組詞頻
+                "postings_mb": round(postings * 6 / (1024 * 1024), 2)
+            }
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        del state['_lock']
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._lock = threading.RLock()
+
+
+class KeywordIndexService:
+    """
+    BM25 索引的背景維護者
+
+    啟動時載入快照（或從資料庫全量建立），之後在背景線程中套用提交通知的變更，
+    並定期寫入快照。
+    """
+
+    def __init__(self, app, path: str = BM25_INDEX_PATH):
+        self.app = app
+        self.path = path
+        self.index = BM25Index()
+        self.state = "idle"  # idle / loading / ready / failed
+        self.load_seconds: Optional[float] = None
+        self.last_snapshot_at: Optional[datetime] = None
+        self.error: Optional[str] = None
+
+        self._changes: "queue.Queue[ChangeSet]" = queue.Queue()
+        self._pending_changes = 0
+        self._thread: Optional[threading.Thread] = None
+
+    def start(self):
+        if self._thread and self._thread.is_alive():
+            return
+        # 先訂閱再載入，載入期間的變更會在載入完成後補上
+        subscribe(self._on_change)
+        atexit.register(self._save_on_exit)
+        self._thread = threading.Thread(target=self._run, name="bm25-index", daemon=True)
+        self._thread.start()
+
+    def is_ready(self) -> bool:
+        return self.state == "ready"
+
+    def _on_change(self, changes: ChangeSet):
+        if changes.affects('session', 'segment'):
+            self._changes.put(changes)
+
+    def _run(self):
+        self.state = "loading"
+        started = time.perf_counter()
+        try:
+            with self.app.app_context():
+                self._load_or_build()
+            self.load_seconds = round(time.perf_counter() - started, 3)
+            self.state = "ready"
+            logger.info(f"BM25 索引就緒：{len(self.index)} 個文檔，耗時 {self.load_seconds} 秒")
+        except Exception as e:
+            self.state = "failed"
+            self.error = str(e)
+            logger.error(f"BM25 索引載入失敗: {e}")
+            return
+
+        last_snapshot = time.monotonic()
+        while True:
+            try:
+                changes = self._changes.get(timeout=BM25_SNAPSHOT_INTERVAL)
+            except queue.Empty:
+                changes = None
+
+            try:
+                with self.app.app_context():
+                    if changes is not None:
+                        self._apply(changes)
+                    due = time.monotonic() - last_snapshot >= BM25_SNAPSHOT_INTERVAL
+                    if self._pending_changes >= BM25_SNAPSHOT_EVERY or (due and self._pending_changes):
+                        self.save_snapshot()
+                        last_snapshot = time.monotonic()
+            except Exception as e:
+                self.error = str(e)
+                logger.error(f"BM25 索引更新失敗: {e}")
+
+    def _save_on_exit(self):
+        if self.is_ready() and self._pending_changes:
+            try:
+                self.save_snapshot()
+            except Exception as e:
+                logger.warning(f"結束時寫入 BM25 快照失敗: {e}")
+
+    def _apply(self, changes: ChangeSet):
+        """重新讀取變更的資料列並更新索引"""
+        for content_type, model, text_columns in (
+            ('session', Session, (Session.title, Session.overview)),
+            ('segment', Segment, (Segment.title, Segment.content))
+        ):
+            upserted = changes.ids(content_type)
+            found = set()
+            if upserted:
+                for row_id, title, body in db.session.query(model.id, *text_columns).filter(model.id.in_(upserted)):
+                    self.index.add(content_type, row_id, title, body)
+                    found.add(row_id)
+            for row_id in changes.ids(content_type, deleted=True) | (upserted - found):
+                self.index.remove(content_type, row_id)
+            self._pending_changes += len(upserted) + len(changes.ids(content_type, deleted=True))
+        db.session.remove()
+        # 索引在提交之後才更新，需讓先前快取的搜尋結果失效
+        bump_data_version()
+
+    def _load_or_build(self):
+        snapshot = self._read_snapshot()
+        if snapshot is None:
+            self.index = BM25Index()
+            self._index_rows(since=None)
+            self.save_snapshot()
+            return
+
+        # 快照之後的變更：新增或修改的資料列重新加入（內容未變時自動略過），已刪除的移除
+        self.index = snapshot["index"]
+        self._index_rows(since=snapshot["taken_at"] - timedelta(minutes=1))
+        for content_type, model in (('session', Session), ('segment', Segment)):
+            existing = {row_id for (row_id,) in db.session.query(model.id)}
+            indexed = {row_id for (kind, row_id) in list(self.index._doc_of) if kind == content_type}
+            for row_id in indexed - existing:
+                self.index.remove(content_type, row_id)
+            if existing - indexed:
+                self._index_rows(since=None, content_type=content_type, row_ids=existing - indexed)
+
+    def _index_rows(self, since: Optional[datetime], content_type: Optional[str] = None, row_ids=None):
+        for kind, model, text_columns in (
+            ('session', Session, (Session.title, Session.overview)),
+            ('segment', Segment, (Segment.title, Segment.content))
+        ):
+            if content_type and kind != content_type:
+                continue
+            query = db.session.query(model.id, *text_columns)
+            if since is not None:
+                query = query.filter(model.updated_at >= since)
+            if row_ids is not None:
+                query = query.filter(model.id.in_(row_ids))
+            for row_id, title, body in query.yield_per(1000):
+                self.index.add(kind, row_id, title, body)
+
+    def _read_snapshot(self) -> Optional[Dict[str, Any]]:
+        if not os.path.exists(self.path):
+            return None
+        try:
+            with open(self.path, 'rb') as f:
+                snapshot = pickle.load(f)
+            if snapshot.get("format") != SNAPSHOT_FORMAT:
+                logger.info("BM25 快照格式已變更，重新建立索引")
+                return None
+            return snapshot
+        except Exception as e:
+            logger.warning(f"讀取 BM25 快照失敗，重新建立索引: {e}")
+            return None
+
+    def save_snapshot(self):
+        """寫入快照（先寫暫存檔再替換，避免中斷時損壞）"""
+        taken_at = datetime.utcnow()
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        tmp_path = self.path + ".tmp"
+        with self.index._lock:
+            with open(tmp_path, 'wb') as f:
+                pickle.dump({"format": SNAPSHOT_FORMAT, "taken_at": taken_at, "index": self.index},
+                            f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp_path, self.path)
+        self._pending_changes = 0
+        self.last_snapshot_at = taken_at
+
+    def status(self) -> Dict[str, Any]:
+        return {
+            "state": self.state,
+            "load_seconds": self.load_seconds,
+            "pending_changes": self._changes.qsize(),
+            "unsaved_changes": self._pending_changes,
+            "last_snapshot_at": self.last_snapshot_at.isoformat() if self.last_snapshot_at else None,
+            "error": self.error,
+            **self.index.stats()
+        }
+
+
+# 有過濾條件時多取的候選倍數（過濾在 SQL 中進行）
+FILTER_OVERFETCH = 5
+
+
+def bm25_search_rows(index: BM25Index, model, query: str, limit: int, base_query=None) -> List[Tuple[Any, float]]:
+    """
+    與 fulltext_service.search_rows 相同介面的 BM25 版本
+
+    Returns:
+        [(模型實例, 相關度)]，依相關度排序
+    """
+    content_type = 'session' if model is Session else 'segment'
+    # 只有帶 WHERE 條件的查詢會排除候選；僅含 join / 載入選項時不需多取
+    filtered = base_query is not None and base_query.whereclause is not None
+    fetch = limit * FILTER_OVERFETCH if filtered else limit
+    hits = index.search(query, fetch, content_type)
+    if not hits:
+        return []
+
+    scores = {row_id: score for _, row_id, score in hits}
+    query_obj = base_query if base_query is not None else model.query
+    rows = {row.id: row for row in query_obj.filter(model.id.in_(list(scores)))}
+    ranked = [(rows[row_id], score) for _, row_id, score in hits if row_id in rows]
+    return ranked[:limit]
+
+
+# 全局實例（單例模式）
+_keyword_index_service: Optional[KeywordIndexService] = None
+_service_lock = threading.Lock()
+
+
+def start_keyword_index(app) -> Optional[KeywordIndexService]:
+    """啟用 BM25 關鍵字引擎時，在背景載入索引（重複呼叫無副作用）"""
+    global _keyword_index_service
+    if KEYWORD_SEARCH_ENGINE != 'bm25':
+        return None
+    with _service_lock:
+        if _keyword_index_service is None:
+            _keyword_index_service = KeywordIndexService(app)
+            _keyword_index_service.start()
+    return _keyword_index_service
+
+
+def get_bm25_index_if_ready() -> Optional[BM25Index]:
+    """索引已載入時返回 BM25Index，否則返回 None（呼叫端應退回 FTS / LIKE）"""
+    if _keyword_index_service is not None and _keyword_index_service.is_ready():
+        return _keyword_index_service.index
+    return None
+
+
+def get_keyword_index_status() -> Dict[str, Any]:
+    if _keyword_index_service is None:
+        return {"engine": KEYWORD_SEARCH_ENGINE, "state": "disabled" if KEYWORD_SEARCH_ENGINE != 'bm25' else "idle"}
+    return {"engine": KEYWORD_SEARCH_ENGINE, **_keyword_index_service.status()}
+
+
+def keyword_search_rows(model, query: str, limit: int, base_query=None) -> List[Tuple[Any, float]]:
+    """關鍵字搜尋入口：BM25 索引就緒時使用之，否則使用 SQLite 全文索引（或 LIKE）"""
+    index = get_bm25_index_if_ready()
+    if index is not None:
+        return bm25_search_rows(index, model, query, limit, base_query)
+    return search_rows(model, query, limit, base_query)
@@ -0,0 +1,86 @@
+"""
+快取工具模組
+提供執行緒安全、有容量與存活時間上限的 LRU 快取
+"""
+
+import time
+import threading
+from collections import OrderedDict
+from typing import Any, Dict, Hashable, Optional
+
+
+class LRUCache:
+    """執行緒安全的 LRU 快取，支援容量上限與 TTL（秒，None 表示不過期）"""
+
+    def __init__(self, max_size: int = 256, ttl: Optional[float] = None):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._data: "OrderedDict[Hashable, tuple]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: Hashable, default: Any = None) -> Any:
+        """讀取快取；未命中或已過期時返回 default"""
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is not None:
+                value, stored_at = entry
+                if self.ttl is None or time.monotonic() - stored_at <= self.ttl:
+                    self._data.move_to_end(key)
+                    self.hits += 1
+                    return value
+                del self._data[key]
+            self.misses += 1
+            return default
+
+    def get_with_age(self, key: Hashable) -> Optional[tuple]:
+        """讀取快取並返回 (value, 存放秒數)；未命中時返回 None"""
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is not None:
+                value, stored_at = entry
+                age = time.monotonic() - stored_at
+                if self.ttl is None or age <= self.ttl:
+                    self._data.move_to_end(key)
+                    self.hits += 1
+                    return value, age
+                del self._data[key]
+            self.misses += 1
+            return None
+
+    def set(self, key: Hashable, value: Any):
+        """寫入快取，超出容量時淘汰最久未使用的條目"""
+        with self._lock:
+            self._data[key] = (value, time.monotonic())
+            self._data.move_to_end(key)
+            while len(self._data) > self.max_size:
+                self._data.popitem(last=False)
+                self.evictions += 1
+
+    def invalidate(self, key: Hashable):
+        """移除單一條目"""
+        with self._lock:
+            self._data.pop(key, None)
+
+    def clear(self):
+        """清空快取"""
+        with self._lock:
+            self._data.clear()
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+    def stats(self) -> Dict[str, Any]:
+        """獲取快取統計"""
+        lookups = self.hits + self.misses
+        return {
+            "size": len(self._data),
+            "max_size": self.max_size,
+            "ttl_seconds": self.ttl,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+            "evictions": self.evictions
+        }
@@ -0,0 +1,184 @@
+"""
+資料變更追蹤模組
+監聽 SQLAlchemy 的 flush / commit 事件，收集每個交易中新增、修改、刪除的課程、段落和標籤，
+提交成功後遞增全域資料版本號並通知訂閱者（記憶體索引、結果快取等），回滾時丟棄。
+只記錄變更的資料列 ID，訂閱者需要內容時應自行重新讀取
+"""
+
+import logging
+import threading
+from dataclasses import dataclass, field
+from typing import Callable, Dict, Iterable, List, Set
+
+from sqlalchemy import event
+from sqlalchemy.orm import Session as OrmSession
+
+from models import Session, Segment, Tag
+
+logger = logging.getLogger(__name__)
+
+# 追蹤的模型與其實體類型名稱
+TRACKED_MODELS = {Session: 'session', Segment: 'segment', Tag: 'tag'}
+
+_PENDING_KEY = 'pending_changes'
+
+
+@dataclass
+class ChangeSet:
+    """一個已提交交易中的資料變更"""
+    upserted: Dict[str, Set[int]] = field(default_factory=dict)
+    deleted: Dict[str, Set[int]] = field(default_factory=dict)
+    # 以 Query.update / Query.delete 批量修改、無法得知資料列 ID 的實體類型
+    bulk: Set[str] = field(default_factory=set)
+    # 其中以 Query.delete 批量刪除的實體類型（關聯表資料列可能一併消失）
+    bulk_deleted: Set[str] = field(default_factory=set)
+    # 批量修改寫入的欄位；'*' 表示無法得知
+    bulk_columns: Dict[str, Set[str]] = field(default_factory=dict)
+    version: int = 0
+
+    def upsert(self, entity_type: str, entity_id: int):
+        self.upserted.setdefault(entity_type, set()).add(entity_id)
+        self.deleted.get(entity_type, set()).discard(entity_id)
+
+    def delete(self, entity_type: str, entity_id: int):
+        self.deleted.setdefault(entity_type, set()).add(entity_id)
+        self.upserted.get(entity_type, set()).discard(entity_id)
+
+    def is_empty(self) -> bool:
+        return not (any(self.upserted.values()) or any(self.deleted.values()) or self.bulk)
+
+    def ids(self, entity_type: str, deleted: bool = False) -> Set[int]:
+        return (self.deleted if deleted else self.upserted).get(entity_type, set())
+
+    def bulk_touches(self, entity_type: str, columns: Iterable[str]) -> bool:
+        """批量修改或刪除是否可能改變此實體類型的這些欄位"""
+        if entity_type not in self.bulk:
+            return False
+        if entity_type in self.bulk_deleted:
+            return True
+        touched = self.bulk_columns.get(entity_type, {'*'})
+        return '*' in touched or not touched.isdisjoint(columns)
+
+    def affects(self, *entity_types: str) -> bool:
+        """變更是否涉及指定的實體類型"""
+        return any(
+            self.upserted.get(entity_type) or self.deleted.get(entity_type) or entity_type in self.bulk
+            for entity_type in entity_types
+        )
+
+
+_subscribers: List[Callable[[ChangeSet], None]] = []
+_version_lock = threading.Lock()
+_data_version = 0
+
+
+def subscribe(callback: Callable[[ChangeSet], None]):
+    """登記提交後的變更通知（在提交的線程中同步呼叫，回呼應盡快返回）"""
+    if callback not in _subscribers:
+        _subscribers.append(callback)
+
+
+def unsubscribe(callback: Callable[[ChangeSet], None]):
+    if callback in _subscribers:
+        _subscribers.remove(callback)
+
+
+def get_data_version() -> int:
+    """全域資料版本號：每次修改課程、段落或標籤的提交都會遞增"""
+    return _data_version
+
+
+def bump_data_version() -> int:
+    """手動遞增資料版本號（例如以原生 SQL 修改資料後）"""
+    global _data_version
+    with _version_lock:
+        _data_version += 1
+        return _data_version
+
+
+def _pending(session) -> ChangeSet:
+    changes = session.info.get(_PENDING_KEY)
+    if changes is None:
+        changes = session.info[_PENDING_KEY] = ChangeSet()
+    return changes
+
+
+@event.listens_for(OrmSession, 'after_flush')
+def _collect_flush_changes(session, flush_context):
+    if not (session.new or session.dirty or session.deleted):
+        return
+
+    changes = _pending(session)
+    for instance in session.new:
+        entity_type = TRACKED_MODELS.get(type(instance))
+        if entity_type:
+            changes.upsert(entity_type, instance.id)
+    for instance in session.dirty:
+        entity_type = TRACKED_MODELS.get(type(instance))
+        # 關聯集合的變更也會使物件出現在 dirty 中
+        if entity_type and session.is_modified(instance):
+            changes.upsert(entity_type, instance.id)
+    for instance in session.deleted:
+        entity_type = TRACKED_MODELS.get(type(instance))
+        if entity_type:
+            changes.delete(entity_type, instance.id)
+
+
+def _bulk_update_columns(update_context) -> Set[str]:
+    """Query.update 寫入的欄位名稱；無法辨識時為 {'*'}"""
+    values = getattr(update_context, 'values', None)
+    if isinstance(values, dict):
+        keys = values.keys()
+    elif isinstance(values, (list, tuple)):
+        # update(..., preserve_parameter_order=True) 的 [(欄位, 值), ...]
+        keys = [item[0] for item in values if isinstance(item, tuple) and item]
+    else:
+        return {'*'}
+
+    columns = set()
+    for key in keys:
+        # 鍵可能是欄位名稱、InstrumentedAttribute 或 Column
+        name = key if isinstance(key, str) else getattr(key, 'key', None)
+        if not isinstance(name, str):
+            return {'*'}
+        columns.add(name)
+    return columns or {'*'}
+
+
+def _collect_bulk_changes(update_context):
+    entity_type = TRACKED_MODELS.get(update_context.mapper.class_)
+    if entity_type:
+        changes = _pending(update_context.session)
+        changes.bulk.add(entity_type)
+        changes.bulk_columns.setdefault(entity_type, set()).update(_bulk_update_columns(update_context))
+
+
+def _collect_bulk_deletes(delete_context):
+    entity_type = TRACKED_MODELS.get(delete_context.mapper.class_)
+    if entity_type:
+        changes = _pending(delete_context.session)
+        changes.bulk.add(entity_type)
+        changes.bulk_deleted.add(entity_type)
+
+
+event.listen(OrmSession, 'after_bulk_update', _collect_bulk_changes)
+event.listen(OrmSession, 'after_bulk_delete', _collect_bulk_deletes)
+
+
+@event.listens_for(OrmSession, 'after_commit')
+def _dispatch_committed_changes(session):
+    changes = session.info.pop(_PENDING_KEY, None)
+    if changes is None or changes.is_empty():
+        return
+
+    changes.version = bump_data_version()
+    for callback in list(_subscribers):
+        try:
+            callback(changes)
+        except Exception as e:
+            logger.error(f"資料變更通知失敗（{getattr(callback, '__name__', callback)}）: {e}")
+
+
+@event.listens_for(OrmSession, 'after_rollback')
+def _discard_rolled_back_changes(session):
+    session.info.pop(_PENDING_KEY, None)
@@ -0,0 +1,183 @@
+"""
+命令列工具
+透過 Flask CLI 註冊維護命令，例如：
+
+    flask --app app vector-rebuild --workers 4
+"""
+
+import click
+
+
+def register_commands(app):
+    """將維護命令註冊到 Flask 應用"""
+
+    @app.cli.command('vector-rebuild')
+    @click.option('--workers', type=int, default=None, help='工作進程數（預設為 CPU 核心數）')
+    @click.option('--threads', type=int, default=None, help='每個工作進程的 torch 線程數')
+    @click.option('--batch-size', type=int, default=None, help='每批編碼的文檔數')
+    @click.option('--reset/--no-reset', default=True, help='重建前是否清空向量集合')
+    def vector_rebuild(workers, threads, batch_size, reset):
+        """以多進程重新編碼所有課程和段落並寫入向量數據庫"""
+        from vector_service import rebuild_index_parallel
+
+        def report(done, total, docs_per_second):
+            click.echo(f"已寫入 {done}/{total} 個文檔（{docs_per_second:.1f} 文檔/秒）")
+
+        stats = rebuild_index_parallel(
+            workers=workers,
+            threads_per_worker=threads,
+            batch_size=batch_size,
+            reset=reset,
+            progress=report
+        )
+        click.echo(
+            f"重建完成：{stats['documents']} 個文檔，{stats['workers']} 個工作進程 × "
+            f"{stats['threads_per_worker']} 線程，耗時 {stats['elapsed_seconds']} 秒"
+            f"（{stats['docs_per_second']} 文檔/秒）"
+        )
+
+    @app.cli.command('vector-reconcile')
+    @click.option('--batch-size', type=int, default=None, help='每次刪除的文檔數')
+    @click.option('--dry-run', is_flag=True, help='只統計孤立向量，不刪除')
+    def vector_reconcile(batch_size, dry_run):
+        """比對資料庫與向量集合，刪除孤立的向量"""
+        from vector_service import reconcile_orphans
+
+        stats = reconcile_orphans(batch_size=batch_size, dry_run=dry_run)
+        click.echo(
+            f"集合共 {stats['indexed']} 個文檔，孤立 {stats['orphans']} 個，"
+            f"已移除 {stats['removed']} 個（{stats['batches']} 次刪除）"
+        )
+
+    @app.cli.command('vector-compact')
+    def vector_compact():
+        """回收向量存儲中已刪除文檔佔用的空間（僅 numpy 後端需要）"""
+        from vector_service import get_chroma_manager
+
+        stats = get_chroma_manager().store.compact()
+        if not stats:
+            click.echo("目前的向量存儲後端不需要壓縮")
+            return
+        click.echo(f"壓縮完成：{stats['rows_before']} → {stats['rows_after']} 行，回收 {stats['reclaimed']} 行")
+
+    @app.cli.command('fulltext-benchmark')
+    @click.option('--rows', type=int, default=100000, help='測試用的段落數')
+    @click.option('--queries', type=int, default=50, help='查詢次數')
+    def fulltext_benchmark(rows, queries):
+        """在暫存資料庫中比較 LIKE 與 FTS5 全文索引的查詢延遲"""
+        import os
+        import random
+        import tempfile
+        from models import Segment
+        from fulltext_service import benchmark_fulltext, query_terms
+
+        samples = [content for (content,) in Segment.query.with_entities(Segment.content)
+                   .filter(Segment.content.isnot(None), Segment.content != '').limit(1000)]
+        if not samples:
+            samples = ["肩膀疼痛的原因和治療方法", "腰椎間盤突出的症狀表現與復健", "頸部僵硬的緩解方法和日常保養"]
+
+        # 從樣本中抽取檢索詞作為查詢
+        vocabulary = sorted({term for text in samples[:200] for term in query_terms(text) if len(term) >= 2})
+        random.seed(42)
+        sample_queries = random.sample(vocabulary, min(queries, len(vocabulary)))
+
+        with tempfile.TemporaryDirectory() as directory:
+            click.echo(f"寫入 {rows} 個段落並建立全文索引 ...")
+            result = benchmark_fulltext(os.path.join(directory, 'benchmark.sqlite3'), samples, rows, sample_queries)
+
+        click.echo(f"建立索引耗時 {result['build_seconds']} 秒，{len(sample_queries)} 個查詢")
+        click.echo(f"{'方式':<8}{'p50(ms)':>10}{'p95(ms)':>10}")
+        for name in ('like', 'fts'):
+            click.echo(f"{name:<8}{str(result[name]['p50_ms']):>10}{str(result[name]['p95_ms']):>10}")
+
+    @app.cli.command('embedding-benchmark')
+    @click.option('--backends', default='torch,onnx,onnx-int8', help='要比較的後端，以逗號分隔')
+    @click.option('--samples', type=int, default=64, help='取樣的段落數')
+    @click.option('--model', 'model_name', default='BAAI/bge-m3', help='嵌入模型名稱')
+    def embedding_benchmark(backends, samples, model_name):
+        """比較各嵌入後端的延遲、記憶體，以及與 fp32 向量的一致性"""
+        import multiprocessing
+        from models import Segment
+        from vector_service import benchmark_embedding_backend, cosine_parity
+
+        texts = [content for (content,) in Segment.query.with_entities(Segment.content)
+                 .filter(Segment.content.isnot(None), Segment.content != '').limit(samples)]
+        if not texts:
+            texts = ["肩膀疼痛的原因和治療", "腰椎間盤突出的症狀表現", "頸部僵硬的緩解方法"] * max(1, samples // 3)
+
+        results = []
+        context = multiprocessing.get_context('spawn')
+        for backend in [name.strip() for name in backends.split(',') if name.strip()]:
+            click.echo(f"測試後端 {backend} ...")
+            # 每個後端在獨立進程中測量，避免記憶體互相影響
+            with context.Pool(1) as pool:
+                try:
+                    results.append(pool.apply(benchmark_embedding_backend, (backend, model_name, texts)))
+                except Exception as e:
+                    click.echo(f"  後端 {backend} 失敗: {e}")
+
+        reference = next((r['embeddings'] for r in results if r['backend'] == 'torch'), None)
+        click.echo(f"{'後端':<12}{'載入(s)':>10}{'p50(ms)':>10}{'p95(ms)':>10}{'文檔/秒':>10}{'RSS(MB)':>10}{'平均cos':>10}{'最小cos':>10}")
+        for result in results:
+            parity = cosine_parity(reference, result['embeddings']) if reference else {}
+            click.echo(
+                f"{result['backend']:<12}{result['load_seconds']:>10}{result['query_latency_ms_p50']:>10}"
+                f"{result['query_latency_ms_p95']:>10}{result['batch_docs_per_second']:>10}"
+                f"{str(result['rss_mb']):>10}{str(parity.get('mean_cosine', '-')):>10}"
+                f"{str(parity.get('min_cosine', '-')):>10}"
+            )
+
+    @app.cli.command('vector-store-benchmark')
+    @click.option('--backends', default='chroma,numpy', help='要比較的向量存儲後端，以逗號分隔')
+    @click.option('--sizes', default='10k,100k,1m', help='向量數量，以逗號分隔（支援 k / m 縮寫）')
+    @click.option('--dim', type=int, default=1024, help='向量維度（BGE-M3 為 1024）')
+    @click.option('--queries', type=int, default=100, help='每個規模測量的查詢次數')
+    def vector_store_benchmark(backends, sizes, dim, queries):
+        """比較各向量存儲後端的冷啟動時間、查詢延遲與常駐記憶體"""
+        import shutil
+        import tempfile
+        import multiprocessing
+        from vector_store import build_benchmark_store, measure_benchmark_store, iter_benchmark_sizes
+
+        context = multiprocessing.get_context('spawn')
+        click.echo(f"{'後端':<10}{'向量數':>10}{'寫入(s)':>10}{'冷啟動(s)':>12}{'p50(ms)':>10}{'p95(ms)':>10}{'RSS(MB)':>10}")
+        for size in iter_benchmark_sizes(sizes):
+            for backend in [name.strip() for name in backends.split(',') if name.strip()]:
+                directory = tempfile.mkdtemp(prefix=f'vector-bench-{backend}-')
+                try:
+                    # 寫入與測量各自在獨立進程中執行，冷啟動和記憶體不受前一步影響
+                    with context.Pool(1) as pool:
+                        build_seconds = pool.apply(build_benchmark_store, (backend, directory, size, dim))
+                    with context.Pool(1) as pool:
+                        result = pool.apply(measure_benchmark_store, (backend, directory, dim, queries))
+                except Exception as e:
+                    click.echo(f"{backend:<10}{size:>10}  失敗: {e}")
+                    continue
+                finally:
+                    shutil.rmtree(directory, ignore_errors=True)
+
+                click.echo(
+                    f"{backend:<10}{size:>10}{build_seconds:>10.1f}{result['cold_start_seconds']:>12}"
+                    f"{result['query_latency_ms_p50']:>10}{result['query_latency_ms_p95']:>10}"
+                    f"{str(result['rss_mb']):>10}"
+                )
+
+    @app.cli.command('relation-layout-benchmark')
+    @click.option('--sizes', default='100,300,1000', help='節點數，以逗號分隔')
+    @click.option('--method', type=click.Choice(['force', 'spectral']), default='force', help='佈局方式')
+    @click.option('--degree', type=float, default=3.0, help='隨機圖的平均度數')
+    @click.option('--iterations', type=int, default=None, help='力導向迭代次數（預設 RELATION_GRAPH_LAYOUT_ITERATIONS）')
+    def relation_layout_benchmark(sizes, method, degree, iterations):
+        """測量關聯圖譜伺服器端佈局在各節點數下的耗時"""
+        from graph_layout import LAYOUT_ITERATIONS, LAYOUT_MAX_NODES, benchmark_layout, layout_available
+
+        if not layout_available():
+            click.echo("未安裝 NumPy，伺服器端佈局不可用")
+            return
+        node_counts = [int(size) for size in sizes.split(',') if size.strip()]
+        results = benchmark_layout(node_counts, degree, method, iterations or LAYOUT_ITERATIONS)
+        click.echo(f"{'節點數':>8}{'連線數':>10}{'耗時(s)':>10}")
+        for result in results:
+            click.echo(f"{result['nodes']:>8}{result['links']:>10}{result['seconds']:>10}")
+        if any(result['nodes'] > LAYOUT_MAX_NODES for result in results):
+            click.echo(f"超過 {LAYOUT_MAX_NODES} 個節點（RELATION_GRAPH_LAYOUT_MAX_NODES）的圖譜在請求中不計算佈局")
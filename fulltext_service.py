@@ -0,0 +1,350 @@
+"""
+全文檢索服務模組
+以 SQLite FTS5 虛擬表索引課程和段落的標題與內容，取代 LIKE '%q%' 的全表掃描
+
+FTS5 內建的 unicode61 分詞器會把連續的中文字視為一個詞，因此寫入前先以 jieba 分詞、
+以空白連接。分詞在 SQLite 內以 jieba_segment() 自訂函數執行，由觸發器在資料列
+新增、修改、刪除時同步 FTS 表；每個資料庫連線建立時都會註冊此函數。
+
+注意：以 batch_alter_table 重建 sessions / segments 表的遷移會一併移除觸發器，
+啟動時的 ensure_fulltext_index() 會補建觸發器並重建索引。
+"""
+
+import re
+import time
+import sqlite3
+import logging
+import threading
+from dataclasses import dataclass
+from typing import Any, Dict, List, Optional, Tuple
+
+import jieba
+from sqlalchemy import event, func, literal_column, or_, table, column
+from sqlalchemy.engine import Engine
+
+logger = logging.getLogger(__name__)
+
+# 搜尋結果摘要的長度（字元）
+SNIPPET_CHARS = 120
+
+# 含有文字或數字的詞才納入索引和查詢（過濾標點和空白）
+_WORD_PATTERN = re.compile(r'\w')
+
+
+@dataclass(frozen=True)
+class FulltextTable:
+    """一個來源表對應的 FTS5 虛擬表"""
+    source: str
+    name: str
+    columns: Tuple[str, ...]
+    weights: Tuple[float, ...]  # bm25 欄位權重，標題命中比內容命中更重要
+
+
+FULLTEXT_TABLES = {
+    'sessions': FulltextTable('sessions', 'sessions_fts', ('title', 'overview'), (3.0, 1.0)),
+    'segments': FulltextTable('segments', 'segments_fts', ('title', 'content'), (2.0, 1.0)),
+}
+
+# 目前資料庫是否可使用全文索引（由 ensure_fulltext_index 設定）
+_fulltext_ready = False
+
+
+def segment_for_index(value: Optional[str]) -> str:
+    """以 jieba 搜尋引擎模式分詞並以空白連接，供 FTS5 的 unicode61 分詞器切分"""
+    if not value:
+        return ''
+    return ' '.join(token for token in jieba.cut_for_search(value) if _WORD_PATTERN.search(token))
+
+
+def query_terms(query: str) -> List[str]:
+    """將查詢分詞為檢索詞（去除標點與重複）"""
+    terms = []
+    for token in jieba.cut(query.strip()):
+        token = token.strip()
+        if token and _WORD_PATTERN.search(token) and token not in terms:
+            terms.append(token)
+    return terms
+
+
+def build_match_query(query: str, columns: Optional[Tuple[str, ...]] = None) -> Optional[str]:
+    """
+    將使用者查詢轉換為 FTS5 MATCH 表達式
+
+    每個詞以前綴匹配（"詞"*），詞之間為 AND；指定 columns 時只匹配這些欄位。
+    查詢中沒有可檢索的詞時返回 None。
+    """
+    terms = query_terms(query)
+    if not terms:
+        return None
+
+    prefix = f"{{{' '.join(columns)}}} : " if columns else ''
+    return ' AND '.join(f'{prefix}"{term.replace(chr(34), chr(34) * 2)}"*' for term in terms)
+
+
+def register_sqlite_functions(dbapi_connection):
+    """在 SQLite 連線上註冊 jieba_segment()，觸發器依賴此函數"""
+    if not isinstance(dbapi_connection, sqlite3.Connection):
+        return
+    try:
+        dbapi_connection.create_function('jieba_segment', 1, segment_for_index, deterministic=True)
+    except (TypeError, sqlite3.NotSupportedError):
+        # 舊版 SQLite 不支援 deterministic 旗標
+        dbapi_connection.create_function('jieba_segment', 1, segment_for_index)
+
+
+@event.listens_for(Engine, 'connect')
+def _on_connect(dbapi_connection, connection_record):
+    register_sqlite_functions(dbapi_connection)
+
+
+def fulltext_ddl(spec: FulltextTable) -> List[str]:
+    """FTS5 虛擬表與同步觸發器的建立語句"""
+    columns = ', '.join(spec.columns)
+    segmented_new = ', '.join(f'jieba_segment(new.{name})' for name in spec.columns)
+    assignments = ', '.join(f'{name} = jieba_segment(new.{name})' for name in spec.columns)
+    return [
+        f"CREATE VIRTUAL TABLE IF NOT EXISTS {spec.name} USING fts5({columns}, tokenize='unicode61')",
+        f"""CREATE TRIGGER IF NOT EXISTS {spec.name}_ai AFTER INSERT ON {spec.source} BEGIN
+            INSERT INTO {spec.name}(rowid, {columns}) VALUES (new.id, {segmented_new});
+        END""",
+        f"""CREATE TRIGGER IF NOT EXISTS {spec.name}_ad AFTER DELETE ON {spec.source} BEGIN
+            DELETE FROM {spec.name} WHERE rowid = old.id;
+        END""",
+        # 只在被索引的欄位變更時重新分詞，同步狀態等欄位的更新不受影響
+        f"""CREATE TRIGGER IF NOT EXISTS {spec.name}_au AFTER UPDATE OF {columns} ON {spec.source} BEGIN
+            UPDATE {spec.name} SET {assignments} WHERE rowid = new.id;
+        END""",
+    ]
+
+
+def drop_fulltext_ddl(spec: FulltextTable) -> List[str]:
+    return [
+        f"DROP TRIGGER IF EXISTS {spec.name}_ai",
+        f"DROP TRIGGER IF EXISTS {spec.name}_ad",
+        f"DROP TRIGGER IF EXISTS {spec.name}_au",
+        f"DROP TABLE IF EXISTS {spec.name}",
+    ]
+
+
+def rebuild_fulltext_table(connection, spec: FulltextTable):
+    """清空並從來源表重新填入 FTS 表（connection 需已註冊 jieba_segment）"""
+    columns = ', '.join(spec.columns)
+    segmented = ', '.join(f'jieba_segment({name})' for name in spec.columns)
+    connection.exec_driver_sql(f"DELETE FROM {spec.name}")
+    connection.exec_driver_sql(
+        f"INSERT INTO {spec.name}(rowid, {columns}) SELECT id, {segmented} FROM {spec.source}"
+    )
+
+
+def ensure_fulltext_index(engine) -> bool:
+    """
+    確保 FTS 表和觸發器存在，缺少觸發器或索引列數與來源表不一致時重建索引
+
+    Returns:
+        全文索引是否可用（非 SQLite 或 SQLite 未編譯 FTS5 時為 False）
+    """
+    global _fulltext_ready
+    if engine.dialect.name != 'sqlite':
+        _fulltext_ready = False
+        return False
+
+    try:
+        with engine.begin() as connection:
+            existing = {name for (name,) in connection.exec_driver_sql(
+                "SELECT name FROM sqlite_master WHERE type IN ('table', 'trigger')"
+            )}
+            for spec in FULLTEXT_TABLES.values():
+                if spec.source not in existing:
+                    continue
+
+                required = {spec.name, f'{spec.name}_ai', f'{spec.name}_ad', f'{spec.name}_au'}
+                complete = required <= existing
+                for statement in fulltext_ddl(spec):
+                    connection.exec_driver_sql(statement)
+
+                indexed = connection.exec_driver_sql(f"SELECT count(*) FROM {spec.name}").scalar()
+                total = connection.exec_driver_sql(f"SELECT count(*) FROM {spec.source}").scalar()
+                if not complete or indexed != total:
+                    started = time.perf_counter()
+                    rebuild_fulltext_table(connection, spec)
+                    logger.info(f"全文索引 {spec.name} 已重建（{total} 列，{time.perf_counter() - started:.2f} 秒）")
+
+        _fulltext_ready = True
+    except Exception as e:
+        logger.warning(f"全文索引不可用，關鍵字搜尋將使用 LIKE: {e}")
+        _fulltext_ready = False
+    return _fulltext_ready
+
+
+_warmup_thread: Optional[threading.Thread] = None
+_warmup_lock = threading.Lock()
+
+
+def start_fulltext_warmup(engine) -> threading.Thread:
+    """
+    在背景線程中執行 ensure_fulltext_index（回填可能需要數十秒），重複呼叫無副作用
+
+    完成前 fulltext_available() 為 False，search_rows 使用 LIKE
+    """
+    global _warmup_thread
+    with _warmup_lock:
+        if _warmup_thread is None:
+            _warmup_thread = threading.Thread(
+                target=ensure_fulltext_index, args=(engine,), name="fulltext-warmup", daemon=True
+            )
+            _warmup_thread.start()
+    return _warmup_thread
+
+
+def fulltext_available() -> bool:
+    return _fulltext_ready
+
+
+def fulltext_search(model, query: str, limit: int, base_query=None,
+                    columns: Optional[Tuple[str, ...]] = None) -> List[Tuple[Any, float]]:
+    """
+    以 FTS5 檢索課程或段落，依 bm25 相關度排序
+
+    Args:
+        model: Session 或 Segment
+        query: 使用者查詢
+        limit: 結果數量
+        base_query: 已加入過濾條件的查詢（預設為 model.query）
+        columns: 只匹配指定欄位
+
+    Returns:
+        [(資料列, 相關度)]；相關度為 bm25 相對於最佳結果的比例（最佳結果為 1.0）
+    """
+    spec = FULLTEXT_TABLES[model.__tablename__]
+    match = build_match_query(query, columns)
+    if not match:
+        return []
+
+    fts = table(spec.name, column('rowid'))
+    fts_ref = literal_column(spec.name)
+    rank = func.bm25(fts_ref, *[literal_column(repr(weight)) for weight in spec.weights])
+
+    base_query = base_query if base_query is not None else model.query
+    rows = base_query.join(fts, fts.c.rowid == model.id)\
+        .filter(fts_ref.op('MATCH')(match))\
+        .add_columns(rank.label('fts_rank'))\
+        .order_by(rank)\
+        .limit(limit).all()
+
+    # bm25 越小越相關（負數）；小型資料集的 IDF 很小，以最佳結果為基準換算
+    best = rows[0][1] if rows and rows[0][1] < 0 else None
+    return [(row, round(fts_rank / best, 4) if best else 1.0) for row, fts_rank in rows]
+
+
+def search_rows(model, query: str, limit: int, base_query=None,
+                columns: Optional[Tuple[str, ...]] = None) -> List[Tuple[Any, float]]:
+    """
+    關鍵字檢索的統一入口：全文索引可用時使用 FTS5 + bm25，否則退回 LIKE '%q%'
+
+    Args:
+        columns: 匹配的欄位，預設為該表所有被索引的欄位
+
+    Returns:
+        [(資料列, 相關度)]；LIKE 模式沒有排序依據，相關度固定為 1.0
+    """
+    if fulltext_available():
+        return fulltext_search(model, query, limit, base_query, columns)
+
+    spec = FULLTEXT_TABLES[model.__tablename__]
+    base_query = base_query if base_query is not None else model.query
+    conditions = [getattr(model, name).contains(query) for name in (columns or spec.columns)]
+    return [(row, 1.0) for row in base_query.filter(or_(*conditions)).limit(limit).all()]
+
+
+def highlight(value: Optional[str], query: str, width: int = SNIPPET_CHARS) -> Dict[str, Any]:
+    """
+    在原文中標出查詢詞，返回以第一個命中處為中心的摘要
+
+    Returns:
+        {"snippet": 摘要, "offsets": [[起, 迄], ...]}，偏移量相對於摘要
+    """
+    if not value:
+        return {"snippet": "", "offsets": []}
+
+    lowered = value.lower()
+    spans = []
+    for term in sorted(set(query_terms(query)) | {query.strip()}, key=len, reverse=True):
+        term = term.lower()
+        if not term:
+            continue
+        start = lowered.find(term)
+        while start != -1:
+            spans.append((start, start + len(term)))
+            start = lowered.find(term, start + len(term))
+
+    # 合併重疊的區間
+    merged: List[List[int]] = []
+    for start, end in sorted(spans):
+        if merged and start <= merged[-1][1]:
+            merged[-1][1] = max(merged[-1][1], end)
+        else:
+            merged.append([start, end])
+
+    window_start = max(0, merged[0][0] - width // 4) if merged else 0
+    window_end = min(len(value), window_start + width)
+    return {
+        "snippet": value[window_start:window_end],
+        "offsets": [[start - window_start, min(end, window_end) - window_start]
+                    for start, end in merged if start < window_end and start >= window_start]
+    }
+
+
+def benchmark_fulltext(path: str, sample_texts: List[str], rows: int,
+                       queries: List[str], limit: int = 20) -> Dict[str, Any]:
+    """
+    在獨立的 SQLite 檔案中比較 LIKE 與 FTS5 的查詢延遲
+
+    以樣本文本循環填入 rows 個段落（寫入時經由觸發器建立索引），
+    每個查詢分別以 LIKE '%q%' 和 FTS5 MATCH + bm25 排序執行。
+    """
+    spec = FULLTEXT_TABLES['segments']
+    connection = sqlite3.connect(path)
+    register_sqlite_functions(connection)
+    try:
+        connection.execute("CREATE TABLE segments (id INTEGER PRIMARY KEY, title TEXT, content TEXT)")
+        for statement in fulltext_ddl(spec):
+            connection.execute(statement)
+
+        started = time.perf_counter()
+        connection.executemany(
+            "INSERT INTO segments (id, title, content) VALUES (?, ?, ?)",
+            ((i + 1, f"段落 {i + 1}", sample_texts[i % len(sample_texts)]) for i in range(rows))
+        )
+        connection.commit()
+        build_seconds = time.perf_counter() - started
+
+        def measure(sql, params_for):
+            latencies = []
+            for query in queries:
+                params = params_for(query)
+                if params is None:
+                    continue
+                started = time.perf_counter()
+                connection.execute(sql, params).fetchall()
+                latencies.append((time.perf_counter() - started) * 1000)
+            latencies.sort()
+            if not latencies:
+                return {"p50_ms": None, "p95_ms": None}
+            return {
+                "p50_ms": round(latencies[len(latencies) // 2], 2),
+                "p95_ms": round(latencies[min(len(latencies) - 1, int(len(latencies) * 0.95))], 2)
+            }
+
+        like = measure(
+            f"SELECT id FROM segments WHERE title LIKE ? OR content LIKE ? LIMIT {limit}",
+            lambda q: (f"%{q}%", f"%{q}%")
+        )
+        fts = measure(
+            f"SELECT rowid, bm25({spec.name}) AS rank FROM {spec.name} WHERE {spec.name} MATCH ? "
+            f"ORDER BY rank LIMIT {limit}",
+            lambda q: (build_match_query(q),) if build_match_query(q) else None
+        )
+        return {"rows": rows, "build_seconds": round(build_seconds, 2), "like": like, "fts": fts}
+    finally:
+        connection.close()
+
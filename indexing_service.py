@@ -0,0 +1,179 @@
+"""
+向量索引工作線程模組
+從 index_outbox 表批量讀取索引事件，合併同一資料列的重複變更後寫入向量數據庫，
+失敗的事件以指數退避重試
+"""
+
+import os
+import logging
+import threading
+from datetime import datetime, timedelta
+from typing import Dict, Any, List, Optional, Tuple
+
+from sqlalchemy import func
+from models import IndexOutbox, db
+from vector_service import apply_index_changes, is_vector_ready
+
+logger = logging.getLogger(__name__)
+
+# 每批處理的事件數
+DEFAULT_OUTBOX_BATCH_SIZE = int(os.environ.get('INDEX_OUTBOX_BATCH_SIZE', 64))
+# 超過此重試次數的事件不再處理，需人工檢查
+MAX_OUTBOX_ATTEMPTS = int(os.environ.get('INDEX_OUTBOX_MAX_ATTEMPTS', 8))
+# 沒有收到通知時的輪詢間隔（秒）
+OUTBOX_POLL_INTERVAL = float(os.environ.get('INDEX_OUTBOX_POLL_INTERVAL', 5.0))
+
+
+class IndexingWorker:
+    """索引事件的背景批量處理器"""
+
+    def __init__(self, app, batch_size: int = DEFAULT_OUTBOX_BATCH_SIZE,
+                 max_attempts: int = MAX_OUTBOX_ATTEMPTS,
+                 poll_interval: float = OUTBOX_POLL_INTERVAL):
+        self.app = app
+        self.batch_size = batch_size
+        self.max_attempts = max_attempts
+        self.poll_interval = poll_interval
+
+        self.processed = 0
+        self.coalesced = 0
+        self.failures = 0
+        self.last_batch_at: Optional[datetime] = None
+        self.last_error: Optional[str] = None
+
+        self._wakeup = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def start(self):
+        """啟動工作線程"""
+        if self._thread and self._thread.is_alive():
+            return
+        self._thread = threading.Thread(target=self._run, name="indexing-worker", daemon=True)
+        self._thread.start()
+        logger.info("向量索引工作線程已啟動")
+
+    def notify(self):
+        """通知有新的索引事件"""
+        self._wakeup.set()
+
+    def _run(self):
+        while True:
+            self._wakeup.wait(self.poll_interval)
+            self._wakeup.clear()
+
+            # 模型預熱完成前事件保留在表中
+            if not is_vector_ready():
+                continue
+
+            try:
+                with self.app.app_context():
+                    while self.process_batch():
+                        pass
+            except Exception as e:
+                self.last_error = str(e)
+                logger.error(f"處理索引事件失敗: {e}")
+
+    def process_batch(self) -> int:
+        """處理一批到期的索引事件，返回處理的事件數"""
+        now = datetime.utcnow()
+        events = IndexOutbox.query.filter(
+            IndexOutbox.available_at <= now,
+            IndexOutbox.attempts < self.max_attempts
+        ).order_by(IndexOutbox.id).limit(self.batch_size).all()
+
+        if not events:
+            return 0
+
+        # 合併同一資料列的多次變更，以最後一次操作為準
+        changes: Dict[Tuple[str, int], str] = {}
+        events_by_key: Dict[Tuple[str, int], List[IndexOutbox]] = {}
+        for event in events:
+            key = (event.entity_type, event.entity_id)
+            changes[key] = event.operation
+            events_by_key.setdefault(key, []).append(event)
+
+        try:
+            apply_index_changes(changes, self.batch_size)
+            self._complete(events)
+        except Exception as e:
+            db.session.rollback()
+            logger.warning(f"批量索引失敗，改為逐筆處理: {e}")
+            # 逐筆重試，避免單一資料列的錯誤阻塞整批
+            for key, operation in changes.items():
+                try:
+                    apply_index_changes({key: operation}, self.batch_size)
+                    self._complete(events_by_key[key])
+                except Exception as item_error:
+                    db.session.rollback()
+                    self._fail(events_by_key[key], item_error)
+
+        self.coalesced += len(events) - len(changes)
+        self.last_batch_at = datetime.utcnow()
+        return len(events)
+
+    def _complete(self, events: List[IndexOutbox]):
+        """移除已處理的事件"""
+        event_ids = [event.id for event in events]
+        IndexOutbox.query.filter(IndexOutbox.id.in_(event_ids)).delete(synchronize_session=False)
+        db.session.commit()
+        self.processed += len(events)
+
+    def _fail(self, events: List[IndexOutbox], error: Exception):
+        """記錄失敗並以指數退避安排重試"""
+        event_ids = [event.id for event in events]
+        for event in IndexOutbox.query.filter(IndexOutbox.id.in_(event_ids)):
+            event.attempts += 1
+            event.last_error = str(error)
+            event.available_at = datetime.utcnow() + timedelta(seconds=min(300, 2 ** event.attempts))
+        db.session.commit()
+
+        self.failures += len(events)
+        self.last_error = str(error)
+        logger.error(f"索引事件處理失敗（{events[0].entity_type} {events[0].entity_id}）: {error}")
+
+    def stats(self) -> Dict[str, Any]:
+        """獲取索引延遲和處理統計（需在 app context 中呼叫）"""
+        pending_query = IndexOutbox.query.filter(IndexOutbox.attempts < self.max_attempts)
+        pending = pending_query.count()
+        oldest = pending_query.with_entities(func.min(IndexOutbox.created_at)).scalar()
+        failed = IndexOutbox.query.filter(IndexOutbox.attempts >= self.max_attempts).count()
+
+        return {
+            "running": bool(self._thread and self._thread.is_alive()),
+            "pending": pending,
+            "failed": failed,
+            "oldest_pending_at": oldest.isoformat() if oldest else None,
+            "lag_seconds": round((datetime.utcnow() - oldest).total_seconds(), 3) if oldest else 0.0,
+            "processed": self.processed,
+            "coalesced": self.coalesced,
+            "failures": self.failures,
+            "last_batch_at": self.last_batch_at.isoformat() if self.last_batch_at else None,
+            "last_error": self.last_error
+        }
+
+
+# 全局實例（單例模式）
+_indexing_worker: Optional[IndexingWorker] = None
+_worker_lock = threading.Lock()
+
+def start_indexing_worker(app) -> IndexingWorker:
+    """啟動索引工作線程（重複呼叫無副作用）"""
+    global _indexing_worker
+    with _worker_lock:
+        if _indexing_worker is None:
+            _indexing_worker = IndexingWorker(app)
+            _indexing_worker.start()
+    return _indexing_worker
+
+def notify_indexing_worker():
+    """資料提交後通知工作線程立即處理"""
+    if _indexing_worker is not None:
+        _indexing_worker.notify()
+
+def get_indexing_stats() -> Dict[str, Any]:
+    """獲取索引統計；工作線程未啟動時只回報待處理事件"""
+    if _indexing_worker is not None:
+        return _indexing_worker.stats()
+
+    pending = IndexOutbox.query.count()
+    return {"running": False, "pending": pending}
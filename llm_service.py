@@ -545,7 +545,7 @@ class LLMCourseService:
         """將處理後的課程數據保存到數據庫"""
         from datetime import datetime
         from models import db, Session, Segment, Tag
-        from app import CATEGORY_COLORS
+        from app import CATEGORY_COLORS, queue_vector_index
         
         try:
             # 創建課程
@@ -579,8 +579,10 @@ class LLMCourseService:
             
             db.session.add(session)
             db.session.flush()  # 獲取 session.id
+            queue_vector_index('session', session.id)
             
             # 處理段落
+            segments = []
             for order_index, segment_data in enumerate(processed_data.get('segments', [])):
                 segment = Segment(
                     session_id=session.id,
@@ -616,6 +618,11 @@ class LLMCourseService:
                         segment.tags.append(tag)
                 
                 db.session.add(segment)
+                segments.append(segment)
+            
+            db.session.flush()  # 獲取 segment.id
+            for segment in segments:
+                queue_vector_index('segment', segment.id)
             
             db.session.commit()
             return session.id
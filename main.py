@@ -11,7 +11,7 @@ import socket
 import webbrowser
 from contextlib import closing
 import webview
-from app import app, db
+from app import app, db, start_vector_services, prepare_search_indexes
 
 
 def find_free_port():
@@ -48,6 +48,7 @@ def start_flask_server(port):
             # 確保資料庫和上傳資料夾
             with app.app_context():
                 db.create_all()
+                prepare_search_indexes()
                 ensure_upload_folder()
             
             # 啟動Flask應用，關閉debug模式以避免重新載入
@@ -82,7 +83,7 @@ def wait_for_server(port, timeout=30):
                     return True
         except Exception:
             pass
-        time.sleep(0.5)
+        time.sleep(0.1)
     
     print("等待Flask伺服器啟動超時")
     return False
@@ -165,6 +166,9 @@ def main():
         print("Flask伺服器啟動失敗，程序退出")
         sys.exit(1)
     
+    # 伺服器就緒後再於背景載入嵌入模型和啟動索引工作線程，視窗不必等待 torch 載入
+    start_vector_services()
+    
     try:
         # 創建WebView視窗
         window = create_webview_window(port)
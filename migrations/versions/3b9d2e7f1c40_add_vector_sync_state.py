@@ -0,0 +1,41 @@
+"""Add vector sync state to sessions and segments; add segments.updated_at.
+
+Revision ID: 3b9d2e7f1c40
+Revises: 8fc808661254
+Create Date: 2026-10-17 10:12:45.118203
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '3b9d2e7f1c40'
+down_revision = '8fc808661254'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table('sessions', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('vector_synced_at', sa.DateTime(), nullable=True))
+        batch_op.add_column(sa.Column('vector_hash', sa.String(length=64), nullable=True))
+
+    with op.batch_alter_table('segments', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('updated_at', sa.DateTime(), nullable=True))
+        batch_op.add_column(sa.Column('vector_synced_at', sa.DateTime(), nullable=True))
+        batch_op.add_column(sa.Column('vector_hash', sa.String(length=64), nullable=True))
+
+    # 既有段落以建立時間作為最後修改時間
+    op.execute('UPDATE segments SET updated_at = created_at WHERE updated_at IS NULL')
+
+
+def downgrade():
+    with op.batch_alter_table('segments', schema=None) as batch_op:
+        batch_op.drop_column('vector_hash')
+        batch_op.drop_column('vector_synced_at')
+        batch_op.drop_column('updated_at')
+
+    with op.batch_alter_table('sessions', schema=None) as batch_op:
+        batch_op.drop_column('vector_hash')
+        batch_op.drop_column('vector_synced_at')
@@ -0,0 +1,39 @@
+"""Add index_outbox table for asynchronous vector indexing.
+
+Revision ID: a41c6e9d2b17
+Revises: 3b9d2e7f1c40
+Create Date: 2026-10-17 11:02:18.470915
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'a41c6e9d2b17'
+down_revision = '3b9d2e7f1c40'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('index_outbox',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('entity_type', sa.String(length=20), nullable=False),
+    sa.Column('entity_id', sa.Integer(), nullable=False),
+    sa.Column('operation', sa.String(length=10), nullable=False),
+    sa.Column('attempts', sa.Integer(), nullable=False),
+    sa.Column('last_error', sa.Text(), nullable=True),
+    sa.Column('created_at', sa.DateTime(), nullable=True),
+    sa.Column('available_at', sa.DateTime(), nullable=True),
+    sa.PrimaryKeyConstraint('id')
+    )
+    with op.batch_alter_table('index_outbox', schema=None) as batch_op:
+        batch_op.create_index(batch_op.f('ix_index_outbox_available_at'), ['available_at'], unique=False)
+
+
+def downgrade():
+    with op.batch_alter_table('index_outbox', schema=None) as batch_op:
+        batch_op.drop_index(batch_op.f('ix_index_outbox_available_at'))
+
+    op.drop_table('index_outbox')
@@ -0,0 +1,42 @@
+"""Add FTS5 full-text index for sessions and segments.
+
+Revision ID: c52f8a3e9d10
+Revises: a41c6e9d2b17
+Create Date: 2026-10-17 14:25:41.208337
+
+"""
+from alembic import op
+
+from fulltext_service import (
+    FULLTEXT_TABLES, drop_fulltext_ddl, fulltext_ddl, rebuild_fulltext_table, register_sqlite_functions
+)
+
+
+# revision identifiers, used by Alembic.
+revision = 'c52f8a3e9d10'
+down_revision = 'a41c6e9d2b17'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    bind = op.get_bind()
+    if bind.dialect.name != 'sqlite':
+        return
+
+    # 觸發器和回填都會呼叫 jieba_segment()，遷移連線可能早於監聽器建立
+    register_sqlite_functions(bind.connection.dbapi_connection)
+    for spec in FULLTEXT_TABLES.values():
+        for statement in fulltext_ddl(spec):
+            op.execute(statement)
+        rebuild_fulltext_table(bind, spec)
+
+
+def downgrade():
+    bind = op.get_bind()
+    if bind.dialect.name != 'sqlite':
+        return
+
+    for spec in FULLTEXT_TABLES.values():
+        for statement in drop_fulltext_ddl(spec):
+            op.execute(statement)
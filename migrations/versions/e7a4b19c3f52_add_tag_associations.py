@@ -0,0 +1,54 @@
+"""Add materialized tag association table and index state.
+
+Revision ID: e7a4b19c3f52
+Revises: c52f8a3e9d10
+Create Date: 2026-10-17 18:36:12.904417
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'e7a4b19c3f52'
+down_revision = 'c52f8a3e9d10'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('tag_associations',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('relation_type', sa.String(length=30), nullable=False),
+    sa.Column('source_tag_id', sa.Integer(), nullable=False),
+    sa.Column('target_tag_id', sa.Integer(), nullable=False),
+    sa.Column('support', sa.Integer(), nullable=False),
+    sa.Column('strength', sa.Float(), nullable=False),
+    sa.Column('example_segment_ids', sa.Text(), nullable=True),
+    sa.Column('updated_at', sa.DateTime(), nullable=True),
+    sa.ForeignKeyConstraint(['source_tag_id'], ['tags.id'], ondelete='CASCADE'),
+    sa.ForeignKeyConstraint(['target_tag_id'], ['tags.id'], ondelete='CASCADE'),
+    sa.PrimaryKeyConstraint('id'),
+    sa.UniqueConstraint('relation_type', 'source_tag_id', 'target_tag_id', name='uq_tag_associations_pair')
+    )
+    with op.batch_alter_table('tag_associations', schema=None) as batch_op:
+        batch_op.create_index('ix_tag_associations_lookup', ['relation_type', 'source_tag_id', 'support'], unique=False)
+        batch_op.create_index('ix_tag_associations_target', ['target_tag_id'], unique=False)
+
+    op.create_table('index_state',
+    sa.Column('name', sa.String(length=50), nullable=False),
+    sa.Column('fingerprint', sa.String(length=64), nullable=True),
+    sa.Column('updated_at', sa.DateTime(), nullable=True),
+    sa.PrimaryKeyConstraint('name')
+    )
+    # 資料由應用程式在第一次診斷查詢時建立（指紋不存在即全量建立）
+
+
+def downgrade():
+    op.drop_table('index_state')
+
+    with op.batch_alter_table('tag_associations', schema=None) as batch_op:
+        batch_op.drop_index('ix_tag_associations_target')
+        batch_op.drop_index('ix_tag_associations_lookup')
+
+    op.drop_table('tag_associations')
@@ -1,6 +1,6 @@
 from datetime import datetime
 from flask_sqlalchemy import SQLAlchemy
-from sqlalchemy import Table, Column, Integer, ForeignKey
+from sqlalchemy import Table, Column, Integer, ForeignKey, Index, UniqueConstraint
 from sqlalchemy.orm import relationship
 
 db = SQLAlchemy()
@@ -68,6 +68,10 @@ class Session(db.Model):
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
     updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
     
+    # 向量索引同步狀態
+    vector_synced_at = db.Column(db.DateTime)
+    vector_hash = db.Column(db.String(64))
+    
     # 關聯
     tags = relationship('Tag', secondary=session_tags, backref='sessions')
     segments = relationship('Segment', backref='session', lazy='dynamic', cascade='all, delete-orphan')
@@ -82,6 +86,11 @@ class Segment(db.Model):
     content = db.Column(db.Text)
     order_index = db.Column(db.Integer, default=0)
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+    
+    # 向量索引同步狀態
+    vector_synced_at = db.Column(db.DateTime)
+    vector_hash = db.Column(db.String(64))
     
     # 關聯
     tags = relationship('Tag', secondary=segment_tags, backref='segments')
@@ -116,3 +125,50 @@ class QueryRelation(db.Model):
     strength = db.Column(db.Float, default=1.0)  # 關聯強度
     notes = db.Column(db.Text)
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+# 向量索引待處理事件（transactional outbox）
+class IndexOutbox(db.Model):
+    __tablename__ = 'index_outbox'
+    
+    id = db.Column(db.Integer, primary_key=True)
+    entity_type = db.Column(db.String(20), nullable=False)  # session/segment
+    entity_id = db.Column(db.Integer, nullable=False)
+    operation = db.Column(db.String(10), nullable=False, default='upsert')  # upsert/delete
+    attempts = db.Column(db.Integer, nullable=False, default=0)
+    last_error = db.Column(db.Text)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    available_at = db.Column(db.DateTime, default=datetime.utcnow, index=True)  # 重試前不會被處理
+    
+    @classmethod
+    def enqueue(cls, entity_type, entity_id, operation='upsert'):
+        """在當前交易中加入一筆索引事件，隨資料變更一起提交"""
+        event = cls(entity_type=entity_type, entity_id=entity_id, operation=operation)
+        db.session.add(event)
+        return event
+
+# 物化的標籤關聯（症狀->病因、病因->手法、手法->位置），由 tag_associations 模組增量維護
+class TagAssociation(db.Model):
+    __tablename__ = 'tag_associations'
+    __table_args__ = (
+        UniqueConstraint('relation_type', 'source_tag_id', 'target_tag_id', name='uq_tag_associations_pair'),
+        # 診斷查詢：WHERE relation_type = ? AND source_tag_id IN (...) ORDER BY support DESC
+        Index('ix_tag_associations_lookup', 'relation_type', 'source_tag_id', 'support'),
+        Index('ix_tag_associations_target', 'target_tag_id'),
+    )
+    
+    id = db.Column(db.Integer, primary_key=True)
+    relation_type = db.Column(db.String(30), nullable=False)  # symptom_to_cause/cause_to_treatment/method_to_location
+    source_tag_id = db.Column(db.Integer, ForeignKey('tags.id', ondelete='CASCADE'), nullable=False)
+    target_tag_id = db.Column(db.Integer, ForeignKey('tags.id', ondelete='CASCADE'), nullable=False)
+    support = db.Column(db.Integer, nullable=False, default=0)  # 同時帶有兩個標籤的段落數
+    strength = db.Column(db.Float, nullable=False, default=0.0)  # 支持段落數 / 帶有來源標籤的段落數
+    example_segment_ids = db.Column(db.Text)  # JSON 陣列，最新的數個段落
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+# 衍生資料的同步狀態（記錄建立時來源資料的指紋，啟動時據此判斷是否需要重建）
+class IndexState(db.Model):
+    __tablename__ = 'index_state'
+    
+    name = db.Column(db.String(50), primary_key=True)
+    fingerprint = db.Column(db.String(64))
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow)
@@ -0,0 +1,661 @@
+"""
+標籤關聯圖譜模組
+在記憶體中維護標籤的稀疏共現矩陣（同一段落、同一課程中共同出現的次數），
+讓關聯圖譜以鄰接查詢建立，不必為每個標籤掃描段落與課程。
+
+- 每個段落 / 課程的標籤集合變更時，只對新舊集合的差異增減共現計數
+- 透過 change_tracking 的提交通知記錄變更的段落、課程與標籤，下一次查詢時只重新讀取這些資料列
+- 以快照持久化；啟動時以關聯表資料列的摘要確認快照仍然有效
+"""
+
+import os
+import heapq
+import atexit
+import pickle
+import hashlib
+import logging
+import threading
+from collections import Counter
+from dataclasses import dataclass
+from typing import Any, Callable, Dict, FrozenSet, Iterable, List, Optional, Set, Tuple
+
+from caching import LRUCache
+from change_tracking import ChangeSet, subscribe
+from models import Tag, db, segment_tags, session_tags
+
+logger = logging.getLogger(__name__)
+
+COOCCURRENCE_SNAPSHOT_PATH = os.environ.get('TAG_COOCCURRENCE_PATH', './chroma_db/tag_cooccurrence.pickle')
+
+# 關聯圖譜的預設節點 / 連線上限（前端力導向佈局在數百個節點後明顯變慢）
+GRAPH_MAX_NODES = int(os.environ.get('RELATION_GRAPH_MAX_NODES', 150))
+GRAPH_MAX_LINKS = int(os.environ.get('RELATION_GRAPH_MAX_LINKS', 400))
+# 關聯圖譜展開的最大層級
+GRAPH_MAX_DEPTH = int(os.environ.get('RELATION_GRAPH_MAX_DEPTH', 5))
+# 關聯圖譜回應快取的條目上限
+RELATION_GRAPH_CACHE_SIZE = int(os.environ.get('RELATION_GRAPH_CACHE_SIZE', 256))
+
+# 快照格式版本；修改資料結構或指紋格式時需遞增
+SNAPSHOT_FORMAT = 2
+# 計算指紋時每批讀取的資料列數
+FINGERPRINT_BATCH = 10000
+
+# 共現層級與對應的關聯表欄位
+LEVELS = {
+    'segment': (segment_tags, segment_tags.c.segment_id),
+    'session': (session_tags, session_tags.c.session_id)
+}
+
+
+@dataclass
+class TagInfo:
+    name: str
+    category: Optional[str]
+    color: Optional[str]
+
+
+def rows_digest(*columns) -> Tuple[int, str]:
+    """
+    依欄位排序後逐列計算的資料列數與 SHA-1 摘要
+
+    與加總式校驗和不同，兩列之間交換值（例如兩個段落互換標籤）也會改變摘要
+    """
+    digest = hashlib.sha1()
+    count = 0
+    for row in db.session.query(*columns).order_by(*columns).yield_per(FINGERPRINT_BATCH):
+        digest.update(repr(tuple(row)).encode('utf-8'))
+        count += 1
+    return count, digest.hexdigest()
+
+
+def relation_type(source_category: Optional[str], target_category: Optional[str]) -> str:
+    """根據標籤分類確定關係類型"""
+    if source_category == '症狀' and target_category == '病因':
+        return 'symptom_to_cause'
+    elif source_category == '病因' and target_category == '手法':
+        return 'cause_to_treatment'
+    elif source_category == '手法' and target_category == '位置':
+        return 'method_to_location'
+    elif source_category == target_category:
+        return 'same_category'
+    else:
+        return 'co_occurrence'
+
+
+class TagCooccurrence:
+    """段落層級與課程層級的標籤共現計數（執行緒安全）"""
+
+    def __init__(self, snapshot_path: Optional[str] = COOCCURRENCE_SNAPSHOT_PATH):
+        self.snapshot_path = snapshot_path
+        self._lock = threading.RLock()
+        self._tags: Dict[int, TagInfo] = {}
+        self._by_category: Dict[Optional[str], List[int]] = {}
+        self._reset_links()
+        # 每次共現或標籤資料改變時遞增；並記錄每個標籤、分類最後一次改變時的版本，供快取判斷失效範圍
+        self.version = 0
+        self._built_version = 0
+        self._tag_changed: Dict[int, int] = {}
+        self._category_changed: Dict[Optional[str], int] = {}
+        self._touched_categories: Set[Optional[str]] = set()
+
+        # 等待套用的變更（由提交通知寫入，查詢時套用）
+        self._pending_lock = threading.Lock()
+        self._stale = True
+        self._tags_stale = False
+        self._dirty: Dict[str, Set[int]] = {'segment': set(), 'session': set(), 'tag': set()}
+        self._unsaved = False
+
+    def _reset_links(self):
+        # 層級 -> 資料列 ID -> 標籤集合
+        self._rows: Dict[str, Dict[int, FrozenSet[int]]] = {level: {} for level in LEVELS}
+        # 層級 -> 標籤 ID -> 使用此標籤的資料列
+        self._members: Dict[str, Dict[int, Set[int]]] = {level: {} for level in LEVELS}
+        # 層級 -> 標籤 ID -> {另一標籤 ID: 共現次數}（對稱）
+        self._pairs: Dict[str, Dict[int, Counter]] = {level: {} for level in LEVELS}
+
+    # ------------------------------------------------------------------
+    # 變更通知與重新整理
+
+    def on_change(self, changes: ChangeSet):
+        if not changes.affects('tag', 'segment', 'session'):
+            return
+        with self._pending_lock:
+            # 批量更新只會改到資料表本身的欄位；批量刪除可能連帶移除關聯表資料列
+            if changes.bulk_deleted & {'tag', 'segment', 'session'}:
+                self._stale = True
+            if 'tag' in changes.bulk:
+                self._tags_stale = True
+            for kind in ('segment', 'session', 'tag'):
+                self._dirty[kind] |= changes.ids(kind) | changes.ids(kind, deleted=True)
+
+    def refresh(self) -> Set[int]:
+        """
+        套用等待中的變更（需在應用程式上下文中呼叫）
+
+        Returns:
+            共現或資料有變動的標籤 ID（全量重建時返回空集合，並遞增 version）
+        """
+        with self._pending_lock:
+            stale, self._stale = self._stale, False
+            tags_stale, self._tags_stale = self._tags_stale, False
+            dirty = self._dirty
+            self._dirty = {'segment': set(), 'session': set(), 'tag': set()}
+        if not (stale or tags_stale or any(dirty.values())):
+            return set()
+
+        try:
+            with self._lock:
+                if stale:
+                    self._build()
+                    return set()
+                touched = set()
+                self._touched_categories = set()
+                if tags_stale or dirty['tag']:
+                    touched |= self._load_tags(None if tags_stale else dirty['tag'])
+                for level in LEVELS:
+                    if dirty[level]:
+                        touched |= self._load_rows(level, dirty[level])
+                if touched:
+                    self.version += 1
+                    self._unsaved = True
+                    for tag_id in touched:
+                        self._tag_changed[tag_id] = self.version
+                    for category in self._touched_categories:
+                        self._category_changed[category] = self.version
+                return touched
+        except Exception:
+            # 讀取失敗時保留變更，下一次查詢重試
+            with self._pending_lock:
+                self._stale = self._stale or stale
+                self._tags_stale = self._tags_stale or tags_stale
+                for kind, ids in dirty.items():
+                    self._dirty[kind] |= ids
+            raise
+
+    def _build(self):
+        """載入快照（關聯表未變時）或從關聯表全量建立"""
+        self._tags, self._by_category = {}, {}
+        self._load_tags(None)
+
+        fingerprint = self._fingerprint()
+        snapshot = self._read_snapshot()
+        if snapshot is not None and snapshot.get("fingerprint") == fingerprint:
+            self._rows, self._members, self._pairs = snapshot["rows"], snapshot["members"], snapshot["pairs"]
+            # 快照之後被刪除的標籤
+            for tag_id in [tag_id for level in LEVELS for tag_id in self._members[level]
+                           if tag_id not in self._tags]:
+                self._drop_tag(tag_id)
+            source = "快照"
+        else:
+            self._reset_links()
+            for level, (table, row_column) in LEVELS.items():
+                grouped: Dict[int, Set[int]] = {}
+                for row_id, tag_id in db.session.query(row_column, table.c.tag_id):
+                    if row_id is not None and tag_id is not None:
+                        grouped.setdefault(row_id, set()).add(tag_id)
+                for row_id, tag_ids in grouped.items():
+                    self._set_row_tags(level, row_id, frozenset(tag_ids))
+            source = "關聯表"
+            self._save_snapshot(fingerprint)
+
+        self.version += 1
+        self._built_version = self.version
+        self._tag_changed, self._category_changed = {}, {}
+        logger.info(f"標籤共現矩陣已從{source}載入：{len(self._tags)} 個標籤，"
+                    f"{sum(len(rows) for rows in self._rows.values())} 個資料列")
+
+    def _load_tags(self, tag_ids: Optional[Set[int]]) -> Set[int]:
+        query = db.session.query(Tag.id, Tag.name, Tag.category, Tag.color)
+        if tag_ids is not None:
+            query = query.filter(Tag.id.in_(tag_ids))
+        found = set()
+        for tag_id, name, category, color in query:
+            found.add(tag_id)
+            previous = self._tags.get(tag_id)
+            if previous is not None and previous.category != category:
+                self._by_category[previous.category].remove(tag_id)
+                self._touched_categories.add(previous.category)
+            if previous is None or previous.category != category:
+                self._by_category.setdefault(category, []).append(tag_id)
+                self._by_category[category].sort()
+                self._touched_categories.add(category)
+            self._tags[tag_id] = TagInfo(name, category, color)
+        missing = (set(self._tags) if tag_ids is None else tag_ids) - found
+        for tag_id in missing:
+            self._drop_tag(tag_id)
+        return found | missing
+
+    def _drop_tag(self, tag_id: int):
+        info = self._tags.pop(tag_id, None)
+        if info is not None:
+            self._by_category[info.category].remove(tag_id)
+            self._touched_categories.add(info.category)
+        for level in LEVELS:
+            for row_id in list(self._members[level].get(tag_id, ())):
+                self._set_row_tags(level, row_id, self._rows[level][row_id] - {tag_id})
+
+    def _load_rows(self, level: str, row_ids: Set[int]) -> Set[int]:
+        table, row_column = LEVELS[level]
+        current: Dict[int, Set[int]] = {row_id: set() for row_id in row_ids}
+        for row_id, tag_id in db.session.query(row_column, table.c.tag_id).filter(row_column.in_(row_ids)):
+            if tag_id is not None:
+                current[row_id].add(tag_id)
+
+        touched = set()
+        for row_id, tag_ids in current.items():
+            before = self._rows[level].get(row_id, frozenset())
+            after = frozenset(tag_ids)
+            if before != after:
+                # 共現計數改變的還包括未變動的標籤（與新增 / 移除的標籤成對）
+                touched |= before | after
+                self._set_row_tags(level, row_id, after)
+        return touched
+
+    def _set_row_tags(self, level: str, row_id: int, tag_ids: FrozenSet[int]):
+        """以新舊標籤集合的差異更新成員與共現計數"""
+        rows, members, pairs = self._rows[level], self._members[level], self._pairs[level]
+        before = rows.get(row_id, frozenset())
+        if before == tag_ids:
+            return
+
+        remaining = set(before)
+        for tag_id in before - tag_ids:
+            remaining.discard(tag_id)
+            for other in remaining:
+                self._add_pair(pairs, tag_id, other, -1)
+            members[tag_id].discard(row_id)
+            if not members[tag_id]:
+                del members[tag_id]
+        kept = before & tag_ids
+        for tag_id in tag_ids - before:
+            for other in kept:
+                self._add_pair(pairs, tag_id, other, 1)
+            kept = kept | {tag_id}
+            members.setdefault(tag_id, set()).add(row_id)
+
+        if tag_ids:
+            rows[row_id] = tag_ids
+        else:
+            rows.pop(row_id, None)
+
+    @staticmethod
+    def _add_pair(pairs: Dict[int, Counter], a: int, b: int, delta: int):
+        for x, y in ((a, b), (b, a)):
+            counter = pairs.setdefault(x, Counter())
+            counter[y] += delta
+            if counter[y] <= 0:
+                del counter[y]
+                if not counter:
+                    del pairs[x]
+
+    # ------------------------------------------------------------------
+    # 持久化
+
+    def _fingerprint(self) -> Tuple:
+        """關聯表的資料列數與 (資料列, 標籤) 摘要，用於判斷快照是否仍然有效"""
+        values = []
+        for table, row_column in LEVELS.values():
+            values.extend(rows_digest(row_column, table.c.tag_id))
+        return tuple(values)
+
+    def _read_snapshot(self) -> Optional[Dict[str, Any]]:
+        if not self.snapshot_path or not os.path.exists(self.snapshot_path):
+            return None
+        try:
+            with open(self.snapshot_path, 'rb') as f:
+                snapshot = pickle.load(f)
+            return snapshot if snapshot.get("format") == SNAPSHOT_FORMAT else None
+        except Exception as e:
+            logger.warning(f"讀取標籤共現快照失敗，重新建立: {e}")
+            return None
+
+    def _save_snapshot(self, fingerprint: Tuple):
+        if not self.snapshot_path:
+            return
+        try:
+            directory = os.path.dirname(self.snapshot_path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            tmp_path = self.snapshot_path + ".tmp"
+            with open(tmp_path, 'wb') as f:
+                pickle.dump({
+                    "format": SNAPSHOT_FORMAT,
+                    "fingerprint": fingerprint,
+                    "rows": self._rows,
+                    "members": self._members,
+                    "pairs": self._pairs
+                }, f, protocol=pickle.HIGHEST_PROTOCOL)
+            os.replace(tmp_path, self.snapshot_path)
+            self._unsaved = False
+        except Exception as e:
+            logger.warning(f"寫入標籤共現快照失敗: {e}")
+
+    def _has_pending(self) -> bool:
+        with self._pending_lock:
+            return self._stale or self._tags_stale or any(self._dirty.values())
+
+    def save(self, app=None):
+        """
+        有未保存的增量變更時寫入快照（指紋需查詢資料庫，需要應用程式上下文）
+
+        先套用等待中的變更：已提交但未套用的資料列會改變指紋，
+        若直接保存，過期的矩陣會以與資料庫一致的指紋寫入，下次啟動時被誤用。
+        """
+        if not self._unsaved or not self.snapshot_path:
+            return
+        if app is not None:
+            with app.app_context():
+                self.save()
+            return
+        try:
+            self.refresh()
+        except Exception as e:
+            logger.warning(f"套用共現變更失敗，不寫入快照: {e}")
+            return
+        with self._lock:
+            if not self._unsaved:
+                return
+            fingerprint = self._fingerprint()
+            # 計算指紋期間又有提交時，矩陣可能落後於指紋，留待下次保存
+            if self._has_pending():
+                logger.info("共現矩陣仍有等待中的變更，略過快照寫入")
+                return
+            self._save_snapshot(fingerprint)
+
+    # ------------------------------------------------------------------
+    # 查詢
+
+    def changed_since(self, version: int, tag_ids: Iterable[int], categories: Iterable[Optional[str]]) -> bool:
+        """指定版本之後，這些標籤的共現或資料、或這些分類的成員是否改變過"""
+        with self._lock:
+            if version < self._built_version:
+                return True
+            return (any(self._tag_changed.get(tag_id, 0) > version for tag_id in tag_ids)
+                    or any(self._category_changed.get(category, 0) > version for category in categories))
+
+    def changed_tags_since(self, version: int) -> Optional[Set[int]]:
+        """指定版本之後共現或資料改變過的標籤；期間曾全量重建時返回 None"""
+        with self._lock:
+            if version < self._built_version:
+                return None
+            return {tag_id for tag_id, changed in self._tag_changed.items() if changed > version}
+
+    def tag(self, tag_id: int) -> Optional[TagInfo]:
+        return self._tags.get(tag_id)
+
+    def neighbors(self, tag_id: int, level: str = 'segment') -> Dict[int, int]:
+        """與指定標籤共現的標籤及次數"""
+        with self._lock:
+            return dict(self._pairs[level].get(tag_id, {}))
+
+    def usage(self, tag_id: int, level: str = 'segment') -> int:
+        with self._lock:
+            return len(self._members[level].get(tag_id, ()))
+
+    def same_category(self, tag_id: int, limit: int = 3) -> List[int]:
+        info = self._tags.get(tag_id)
+        if info is None:
+            return []
+        with self._lock:
+            return [other for other in self._by_category.get(info.category, []) if other != tag_id][:limit]
+
+    def top_neighbors(self, tag_id: int, category: str, limit: int = 5) -> List[int]:
+        """在同一段落中最常共現的指定分類標籤"""
+        with self._lock:
+            counts = self._pairs['segment'].get(tag_id, {})
+            candidates = [other for other in counts if self._tags.get(other) and self._tags[other].category == category]
+        return sorted(candidates, key=lambda other: (-counts[other], other))[:limit]
+
+    def related_tags(self, tag_id: int) -> Dict[int, Dict[str, Any]]:
+        """
+        與指定標籤相關的標籤
+
+        Returns:
+            {標籤 ID: {'type': 關係類型, 'strength': 強度, 'co_occurrence': 段落共現次數}}
+        """
+        self.refresh()
+        with self._lock:
+            source = self._tags.get(tag_id)
+            if source is None:
+                return {}
+            related: Dict[int, Dict[str, Any]] = {}
+
+            def category_of(other):
+                return self._tags[other].category if other in self._tags else None
+
+            # 1. 在同一段落中共現的標籤
+            for other, count in self._pairs['segment'].get(tag_id, {}).items():
+                related[other] = {
+                    'type': relation_type(source.category, category_of(other)),
+                    'strength': 0.1 + 0.1 * count,
+                    'co_occurrence': count
+                }
+
+            # 2. 在同一課程中的標籤
+            for other, count in self._pairs['session'].get(tag_id, {}).items():
+                entry = related.get(other)
+                if entry is None:
+                    related[other] = {
+                        'type': relation_type(source.category, category_of(other)),
+                        'strength': 0.05 + 0.05 * count,
+                        'co_occurrence': 0
+                    }
+                else:
+                    entry['strength'] += 0.05 * count
+
+            # 3. 根據分類關係
+            for other in self.same_category(tag_id):
+                related.setdefault(other, {'type': 'same_category', 'strength': 0.3, 'co_occurrence': 0})
+
+            # 4. 特定關係邏輯：症狀 -> 病因、病因 -> 治療方法
+            patterns = {'症狀': ('病因', 'symptom_to_cause', 0.8), '病因': ('手法', 'cause_to_treatment', 0.7)}
+            if source.category in patterns:
+                target_category, pattern_type, strength = patterns[source.category]
+                for other in self.top_neighbors(tag_id, target_category):
+                    related[other] = {'type': pattern_type, 'strength': strength, 'co_occurrence': 0}
+
+            for entry in related.values():
+                entry['strength'] = round(entry['strength'], 4)
+            return related
+
+
+def build_tag_graph(cooccurrence: TagCooccurrence, start_tag_id: int, depth: int = 2,
+                    max_nodes: int = GRAPH_MAX_NODES, max_links: int = GRAPH_MAX_LINKS,
+                    default_colors: Optional[Dict[str, str]] = None) -> Dict[str, Any]:
+    """
+    以最佳優先順序展開關聯圖譜
+
+    從起始標籤出發，每次取出強度最高的候選連線；新節點在層級未超過 depth 時再展開其鄰居。
+    節點與連線數達到上限後停止加入，回應中的 truncated 表示是否有關聯因上限被略過。
+    展開的節點數不超過 max_nodes，因此成本與起始標籤的連接數無關。
+
+    Returns:
+        前端 relation-graph.js 使用的 nodes / links 格式
+    """
+    default_colors = default_colors or {}
+    nodes: Dict[str, Dict[str, Any]] = {}
+    links: List[Dict[str, Any]] = []
+    link_keys: Set[Tuple[str, str]] = set()
+    degree: Counter = Counter()
+    truncated = False
+
+    def add_node(tag_id: int, level: int) -> str:
+        node_id = f"tag_{tag_id}"
+        info = cooccurrence.tag(tag_id)
+        nodes[node_id] = {
+            'id': node_id,
+            'name': info.name,
+            'category': info.category,
+            'color': info.color or default_colors.get(info.category, '#6c757d'),
+            'type': 'tag',
+            'level': level
+        }
+        return node_id
+
+    # 候選連線：(-強度, 序號, 來源標籤, 目標標籤, 來源層級, 關係資訊)
+    frontier: List[Tuple[float, int, int, int, int, Dict[str, Any]]] = []
+    sequence = 0
+
+    def expand(tag_id: int, level: int):
+        nonlocal sequence
+        related = cooccurrence.related_tags(tag_id)
+        # 每個節點最多提供 max_links 條候選，避免高連接度的標籤塞滿候選佇列
+        strongest = heapq.nlargest(max_links, related.items(), key=lambda item: item[1]['strength'])
+        for related_id, info in strongest:
+            if related_id != tag_id and cooccurrence.tag(related_id) is not None:
+                heapq.heappush(frontier, (-info['strength'], sequence, tag_id, related_id, level, info))
+                sequence += 1
+
+    cooccurrence.refresh()
+    if cooccurrence.tag(start_tag_id) is None:
+        return {'nodes': [], 'links': [], 'message': '找不到起始標籤'}
+    add_node(start_tag_id, 0)
+    if depth >= 0:
+        expand(start_tag_id, 0)
+
+    while frontier:
+        if len(links) >= max_links:
+            truncated = True
+            break
+        _, _, source_id, target_id, level, info = heapq.heappop(frontier)
+        source_node, target_node = f"tag_{source_id}", f"tag_{target_id}"
+        key = (source_node, target_node) if source_node < target_node else (target_node, source_node)
+        if key in link_keys:
+            continue
+
+        if target_node not in nodes:
+            if len(nodes) >= max_nodes:
+                truncated = True
+                continue
+            add_node(target_id, level + 1)
+            if level + 1 <= depth:
+                expand(target_id, level + 1)
+
+        link_keys.add(key)
+        degree[source_node] += 1
+        degree[target_node] += 1
+        links.append({
+            'id': f"{source_node}_{target_node}",
+            'source': source_node,
+            'target': target_node,
+            'relation_type': info['type'],
+            'strength': info['strength'],
+            'value': info['strength'] * 10  # 用於可視化中的連線粗細
+        })
+
+    # 節點的重要性（連接數）
+    for node_id, node in nodes.items():
+        node['importance'] = degree[node_id]
+        node['size'] = max(10, min(30, 10 + degree[node_id] * 2))
+
+    return {
+        'nodes': list(nodes.values()),
+        'links': links,
+        'center_node': f"tag_{start_tag_id}",
+        'total_nodes': len(nodes),
+        'total_links': len(links),
+        'max_depth': depth,
+        'max_nodes': max_nodes,
+        'max_links': max_links,
+        'truncated': truncated
+    }
+
+
+@dataclass
+class _CachedGraph:
+    payload: Dict[str, Any]
+    version: int
+    tag_ids: FrozenSet[int]
+    categories: FrozenSet[Optional[str]]
+
+
+class RelationGraphCache:
+    """
+    關聯圖譜回應的快取
+
+    鍵為 (起始標籤 ID, 深度, 節點上限, 連線上限, 佈局方式)，伺服器端佈局的座標隨圖譜一起快取。
+    條目記錄建立時的共現矩陣版本與圖中的標籤、分類；只有這些標籤的共現或資料、
+    或這些分類的成員在之後改變時才失效，其他標籤的變更不影響。
+    """
+
+    def __init__(self, cooccurrence: TagCooccurrence, max_size: int = 256):
+        self.cooccurrence = cooccurrence
+        self._cache = LRUCache(max_size=max_size)
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+        self._stats_lock = threading.Lock()
+
+    def get_or_build(self, start_tag_id: int, depth: int, max_nodes: int, max_links: int,
+                     build: Callable[[], Dict[str, Any]],
+                     layout: Optional[str] = None) -> Tuple[Dict[str, Any], Optional[float]]:
+        """
+        Returns:
+            (圖譜資料, 快取存放秒數)；重新建立時秒數為 None
+        """
+        key = (start_tag_id, depth, max_nodes, max_links, layout)
+        self.cooccurrence.refresh()
+
+        cached = self._cache.get_with_age(key)
+        if cached is not None:
+            entry, age = cached
+            if not self.cooccurrence.changed_since(entry.version, entry.tag_ids, entry.categories):
+                with self._stats_lock:
+                    self.hits += 1
+                return entry.payload, age
+            self._cache.invalidate(key)
+            with self._stats_lock:
+                self.invalidations += 1
+
+        with self._stats_lock:
+            self.misses += 1
+        # 先記錄版本再建立：建立期間套用的變更會使此條目在下次讀取時失效
+        version = self.cooccurrence.version
+        payload = build()
+        tag_ids = frozenset(int(node['id'].split('_', 1)[1]) for node in payload.get('nodes', []))
+        categories = frozenset(node.get('category') for node in payload.get('nodes', []))
+        if not payload.get('error'):
+            self._cache.set(key, _CachedGraph(payload, version, tag_ids, categories))
+        return payload, None
+
+    def stats(self) -> Dict[str, Any]:
+        lookups = self.hits + self.misses
+        return {
+            "size": len(self._cache),
+            "max_size": self._cache.max_size,
+            "hits": self.hits,
+            "misses": self.misses,
+            "invalidations": self.invalidations,
+            "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+            "evictions": self._cache.evictions
+        }
+
+
+# 全局實例（單例模式）
+_tag_cooccurrence: Optional[TagCooccurrence] = None
+_cooccurrence_lock = threading.Lock()
+
+
+_relation_graph_cache: Optional[RelationGraphCache] = None
+
+
+def get_tag_cooccurrence(app=None) -> TagCooccurrence:
+    global _tag_cooccurrence
+    if _tag_cooccurrence is None:
+        with _cooccurrence_lock:
+            if _tag_cooccurrence is None:
+                _tag_cooccurrence = TagCooccurrence()
+                subscribe(_tag_cooccurrence.on_change)
+                if app is not None:
+                    atexit.register(_tag_cooccurrence.save, app)
+    return _tag_cooccurrence
+
+
+def get_relation_graph_cache(app=None) -> RelationGraphCache:
+    global _relation_graph_cache
+    if _relation_graph_cache is None:
+        cooccurrence = get_tag_cooccurrence(app)
+        with _cooccurrence_lock:
+            if _relation_graph_cache is None:
+                _relation_graph_cache = RelationGraphCache(cooccurrence, RELATION_GRAPH_CACHE_SIZE)
+    return _relation_graph_cache
@@ -0,0 +1,186 @@
+"""
+搜尋過濾條件模組
+同一組條件可轉換為向量存儲的 where 子句，也可轉換為 SQL 查詢的過濾條件，
+讓語義搜尋與關鍵字搜尋得到一致的結果範圍
+"""
+
+import calendar
+from dataclasses import dataclass, field
+from datetime import date, datetime, time
+from typing import Any, Dict, List, Optional
+
+from models import Session, Segment, Tag
+
+
+def tag_metadata_key(tag_id: int) -> str:
+    """向量元數據中的標籤欄位名稱（每個標籤一個布林欄位，可直接用於 where 等值比較）"""
+    return f"tag_{tag_id}"
+
+
+def date_to_timestamp(value) -> Optional[int]:
+    """將日期轉換為 UTC 當日零時的 Unix 時間戳，供向量存儲的範圍比較使用"""
+    if value is None:
+        return None
+    if isinstance(value, datetime):
+        value = value.date()
+    return calendar.timegm(value.timetuple())
+
+
+def _parse_date(value) -> Optional[date]:
+    if not value:
+        return None
+    if isinstance(value, datetime):
+        return value.date()
+    if isinstance(value, date):
+        return value
+    return datetime.fromisoformat(str(value)).date()
+
+
+def _parse_ids(values) -> List[int]:
+    if not values:
+        return []
+    if not isinstance(values, (list, tuple, set)):
+        values = [values]
+    return [int(value) for value in values]
+
+
+@dataclass
+class SearchFilters:
+    """結構化搜尋過濾條件"""
+    tag_ids: List[int] = field(default_factory=list)
+    tag_match: str = "any"  # any：符合任一標籤；all：需同時擁有全部標籤
+    session_ids: List[int] = field(default_factory=list)
+    segment_types: List[str] = field(default_factory=list)
+    date_from: Optional[date] = None
+    date_to: Optional[date] = None
+    content_type: Optional[str] = None  # session / segment
+
+    @classmethod
+    def from_dict(cls, data: Optional[Dict[str, Any]]) -> "SearchFilters":
+        """
+        從請求參數建立過濾條件
+
+        Raises:
+            ValueError: 參數格式錯誤
+        """
+        data = data or {}
+
+        tag_ids = _parse_ids(data.get('tag_ids'))
+        tag_names = data.get('tags') or []
+        if tag_names:
+            if isinstance(tag_names, str):
+                tag_names = [tag_names]
+            tag_ids += [tag_id for (tag_id,) in Tag.query.with_entities(Tag.id)
+                        .filter(Tag.name.in_(tag_names))]
+            # 指定的標籤名稱都不存在時，結果必須為空，而不是忽略條件
+            if not tag_ids:
+                tag_ids = [-1]
+
+        tag_match = data.get('tag_match', 'any')
+        if tag_match not in ('any', 'all'):
+            raise ValueError("tag_match 必須為 any 或 all")
+
+        content_type = data.get('content_type') or None
+        if content_type not in (None, 'session', 'segment'):
+            raise ValueError("content_type 必須為 session 或 segment")
+
+        segment_types = data.get('segment_types') or []
+        if isinstance(segment_types, str):
+            segment_types = [segment_types]
+
+        return cls(
+            tag_ids=sorted(set(tag_ids)),
+            tag_match=tag_match,
+            session_ids=_parse_ids(data.get('session_ids')),
+            segment_types=list(segment_types),
+            date_from=_parse_date(data.get('date_from')),
+            date_to=_parse_date(data.get('date_to')),
+            content_type=content_type
+        )
+
+    def is_empty(self) -> bool:
+        return not (self.tag_ids or self.session_ids or self.segment_types
+                    or self.date_from or self.date_to or self.content_type)
+
+    def includes(self, content_type: str) -> bool:
+        """此條件下是否可能有該類型的結果（段落類型條件只適用於段落）"""
+        if self.content_type and self.content_type != content_type:
+            return False
+        return not (content_type == 'session' and self.segment_types)
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            'tag_ids': self.tag_ids,
+            'tag_match': self.tag_match,
+            'session_ids': self.session_ids,
+            'segment_types': self.segment_types,
+            'date_from': self.date_from.isoformat() if self.date_from else None,
+            'date_to': self.date_to.isoformat() if self.date_to else None,
+            'content_type': self.content_type
+        }
+
+    def to_where(self) -> Optional[Dict[str, Any]]:
+        """轉換為向量存儲的 where 子句；沒有條件時返回 None"""
+        clauses = []
+        if self.content_type:
+            clauses.append({"type": self.content_type})
+        if self.segment_types:
+            clauses.append({"segment_type": {"$in": self.segment_types}})
+        if self.session_ids:
+            clauses.append({"session_id": {"$in": self.session_ids}})
+        if self.date_from:
+            clauses.append({"date_ts": {"$gte": date_to_timestamp(self.date_from)}})
+        if self.date_to:
+            clauses.append({"date_ts": {"$lte": date_to_timestamp(self.date_to)}})
+        if self.tag_ids:
+            tag_clauses = [{tag_metadata_key(tag_id): True} for tag_id in self.tag_ids]
+            if len(tag_clauses) == 1:
+                clauses.append(tag_clauses[0])
+            elif self.tag_match == 'all':
+                clauses.extend(tag_clauses)
+            else:
+                clauses.append({"$or": tag_clauses})
+
+        if not clauses:
+            return None
+        # Chroma 要求 $and 至少包含兩個條件
+        return clauses[0] if len(clauses) == 1 else {"$and": clauses}
+
+    def _date_predicates(self):
+        predicates = []
+        if self.date_from:
+            predicates.append(Session.date >= datetime.combine(self.date_from, time.min))
+        if self.date_to:
+            predicates.append(Session.date <= datetime.combine(self.date_to, time.max))
+        return predicates
+
+    def _tag_predicates(self, tags_relationship):
+        if not self.tag_ids:
+            return []
+        if self.tag_match == 'all':
+            return [tags_relationship.any(Tag.id == tag_id) for tag_id in self.tag_ids]
+        return [tags_relationship.any(Tag.id.in_(self.tag_ids))]
+
+    def apply_to_session_query(self, query):
+        """在課程查詢上加入相同的過濾條件；此條件排除課程時返回 None"""
+        if not self.includes('session'):
+            return None
+        predicates = self._date_predicates() + self._tag_predicates(Session.tags)
+        if self.session_ids:
+            predicates.append(Session.id.in_(self.session_ids))
+        return query.filter(*predicates) if predicates else query
+
+    def apply_to_segment_query(self, query):
+        """在段落查詢上加入相同的過濾條件；此條件排除段落時返回 None"""
+        if not self.includes('segment'):
+            return None
+        predicates = self._tag_predicates(Segment.tags)
+        if self.session_ids:
+            predicates.append(Segment.session_id.in_(self.session_ids))
+        if self.segment_types:
+            predicates.append(Segment.segment_type.in_(self.segment_types))
+        date_predicates = self._date_predicates()
+        if date_predicates:
+            # 以 EXISTS 子查詢過濾，不影響呼叫端已有的 join
+            predicates.append(Segment.session.has(*date_predicates))
+        return query.filter(*predicates) if predicates else query
@@ -140,6 +140,24 @@ class RelationGraph {
         // 清除之前的圖形
         this.g.selectAll('*').remove();
         
+        // 伺服器已計算佈局（座標為 0~1）時直接換算為畫布座標，不在瀏覽器中模擬
+        this.serverLayout = Boolean(this.data.layout);
+        if (this.serverLayout) {
+            const margin = 40;
+            this.data.nodes.forEach(node => {
+                node.x = margin + node.x * (this.width - margin * 2);
+                node.y = margin + node.y * (this.height - margin * 2);
+            });
+            // 停止的模擬只用來把連線的 source / target 解析為節點物件
+            this.simulation = d3.forceSimulation(this.data.nodes)
+                .force('link', d3.forceLink(this.data.links).id(d => d.id))
+                .stop();
+            this.renderLinks();
+            this.renderNodes();
+            this.updatePositions();
+            return;
+        }
+        
         // 創建力導向模擬
         this.simulation = d3.forceSimulation(this.data.nodes)
             .force('link', d3.forceLink(this.data.links)
@@ -241,17 +259,25 @@ class RelationGraph {
     }
     
     dragStarted(event, d) {
+        if (this.serverLayout) return;
         if (!event.active) this.simulation.alphaTarget(0.3).restart();
         d.fx = d.x;
         d.fy = d.y;
     }
     
     dragged(event, d) {
+        if (this.serverLayout) {
+            d.x = event.x;
+            d.y = event.y;
+            this.updatePositions();
+            return;
+        }
         d.fx = event.x;
         d.fy = event.y;
     }
     
     dragEnded(event, d) {
+        if (this.serverLayout) return;
         if (!event.active) this.simulation.alphaTarget(0);
         d.fx = null;
         d.fy = null;
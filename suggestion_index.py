@@ -0,0 +1,281 @@
+"""
+搜尋建議索引模組
+在記憶體中維護標籤名稱與課程標題的前綴索引（排序陣列 + 二分搜尋）和 n-gram 中綴索引，
+並預先計算標籤使用次數，讓自動完成不必在每次按鍵時查詢資料庫。
+
+透過 change_tracking 的提交通知記錄變更的標籤和課程，下一次查詢時只重新讀取這些資料列
+"""
+
+import heapq
+import logging
+import threading
+from bisect import bisect_left, insort
+from dataclasses import dataclass
+from datetime import datetime
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Set, Tuple
+
+from sqlalchemy import func
+
+from change_tracking import ChangeSet, subscribe
+from models import Session, Tag, db, segment_tags
+
+logger = logging.getLogger(__name__)
+
+# 建議索引讀取的欄位；批量修改未寫入這些欄位時（例如只更新 updated_at）不需重建
+INDEXED_COLUMNS = {'tag': ('name', 'category', 'color'), 'session': ('title', 'date')}
+
+
+def normalize_text(value: Optional[str]) -> str:
+    return (value or '').strip().casefold()
+
+
+def _grams(text: str) -> Set[str]:
+    """單字與相鄰二字組（中文標籤通常只有 2~4 個字）"""
+    return set(text) | {text[i:i + 2] for i in range(len(text) - 1)}
+
+
+@dataclass
+class Suggestion:
+    kind: str  # tag / session
+    id: int
+    text: str
+    category: Optional[str] = None
+    color: Optional[str] = None
+    # 排序權重：標籤為段落使用次數，課程為日期時間戳
+    weight: float = 0.0
+
+    def to_dict(self) -> Dict[str, Any]:
+        if self.kind == 'tag':
+            return {'id': self.id, 'name': self.text, 'category': self.category, 'color': self.color}
+        return {'id': self.id, 'title': self.text}
+
+
+class _TextIndex:
+    """單一類型文字的前綴索引與中綴索引"""
+
+    def __init__(self):
+        self._sorted: List[Tuple[str, int]] = []
+        self._grams: Dict[str, Set[int]] = {}
+        self._text: Dict[int, str] = {}
+
+    def __len__(self) -> int:
+        return len(self._text)
+
+    def add(self, item_id: int, text: str):
+        key = normalize_text(text)
+        if self._text.get(item_id) == key:
+            return
+        self.remove(item_id)
+        self._text[item_id] = key
+        insort(self._sorted, (key, item_id))
+        for gram in _grams(key):
+            self._grams.setdefault(gram, set()).add(item_id)
+
+    def remove(self, item_id: int):
+        key = self._text.pop(item_id, None)
+        if key is None:
+            return
+        position = bisect_left(self._sorted, (key, item_id))
+        if position < len(self._sorted) and self._sorted[position] == (key, item_id):
+            del self._sorted[position]
+        for gram in _grams(key):
+            ids = self._grams.get(gram)
+            if ids is not None:
+                ids.discard(item_id)
+                if not ids:
+                    del self._grams[gram]
+
+    def ids(self) -> Iterable[int]:
+        return self._text.keys()
+
+    def prefix(self, query: str) -> Iterator[int]:
+        position = bisect_left(self._sorted, (query,))
+        while position < len(self._sorted) and self._sorted[position][0].startswith(query):
+            yield self._sorted[position][1]
+            position += 1
+
+    def infix(self, query: str) -> Set[int]:
+        if len(query) <= 2:
+            return set(self._grams.get(query, ()))
+        # 以最稀有的二字組縮小候選，再確認完整子字串
+        candidate_sets = sorted(
+            (self._grams.get(query[i:i + 2], set()) for i in range(len(query) - 1)),
+            key=len
+        )
+        return {item_id for item_id in candidate_sets[0] if query in self._text[item_id]}
+
+
+class SuggestionIndex:
+    """標籤與課程標題的自動完成索引（執行緒安全）"""
+
+    def __init__(self):
+        self._lock = threading.RLock()
+        self._indexes = {'tag': _TextIndex(), 'session': _TextIndex()}
+        self._entries: Dict[Tuple[str, int], Suggestion] = {}
+
+        # 等待套用的變更（由提交通知寫入，查詢時套用）
+        self._pending_lock = threading.Lock()
+        self._stale = True
+        self._dirty: Dict[str, Set[int]] = {'tag': set(), 'session': set()}
+        self._usage_dirty = False
+
+    def on_change(self, changes: ChangeSet):
+        if not changes.affects('tag', 'session', 'segment'):
+            return
+        with self._pending_lock:
+            if any(changes.bulk_touches(kind, columns) for kind, columns in INDEXED_COLUMNS.items()):
+                self._stale = True
+            for kind in ('tag', 'session'):
+                self._dirty[kind] |= changes.ids(kind) | changes.ids(kind, deleted=True)
+            # 段落或標籤的增刪改都可能改變標籤使用次數；批量修改不會改變關聯表，批量刪除則可能
+            if (any(changes.ids(kind) or changes.ids(kind, deleted=True) for kind in ('tag', 'segment'))
+                    or changes.bulk_deleted & {'tag', 'segment'}):
+                self._usage_dirty = True
+
+    def refresh(self):
+        """套用等待中的變更（需在應用程式上下文中呼叫）"""
+        with self._pending_lock:
+            stale, self._stale = self._stale, False
+            dirty = {kind: ids for kind, ids in self._dirty.items()}
+            self._dirty = {'tag': set(), 'session': set()}
+            usage_dirty, self._usage_dirty = self._usage_dirty, False
+
+        if not (stale or dirty['tag'] or dirty['session'] or usage_dirty):
+            return
+
+        try:
+            if stale:
+                self._build()
+                return
+            with self._lock:
+                if dirty['tag']:
+                    self._load_tags(dirty['tag'])
+                if dirty['session']:
+                    self._load_sessions(dirty['session'])
+                if usage_dirty:
+                    self._load_usage()
+        except Exception:
+            # 讀取失敗時保留變更，下一次查詢重試
+            with self._pending_lock:
+                self._stale = self._stale or stale
+                for kind, ids in dirty.items():
+                    self._dirty[kind] |= ids
+                self._usage_dirty = self._usage_dirty or usage_dirty
+            raise
+
+    def _build(self):
+        with self._lock:
+            self._indexes = {'tag': _TextIndex(), 'session': _TextIndex()}
+            self._entries = {}
+            self._load_tags(None)
+            self._load_sessions(None)
+            self._load_usage()
+        logger.info(f"搜尋建議索引已建立：{len(self._indexes['tag'])} 個標籤，"
+                    f"{len(self._indexes['session'])} 個課程")
+
+    def _put(self, entry: Suggestion):
+        self._entries[(entry.kind, entry.id)] = entry
+        self._indexes[entry.kind].add(entry.id, entry.text)
+
+    def _drop(self, kind: str, item_id: int):
+        self._entries.pop((kind, item_id), None)
+        self._indexes[kind].remove(item_id)
+
+    def _load_tags(self, tag_ids: Optional[Set[int]]):
+        query = db.session.query(Tag.id, Tag.name, Tag.category, Tag.color)
+        if tag_ids is not None:
+            query = query.filter(Tag.id.in_(tag_ids))
+        found = set()
+        for tag_id, name, category, color in query:
+            previous = self._entries.get(('tag', tag_id))
+            self._put(Suggestion('tag', tag_id, name, category, color, previous.weight if previous else 0.0))
+            found.add(tag_id)
+        for tag_id in (tag_ids or set()) - found:
+            self._drop('tag', tag_id)
+
+    def _load_sessions(self, session_ids: Optional[Set[int]]):
+        query = db.session.query(Session.id, Session.title, Session.date)
+        if session_ids is not None:
+            query = query.filter(Session.id.in_(session_ids))
+        found = set()
+        for session_id, title, date in query:
+            weight = date.timestamp() if isinstance(date, datetime) else 0.0
+            self._put(Suggestion('session', session_id, title or '', weight=weight))
+            found.add(session_id)
+        for session_id in (session_ids or set()) - found:
+            self._drop('session', session_id)
+
+    def _load_usage(self):
+        """以一次 GROUP BY 重新計算所有標籤的段落使用次數"""
+        usage = dict(
+            db.session.query(segment_tags.c.tag_id, func.count(segment_tags.c.segment_id))
+            .group_by(segment_tags.c.tag_id)
+        )
+        for tag_id in self._indexes['tag'].ids():
+            self._entries[('tag', tag_id)].weight = usage.get(tag_id, 0)
+
+    def search(self, kind: str, query: str, limit: int = 10,
+               categories: Optional[Iterable[str]] = None) -> List[Suggestion]:
+        """
+        前綴匹配優先，不足時以中綴匹配補齊；同一組內依權重、文字排序
+
+        Args:
+            kind: tag / session
+            categories: 只返回這些分類的標籤
+        """
+        query = normalize_text(query)
+        if not query or limit <= 0:
+            return []
+        self.refresh()
+
+        categories = set(categories) if categories else None
+        with self._lock:
+            text_index = self._indexes[kind]
+            entries = self._entries
+
+            def allowed(item_id):
+                return categories is None or entries[(kind, item_id)].category in categories
+
+            def rank(item_id):
+                entry = entries[(kind, item_id)]
+                return -entry.weight, entry.text
+
+            prefix_ids = [item_id for item_id in text_index.prefix(query) if allowed(item_id)]
+            ranked = heapq.nsmallest(limit, prefix_ids, key=rank)
+            if len(ranked) < limit:
+                seen = set(prefix_ids)
+                infix_ids = [item_id for item_id in text_index.infix(query)
+                             if item_id not in seen and allowed(item_id)]
+                ranked += heapq.nsmallest(limit - len(ranked), infix_ids, key=rank)
+            return [entries[(kind, item_id)] for item_id in ranked]
+
+    def tag_usage(self, tag_ids: Iterable[int]) -> Dict[int, int]:
+        """標籤的段落使用次數（預先計算，不查詢資料庫）"""
+        self.refresh()
+        with self._lock:
+            return {
+                tag_id: int(self._entries[('tag', tag_id)].weight) if ('tag', tag_id) in self._entries else 0
+                for tag_id in tag_ids
+            }
+
+    def search_tags(self, query: str, limit: int = 15,
+                    categories: Optional[Iterable[str]] = None) -> List[Suggestion]:
+        return self.search('tag', query, limit, categories)
+
+    def search_sessions(self, query: str, limit: int = 3) -> List[Suggestion]:
+        return self.search('session', query, limit)
+
+
+# 全局實例（單例模式）
+_suggestion_index: Optional[SuggestionIndex] = None
+_index_lock = threading.Lock()
+
+
+def get_suggestion_index() -> SuggestionIndex:
+    global _suggestion_index
+    if _suggestion_index is None:
+        with _index_lock:
+            if _suggestion_index is None:
+                _suggestion_index = SuggestionIndex()
+                subscribe(_suggestion_index.on_change)
+    return _suggestion_index
@@ -0,0 +1,371 @@
+"""
+標籤關聯物化表模組
+將症狀->病因、病因->手法、手法->位置的關聯（支持段落數、強度、例子段落）物化到 tag_associations 表，
+診斷查詢只需以 (relation_type, source_tag_id) 索引查一次，不必載入所有相符段落再逐一檢查標籤。
+
+- 支持段落數：同時帶有來源標籤與目標標籤的段落數（症狀->病因也計入段落所屬課程的病因標籤）
+- 強度：支持段落數 / 帶有來源標籤的段落數
+- 段落或課程的標籤、標籤分類改變後，由標籤共現矩陣得知哪些標籤受影響，只重新計算涉及這些標籤的資料列
+- 維護在背景線程中進行（啟動時比對 index_state 表中全量重建時的來源資料指紋，不一致或曾增量更新時全量重建；
+  之後由提交通知喚醒），查詢只讀取物化表，不在請求中重建
+- 帶有段落條件（位置、領域）的查詢以同一套規則只統計符合條件的段落，返回相同格式的候選標籤
+"""
+
+import os
+import json
+import hashlib
+import logging
+import threading
+import time
+from dataclasses import dataclass, field
+from datetime import datetime
+from typing import Dict, Iterable, List, Optional, Set, Tuple
+
+from sqlalchemy import and_, func, or_
+from sqlalchemy.orm import Query
+from sqlalchemy.orm import aliased
+
+from models import IndexState, Segment, Tag, TagAssociation, db, segment_tags, session_tags
+from change_tracking import ChangeSet, subscribe
+from relation_graph import TagCooccurrence, get_tag_cooccurrence, rows_digest
+
+logger = logging.getLogger(__name__)
+
+# 每個關聯保留的例子段落數
+MAX_EXAMPLE_SEGMENTS = int(os.environ.get('TAG_ASSOCIATION_EXAMPLES', 5))
+# 維護線程沒有收到提交通知時，每隔多久檢查一次變更（秒）；失敗後也以此間隔重試
+REFRESH_INTERVAL = float(os.environ.get('TAG_ASSOCIATION_REFRESH_INTERVAL', 60))
+# IN 條件每批的標籤數（SQLite 的參數數量有上限）
+ID_BATCH_SIZE = 500
+STATE_NAME = 'tag_associations'
+
+
+@dataclass(frozen=True)
+class AssociationRule:
+    source_categories: Tuple[str, ...]
+    target_categories: Tuple[str, ...]
+    # 目標標籤是否也包含段落所屬課程的標籤
+    include_session_tags: bool = False
+
+
+ASSOCIATION_RULES: Dict[str, AssociationRule] = {
+    'symptom_to_cause': AssociationRule(('症狀',), ('病因',), include_session_tags=True),
+    'cause_to_treatment': AssociationRule(('病因',), ('治療', '手法')),
+    'method_to_location': AssociationRule(('手法', '治療'), ('位置', '施術位置', '治療位置')),
+}
+
+
+@dataclass
+class AssociationCandidate:
+    """診斷查詢的候選標籤（多個來源標籤的關聯合併）"""
+    tag_id: int
+    support: int
+    strength: float
+    source_tag_ids: List[int] = field(default_factory=list)
+    example_segment_ids: List[int] = field(default_factory=list)
+
+
+def _batches(ids: Iterable[int]) -> Iterable[List[int]]:
+    ids = sorted(ids)
+    for start in range(0, len(ids), ID_BATCH_SIZE):
+        yield ids[start:start + ID_BATCH_SIZE]
+
+
+class TagAssociationStore:
+    """tag_associations 表的增量維護與查詢（執行緒安全）"""
+
+    def __init__(self, cooccurrence: TagCooccurrence):
+        self.cooccurrence = cooccurrence
+        self._lock = threading.RLock()
+        # 已同步到的共現矩陣版本；None 表示本進程尚未核對指紋
+        self._synced_version: Optional[int] = None
+        self.rebuilds = 0
+        self.incremental_updates = 0
+        self.last_refresh_at: Optional[datetime] = None
+        self.last_error: Optional[str] = None
+
+        self.app = None
+        self._wakeup = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    # ------------------------------------------------------------------
+    # 背景維護
+
+    def start(self, app):
+        """啟動維護線程：先核對指紋（必要時全量重建），之後由提交通知喚醒（重複呼叫無副作用）"""
+        if self._thread and self._thread.is_alive():
+            return
+        self.app = app
+        subscribe(self.on_change)
+        self._wakeup.set()
+        self._thread = threading.Thread(target=self._run, name="tag-associations", daemon=True)
+        self._thread.start()
+
+    def on_change(self, changes: ChangeSet):
+        if changes.affects('tag', 'segment', 'session'):
+            self._wakeup.set()
+
+    def _run(self):
+        while True:
+            self._wakeup.wait(REFRESH_INTERVAL)
+            self._wakeup.clear()
+            started = time.perf_counter()
+            try:
+                with self.app.app_context():
+                    self.refresh()
+                self.last_refresh_at = datetime.utcnow()
+                self.last_error = None
+            except Exception as e:
+                self.last_error = str(e)
+                logger.error(f"標籤關聯表更新失敗: {e}")
+                continue
+            elapsed = time.perf_counter() - started
+            if elapsed > 1:
+                logger.info(f"標籤關聯表更新耗時 {elapsed:.2f} 秒")
+
+    # ------------------------------------------------------------------
+    # 維護
+
+    def refresh(self):
+        """套用共現矩陣記錄的標籤變更（需在應用程式上下文中呼叫；由維護線程執行）"""
+        self.cooccurrence.refresh()
+        with self._lock:
+            version = self.cooccurrence.version
+            if self._synced_version is None:
+                stored = self._stored_fingerprint()
+                if stored is None or stored != self._fingerprint():
+                    self.rebuild()
+                self._synced_version = version
+                return
+
+            changed = self.cooccurrence.changed_tags_since(self._synced_version)
+            if changed is None:
+                # 共現矩陣曾全量重建（批量刪除），無法得知受影響的標籤
+                self.rebuild()
+            elif changed:
+                self._recompute(changed)
+                self.incremental_updates += 1
+            self._synced_version = version
+
+    def rebuild(self):
+        """從關聯表全量重建"""
+        self._recompute(None)
+        self.rebuilds += 1
+        logger.info(f"標籤關聯表已重建：{TagAssociation.query.count()} 筆關聯")
+
+    def _recompute(self, tag_ids: Optional[Set[int]]):
+        """
+        重新計算涉及這些標籤（來源或目標）的關聯；None 表示全部
+
+        指紋只在全量重建時寫入，並在讀取關聯之前計算：期間的提交只會讓指紋比資料舊，
+        下次啟動時不一致而重建，不會把未套用的變更標記為已套用。增量更新不重算整張表的指紋，
+        而是清除已保存的指紋，下次啟動時全量重建。
+        """
+        fingerprint = self._fingerprint() if tag_ids is None else None
+        now = datetime.utcnow()
+        rows = [{
+            'relation_type': relation,
+            'source_tag_id': source_id,
+            'target_tag_id': target_id,
+            'support': support,
+            'strength': strength,
+            'example_segment_ids': json.dumps(examples),
+            'updated_at': now
+        } for relation, rule in ASSOCIATION_RULES.items()
+            for source_id, target_id, support, strength, examples in self._pair_statistics(rule, tag_ids)]
+
+        table = TagAssociation.__table__
+        # 以獨立連線寫入，不影響呼叫端的 session
+        with db.engine.begin() as connection:
+            if tag_ids is None:
+                connection.execute(table.delete())
+            else:
+                for batch in _batches(tag_ids):
+                    connection.execute(table.delete().where(
+                        or_(table.c.source_tag_id.in_(batch), table.c.target_tag_id.in_(batch))
+                    ))
+            if rows:
+                connection.execute(table.insert(), rows)
+            self._store_fingerprint(connection, fingerprint)
+
+    def _pair_statistics(self, rule: AssociationRule, tag_ids: Optional[Set[int]],
+                         source_ids: Optional[List[int]] = None,
+                         segment_ids: Optional[Query] = None) -> List[Tuple[int, int, int, float, List[int]]]:
+        """
+        依規則統計 (來源標籤, 目標標籤, 支持段落數, 強度, 例子段落)
+
+        Args:
+            tag_ids: 只統計來源或目標在其中的組合；None 表示全部
+            source_ids: 只統計這些來源標籤
+            segment_ids: 段落 ID 查詢；只統計其中的段落（強度的分母也只計入這些段落）
+        """
+        # (來源標籤, 目標標籤) -> 支持段落
+        pair_segments: Dict[Tuple[int, int], Set[int]] = {}
+        batches = [None] if tag_ids is None else list(_batches(tag_ids))
+        for batch in batches:
+            for source_id, target_id, segment_id in self._pair_rows(rule, batch, source_ids, segment_ids):
+                if source_id != target_id:
+                    pair_segments.setdefault((source_id, target_id), set()).add(segment_id)
+        if not pair_segments:
+            return []
+
+        usage: Dict[int, int] = {}
+        for batch in _batches({source_id for source_id, _ in pair_segments}):
+            query = db.session.query(segment_tags.c.tag_id, func.count(func.distinct(segment_tags.c.segment_id)))\
+                .filter(segment_tags.c.tag_id.in_(batch))
+            if segment_ids is not None:
+                query = query.filter(segment_tags.c.segment_id.in_(segment_ids))
+            usage.update(query.group_by(segment_tags.c.tag_id))
+
+        return [(
+            source_id, target_id, len(segments),
+            round(len(segments) / max(usage.get(source_id, 0), len(segments)), 4),
+            # 段落 ID 較大者較新
+            sorted(segments, reverse=True)[:MAX_EXAMPLE_SEGMENTS]
+        ) for (source_id, target_id), segments in pair_segments.items()]
+
+    def _pair_rows(self, rule: AssociationRule, batch: Optional[List[int]],
+                   source_ids: Optional[List[int]] = None, segment_ids: Optional[Query] = None):
+        """逐一產生 (來源標籤, 目標標籤, 段落)；batch 不為 None 時只包含來源或目標在其中的組合"""
+        source_link = aliased(segment_tags)
+        source_tag = aliased(Tag)
+        target_tag = aliased(Tag)
+
+        def restrict(query, target_column):
+            if batch is not None:
+                query = query.filter(or_(source_link.c.tag_id.in_(batch), target_column.in_(batch)))
+            if source_ids is not None:
+                query = query.filter(source_link.c.tag_id.in_(source_ids))
+            if segment_ids is not None:
+                query = query.filter(source_link.c.segment_id.in_(segment_ids))
+            return query
+
+        # 段落本身的目標標籤
+        target_link = aliased(segment_tags)
+        query = db.session.query(source_link.c.tag_id, target_link.c.tag_id, source_link.c.segment_id)\
+            .join(source_tag, source_tag.id == source_link.c.tag_id)\
+            .join(target_link, target_link.c.segment_id == source_link.c.segment_id)\
+            .join(target_tag, target_tag.id == target_link.c.tag_id)\
+            .filter(source_tag.category.in_(rule.source_categories),
+                    target_tag.category.in_(rule.target_categories))
+        yield from restrict(query, target_link.c.tag_id)
+
+        if not rule.include_session_tags:
+            return
+        # 段落所屬課程的目標標籤
+        session_link = aliased(session_tags)
+        query = db.session.query(source_link.c.tag_id, session_link.c.tag_id, source_link.c.segment_id)\
+            .join(source_tag, source_tag.id == source_link.c.tag_id)\
+            .join(Segment, Segment.id == source_link.c.segment_id)\
+            .join(session_link, session_link.c.session_id == Segment.session_id)\
+            .join(target_tag, target_tag.id == session_link.c.tag_id)\
+            .filter(source_tag.category.in_(rule.source_categories),
+                    target_tag.category.in_(rule.target_categories))
+        yield from restrict(query, session_link.c.tag_id)
+
+    # ------------------------------------------------------------------
+    # 指紋
+
+    def _fingerprint(self) -> str:
+        """關聯表、段落所屬課程與標籤分類的逐列摘要（交換兩列的值也會改變指紋）"""
+        values = [
+            rows_digest(segment_tags.c.segment_id, segment_tags.c.tag_id),
+            rows_digest(session_tags.c.session_id, session_tags.c.tag_id),
+            rows_digest(Segment.id, Segment.session_id),
+            rows_digest(Tag.id, Tag.category),
+        ]
+        return hashlib.sha1(repr(values).encode('utf-8')).hexdigest()
+
+    def _stored_fingerprint(self) -> Optional[str]:
+        state = db.session.get(IndexState, STATE_NAME)
+        return state.fingerprint if state is not None else None
+
+    def _store_fingerprint(self, connection, fingerprint: Optional[str]):
+        table = IndexState.__table__
+        values = {'fingerprint': fingerprint, 'updated_at': datetime.utcnow()}
+        updated = connection.execute(table.update().where(table.c.name == STATE_NAME).values(**values))
+        if not updated.rowcount:
+            connection.execute(table.insert().values(name=STATE_NAME, **values))
+
+    # ------------------------------------------------------------------
+    # 查詢
+
+    def lookup(self, relation: str, source_tag_ids: Iterable[int], limit: int = 20,
+               segment_ids: Optional[Query] = None) -> List[AssociationCandidate]:
+        """
+        取得來源標籤的關聯，合併為依支持段落數、強度排序的候選標籤
+
+        沒有段落條件時以 (關聯類型, 來源標籤) 索引查詢物化表一次；指定 segment_ids（段落 ID 查詢，
+        例如帶有某位置標籤的段落）時以相同規則只統計這些段落。兩者返回相同格式的候選標籤。
+        多個來源標籤指向同一目標時，支持段落數相加、強度取最大值，例子段落依序合併
+        """
+        rule = ASSOCIATION_RULES.get(relation)
+        if rule is None:
+            raise ValueError(f"未知的關聯類型: {relation}")
+        source_tag_ids = list(dict.fromkeys(source_tag_ids))
+        if not source_tag_ids:
+            return []
+
+        if segment_ids is None:
+            rows = [
+                (target_id, source_id, support, strength, json.loads(examples or '[]'))
+                for target_id, source_id, support, strength, examples in db.session.query(
+                    TagAssociation.target_tag_id, TagAssociation.source_tag_id, TagAssociation.support,
+                    TagAssociation.strength, TagAssociation.example_segment_ids
+                ).filter(
+                    and_(TagAssociation.relation_type == relation, TagAssociation.source_tag_id.in_(source_tag_ids))
+                ).order_by(TagAssociation.support.desc())
+            ]
+        else:
+            rows = sorted(
+                ((target_id, source_id, support, strength, examples)
+                 for source_id, target_id, support, strength, examples
+                 in self._pair_statistics(rule, None, source_tag_ids, segment_ids)),
+                key=lambda row: -row[2]
+            )
+
+        candidates: Dict[int, AssociationCandidate] = {}
+        for target_id, source_id, support, strength, examples in rows:
+            candidate = candidates.setdefault(target_id, AssociationCandidate(target_id, 0, 0.0))
+            candidate.support += support
+            candidate.strength = max(candidate.strength, strength)
+            candidate.source_tag_ids.append(source_id)
+            for segment_id in examples:
+                if (segment_id not in candidate.example_segment_ids
+                        and len(candidate.example_segment_ids) < MAX_EXAMPLE_SEGMENTS):
+                    candidate.example_segment_ids.append(segment_id)
+
+        ranked = sorted(candidates.values(), key=lambda c: (-c.support, -c.strength, c.tag_id))
+        return ranked[:limit]
+
+    def stats(self) -> Dict:
+        return {
+            "running": bool(self._thread and self._thread.is_alive()),
+            "synced_version": self._synced_version,
+            "rebuilds": self.rebuilds,
+            "incremental_updates": self.incremental_updates,
+            "last_refresh_at": self.last_refresh_at.isoformat() if self.last_refresh_at else None,
+            "last_error": self.last_error
+        }
+
+
+# 全局實例（單例模式）
+_association_store: Optional[TagAssociationStore] = None
+_store_lock = threading.Lock()
+
+
+def get_tag_association_store(app=None) -> TagAssociationStore:
+    global _association_store
+    if _association_store is None:
+        cooccurrence = get_tag_cooccurrence(app)
+        with _store_lock:
+            if _association_store is None:
+                _association_store = TagAssociationStore(cooccurrence)
+    return _association_store
+
+
+def start_tag_association_maintenance(app) -> TagAssociationStore:
+    """啟動標籤關聯表的背景維護（重複呼叫無副作用）"""
+    store = get_tag_association_store(app)
+    store.start(app)
+    return store
@@ -0,0 +1,250 @@
+"""
+標籤詞典比對模組
+以所有標籤名稱建立 Aho-Corasick 自動機，一次線性掃描即可找出查詢或段落內容中提到的全部標籤，
+用於智能搜尋的標籤匹配，以及撰寫段落時的標籤建議。
+
+標籤新增時直接插入字典樹、刪除時只移除輸出，失效連結在下一次比對前重新計算；
+變更透過 change_tracking 的提交通知記錄，於下一次比對時只重新讀取變更的標籤
+"""
+
+import logging
+import threading
+from collections import Counter, deque
+from dataclasses import dataclass
+from typing import Dict, Hashable, Iterable, Iterator, List, Optional, Set, Tuple
+
+from change_tracking import ChangeSet, subscribe
+from models import Tag, db
+
+logger = logging.getLogger(__name__)
+
+# 少於此長度的標籤名稱不參與比對（單字標籤幾乎在任何文字中都會出現）
+MIN_PATTERN_CHARS = 2
+# 已刪除的輸出超過此數量時重建字典樹，回收不再使用的節點
+REBUILD_AFTER_REMOVALS = 500
+# 詞典讀取的標籤欄位；批量修改未寫入這些欄位時不需重建
+INDEXED_COLUMNS = ('name', 'category')
+
+
+class AhoCorasick:
+    """多模式字串比對自動機（以字典儲存轉移，模式比對不分大小寫）"""
+
+    def __init__(self):
+        self._goto: List[Dict[str, int]] = [{}]
+        self._fail: List[int] = [0]
+        # 節點的輸出，以及沿失效連結可到達的下一個有輸出的節點
+        self._out: List[Set[Hashable]] = [set()]
+        self._dict_link: List[int] = [0]
+        self._patterns: Dict[Hashable, str] = {}
+        self._links_ready = True
+        self._removed = 0
+
+    def __len__(self) -> int:
+        return len(self._patterns)
+
+    def add(self, key: Hashable, pattern: str):
+        pattern = pattern.lower()
+        if self._patterns.get(key) == pattern:
+            return
+        self.remove(key)
+        node = 0
+        for char in pattern:
+            next_node = self._goto[node].get(char)
+            if next_node is None:
+                next_node = len(self._goto)
+                self._goto[node][char] = next_node
+                self._goto.append({})
+                self._fail.append(0)
+                self._out.append(set())
+                self._dict_link.append(0)
+            node = next_node
+        self._out[node].add(key)
+        self._patterns[key] = pattern
+        self._links_ready = False
+
+    def remove(self, key: Hashable):
+        pattern = self._patterns.pop(key, None)
+        if pattern is None:
+            return
+        node = 0
+        for char in pattern:
+            node = self._goto[node][char]
+        self._out[node].discard(key)
+        self._removed += 1
+        if self._removed >= REBUILD_AFTER_REMOVALS:
+            self._rebuild()
+
+    def _rebuild(self):
+        patterns = self._patterns
+        self.__init__()
+        for key, pattern in patterns.items():
+            self.add(key, pattern)
+
+    def _build_links(self):
+        """以廣度優先順序計算失效連結與輸出連結"""
+        queue = deque()
+        for child in self._goto[0].values():
+            self._fail[child] = 0
+            self._dict_link[child] = 0
+            queue.append(child)
+        while queue:
+            node = queue.popleft()
+            for char, child in self._goto[node].items():
+                fail = self._fail[node]
+                while fail and char not in self._goto[fail]:
+                    fail = self._fail[fail]
+                fail = self._goto[fail].get(char, 0)
+                self._fail[child] = fail
+                self._dict_link[child] = fail if self._out[fail] else self._dict_link[fail]
+                queue.append(child)
+        self._links_ready = True
+
+    def iter_matches(self, text: str) -> Iterator[Tuple[int, int, Hashable]]:
+        """逐一產生 (起點, 終點, 模式鍵)，包含重疊的匹配"""
+        if not self._links_ready:
+            self._build_links()
+        node = 0
+        for position, char in enumerate(text.lower()):
+            while node and char not in self._goto[node]:
+                node = self._fail[node]
+            node = self._goto[node].get(char, 0)
+            match_node = node if self._out[node] else self._dict_link[node]
+            while match_node:
+                for key in self._out[match_node]:
+                    yield position + 1 - len(self._patterns[key]), position + 1, key
+                match_node = self._dict_link[match_node]
+
+
+@dataclass
+class TagMention:
+    tag_id: int
+    name: str
+    category: Optional[str]
+    start: int
+    end: int
+
+
+class TagDictionary:
+    """全部標籤名稱的詞典比對器（執行緒安全）"""
+
+    def __init__(self):
+        self._lock = threading.RLock()
+        self._automaton = AhoCorasick()
+        self._tags: Dict[int, Tuple[str, Optional[str]]] = {}
+
+        # 等待套用的變更（由提交通知寫入，比對時套用）
+        self._pending_lock = threading.Lock()
+        self._stale = True
+        self._dirty: Set[int] = set()
+
+    def on_change(self, changes: ChangeSet):
+        if not changes.affects('tag'):
+            return
+        with self._pending_lock:
+            if changes.bulk_touches('tag', INDEXED_COLUMNS):
+                self._stale = True
+            self._dirty |= changes.ids('tag') | changes.ids('tag', deleted=True)
+
+    def refresh(self):
+        """套用等待中的變更（需在應用程式上下文中呼叫）"""
+        with self._pending_lock:
+            stale, self._stale = self._stale, False
+            dirty, self._dirty = self._dirty, set()
+        if not (stale or dirty):
+            return
+
+        try:
+            with self._lock:
+                if stale:
+                    self._automaton = AhoCorasick()
+                    self._tags = {}
+                self._load(None if stale else dirty)
+        except Exception:
+            # 讀取失敗時保留變更，下一次比對重試
+            with self._pending_lock:
+                self._stale = self._stale or stale
+                self._dirty |= dirty
+            raise
+        if stale:
+            logger.info(f"標籤詞典已建立：{len(self._automaton)} 個標籤")
+
+    def _load(self, tag_ids: Optional[Set[int]]):
+        query = db.session.query(Tag.id, Tag.name, Tag.category)
+        if tag_ids is not None:
+            query = query.filter(Tag.id.in_(tag_ids))
+        found = set()
+        for tag_id, name, category in query:
+            found.add(tag_id)
+            self._tags[tag_id] = (name, category)
+            if name and len(name.strip()) >= MIN_PATTERN_CHARS:
+                self._automaton.add(tag_id, name.strip())
+            else:
+                self._automaton.remove(tag_id)
+        for tag_id in (tag_ids or set()) - found:
+            self._tags.pop(tag_id, None)
+            self._automaton.remove(tag_id)
+
+    def find(self, text: Optional[str], categories: Optional[Iterable[str]] = None,
+             longest_only: bool = True) -> List[TagMention]:
+        """
+        找出文字中提到的標籤
+
+        Args:
+            categories: 只返回這些分類的標籤
+            longest_only: 重疊的匹配只保留最長者（「肩頸痛」不再另外算作「頸痛」）
+        """
+        if not text:
+            return []
+        self.refresh()
+
+        categories = set(categories) if categories else None
+        with self._lock:
+            mentions = [
+                TagMention(tag_id, *self._tags[tag_id], start, end)
+                for start, end, tag_id in self._automaton.iter_matches(text)
+            ]
+        if longest_only:
+            mentions.sort(key=lambda mention: (mention.start, mention.start - mention.end))
+            kept, covered_until = [], 0
+            for mention in mentions:
+                if mention.start >= covered_until:
+                    kept.append(mention)
+                    covered_until = mention.end
+            mentions = kept
+        if categories is not None:
+            mentions = [mention for mention in mentions if mention.category in categories]
+        return mentions
+
+    def suggest_tags(self, *texts: Optional[str], exclude_ids: Iterable[int] = (),
+                     limit: int = 10) -> List[Tuple[TagMention, int]]:
+        """
+        依提及次數建議標籤（撰寫段落時使用，不查詢資料庫）
+
+        Returns:
+            [(第一次提及, 提及次數)]，依次數排序
+        """
+        exclude_ids = set(exclude_ids)
+        counts: Counter = Counter()
+        first_mentions: Dict[int, TagMention] = {}
+        for text in texts:
+            for mention in self.find(text):
+                if mention.tag_id in exclude_ids:
+                    continue
+                counts[mention.tag_id] += 1
+                first_mentions.setdefault(mention.tag_id, mention)
+        return [(first_mentions[tag_id], count) for tag_id, count in counts.most_common(limit)]
+
+
+# 全局實例（單例模式）
+_tag_dictionary: Optional[TagDictionary] = None
+_dictionary_lock = threading.Lock()
+
+
+def get_tag_dictionary() -> TagDictionary:
+    global _tag_dictionary
+    if _tag_dictionary is None:
+        with _dictionary_lock:
+            if _tag_dictionary is None:
+                _tag_dictionary = TagDictionary()
+                subscribe(_tag_dictionary.on_change)
+    return _tag_dictionary
@@ -0,0 +1,43 @@
+import os
+import sys
+import tempfile
+
+import pytest
+
+# 模組位於儲存庫根目錄（平面結構）
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# app 在匯入時讀取資料庫設定；測試使用記憶體資料庫，不寫入索引快照
+os.environ.setdefault('DATABASE_URL', 'sqlite://')
+os.environ.setdefault('TAG_COOCCURRENCE_PATH', '')
+os.environ.setdefault('BM25_INDEX_PATH', os.path.join(tempfile.mkdtemp(prefix='bm25-'), 'bm25_index.pickle'))
+
+
+@pytest.fixture
+def app_db():
+    """建立空白資料表的應用程式上下文，結束時清除"""
+    flask_app = pytest.importorskip("app")
+    from models import db
+
+    with flask_app.app.app_context():
+        db.create_all()
+        try:
+            yield db
+        finally:
+            db.session.remove()
+            db.drop_all()
+
+
+@pytest.fixture
+def association_store(app_db, monkeypatch):
+    """替換全域的標籤關聯表維護者，使用不讀寫快照的獨立共現矩陣"""
+    import tag_associations
+    from change_tracking import subscribe, unsubscribe
+    from relation_graph import TagCooccurrence
+
+    cooccurrence = TagCooccurrence(snapshot_path=None)
+    subscribe(cooccurrence.on_change)
+    store = tag_associations.TagAssociationStore(cooccurrence)
+    monkeypatch.setattr(tag_associations, '_association_store', store)
+    yield store
+    unsubscribe(cooccurrence.on_change)
@@ -0,0 +1,165 @@
+"""BM25Index：分數與公式一致，刪除標記與壓縮不改變結果"""
+
+import math
+
+import pytest
+
+from bm25_index import BM25Index
+
+DOCS = {
+    1: "apple apple banana",
+    2: "banana cherry",
+    3: "cherry cherry cherry durian",
+}
+
+
+def _build(docs):
+    index = BM25Index(k1=1.5, b=0.75)
+    for row_id, body in docs.items():
+        index.add('segment', row_id, None, body)
+    return index
+
+
+def _bm25(docs, query_terms, k1=1.5, b=0.75):
+    """直接按公式計算未正規化的分數"""
+    tokenized = {row_id: body.split() for row_id, body in docs.items()}
+    live = len(tokenized)
+    avgdl = sum(len(tokens) for tokens in tokenized.values()) / live
+    scores = {}
+    for term in query_terms:
+        df = sum(term in tokens for tokens in tokenized.values())
+        if not df:
+            continue
+        idf = math.log(1 + (live - df + 0.5) / (df + 0.5))
+        for row_id, tokens in tokenized.items():
+            tf = tokens.count(term)
+            if tf:
+                norm = k1 * (1 - b + b * len(tokens) / avgdl)
+                scores[row_id] = scores.get(row_id, 0.0) + idf * tf * (k1 + 1) / (tf + norm)
+    return scores
+
+
+def _normalized(scores):
+    best = max(scores.values())
+    return {row_id: round(score / best, 4) for row_id, score in scores.items()}
+
+
+def test_scores_match_formula():
+    index = _build(DOCS)
+    hits = index.search("banana cherry", limit=10)
+    assert {row_id: score for _, row_id, score in hits} == _normalized(_bm25(DOCS, ["banana", "cherry"]))
+    # 依分數排序
+    assert [score for _, _, score in hits] == sorted((score for _, _, score in hits), reverse=True)
+
+
+def test_hand_computed_score():
+    # banana 出現在文檔 1 與 2，以手算的分數比例驗證長度正規化
+    # N=3, avgdl=3, banana: df=2 -> idf=ln(1 + 1.5/2.5)=ln(1.6)
+    # 文檔 1（長度 3，tf=1）：norm=1.5，分數 = ln(1.6) * 2.5 / 2.5 = ln(1.6)
+    # 文檔 2（長度 2，tf=1）：norm=1.5 * (0.25 + 0.5)=1.125，分數 = ln(1.6) * 2.5 / 2.125
+    index = _build(DOCS)
+    hits = {row_id: score for _, row_id, score in index.search("banana", limit=10)}
+    assert hits == {2: 1.0, 1: round(2.125 / 2.5, 4)}
+
+
+def test_tombstoned_documents_match_fresh_index():
+    # 加入其他文檔，使一筆刪除不超過壓縮比例，只留下刪除標記
+    docs = {**DOCS, **{row_id: f"filler{row_id}" for row_id in range(10, 20)}}
+    index = _build(docs)
+    index.remove('segment', 3)
+    assert index.stats()["deleted"] == 1
+
+    remaining = {row_id: body for row_id, body in docs.items() if row_id != 3}
+    fresh = _build(remaining)
+    for query in ("banana", "cherry", "apple banana", "durian"):
+        assert index.search(query, limit=10) == fresh.search(query, limit=10)
+    assert index.search("durian", limit=10) == []
+
+
+def test_update_replaces_old_terms():
+    index = _build(DOCS)
+    index.add('segment', 1, None, "durian")
+    assert [row_id for _, row_id, _ in index.search("apple", limit=10)] == []
+    assert {row_id for _, row_id, _ in index.search("durian", limit=10)} == {1, 3}
+
+
+def test_compaction_preserves_results():
+    docs = {row_id: f"common term{row_id % 3}" for row_id in range(1, 21)}
+    index = _build(docs)
+    for row_id in (2, 5, 7):
+        index.remove('segment', row_id)
+    before = {query: index.search(query, limit=30) for query in ("common", "term1", "term2 common")}
+    postings_before = index.stats()["postings"]
+
+    index.compact()
+    assert index.stats()["deleted"] == 0
+    assert index.stats()["postings"] < postings_before
+    for query, hits in before.items():
+        assert index.search(query, limit=30) == hits
+
+    # 壓縮後仍能增量新增與刪除
+    index.add('segment', 99, None, "common term1")
+    index.remove('segment', 1)
+    live = {row_id: body for row_id, body in docs.items() if row_id not in (1, 2, 5, 7)}
+    live[99] = "common term1"
+    assert index.search("term1 common", limit=30) == _build(live).search("term1 common", limit=30)
+
+
+def test_remove_compacts_after_threshold():
+    docs = {row_id: f"word{row_id} shared" for row_id in range(1, 11)}
+    index = _build(docs)
+    index.remove('segment', 1)
+    index.remove('segment', 2)
+    assert index.stats()["deleted"] == 2
+    # 第三筆刪除使已刪除比例超過 COMPACT_RATIO，自動壓縮
+    index.remove('segment', 3)
+    assert index.stats()["deleted"] == 0
+    assert len(index) == 7
+    assert {row_id for _, row_id, _ in index.search("shared", limit=20)} == set(range(4, 11))
+
+
+@pytest.mark.parametrize("row_id", [1, 2, 3])
+def test_readding_removed_document(row_id):
+    index = _build(DOCS)
+    index.remove('segment', row_id)
+    index.add('segment', row_id, None, DOCS[row_id])
+    assert index.search("banana cherry", limit=10) == _build(DOCS).search("banana cherry", limit=10)
+
+
+class RecordingIndex:
+    """記錄 bm25_search_rows 向索引取回的候選數"""
+
+    def __init__(self):
+        self.limits = []
+
+    def search(self, query, limit, content_type=None):
+        self.limits.append(limit)
+        return []
+
+
+def test_overfetch_only_with_filters(app_db):
+    from sqlalchemy.orm import selectinload
+
+    from bm25_index import FILTER_OVERFETCH, bm25_search_rows
+    from models import Session
+
+    index = RecordingIndex()
+    bm25_search_rows(index, Session, "查詢", 10)
+    bm25_search_rows(index, Session, "查詢", 10, Session.query.options(selectinload(Session.tags)))
+    bm25_search_rows(index, Session, "查詢", 10, Session.query.filter(Session.id.in_([1, 2])))
+    assert index.limits == [10, 10, 10 * FILTER_OVERFETCH]
+
+
+def test_search_rows_respects_filters(app_db):
+    from bm25_index import bm25_search_rows
+    from models import Session
+
+    index = BM25Index()
+    for row_id in range(1, 7):
+        app_db.session.add(Session(id=row_id, title=f"課程 {row_id}", overview="apple"))
+        index.add('session', row_id, f"課程 {row_id}", "apple")
+    app_db.session.commit()
+
+    rows = bm25_search_rows(index, Session, "apple", 3, Session.query.filter(Session.id > 4))
+    assert sorted(session.id for session, _ in rows) == [5, 6]
+    assert len(bm25_search_rows(index, Session, "apple", 3, Session.query)) == 3
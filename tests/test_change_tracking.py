@@ -0,0 +1,41 @@
+"""change_tracking：批量修改記錄寫入的欄位"""
+
+import pytest
+
+from change_tracking import ChangeSet, subscribe, unsubscribe
+
+
+@pytest.fixture
+def committed(app_db):
+    received = []
+    subscribe(received.append)
+    yield received
+    unsubscribe(received.append)
+
+
+def test_bulk_update_records_columns(app_db, committed):
+    from models import Session, Tag
+
+    Session.query.filter(Session.id == 1).update({Session.updated_at: None}, synchronize_session=False)
+    Tag.query.filter(Tag.id == 1).update({'name': '新名稱'}, synchronize_session=False)
+    app_db.session.commit()
+
+    changes = committed[-1]
+    assert changes.bulk == {'session', 'tag'}
+    assert changes.bulk_columns == {'session': {'updated_at'}, 'tag': {'name'}}
+    assert not changes.bulk_touches('session', ['title', 'date'])
+    assert changes.bulk_touches('tag', ['name', 'category'])
+    assert not changes.bulk_touches('segment', ['title'])
+
+
+def test_bulk_delete_touches_every_column(app_db, committed):
+    from models import Tag
+
+    Tag.query.filter(Tag.id == 1).delete(synchronize_session=False)
+    app_db.session.commit()
+    assert committed[-1].bulk_touches('tag', ['color'])
+
+
+def test_unknown_columns_touch_everything():
+    changes = ChangeSet(bulk={'tag'})
+    assert changes.bulk_touches('tag', ['name'])
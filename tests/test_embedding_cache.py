@@ -0,0 +1,20 @@
+"""EmbeddingCache：淘汰計數以實際刪除的列數為準"""
+
+from vector_service import EmbeddingCache
+
+
+def test_eviction_counts_deleted_rows(tmp_path):
+    path = str(tmp_path / 'embeddings.db')
+    cache = EmbeddingCache(path, max_entries=10)
+    cache.put_many({f'a{i}': [float(i)] for i in range(10)})
+    assert cache.stats()['entries'] == 10 and cache.evictions == 0
+
+    # 另一個寫入者清空了表；這個實例的計數仍為 10
+    other = EmbeddingCache(path, max_entries=10)
+    other.clear()
+
+    cache.put_many({'b0': [0.0], 'b1': [1.0]})
+    # 計劃淘汰 3 列，但表中只有 2 列
+    assert cache.evictions == 2
+    assert cache.stats()['entries'] == 10
+    assert cache.get_many(['b0', 'b1']) == {}
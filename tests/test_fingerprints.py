@@ -0,0 +1,99 @@
+"""共現快照與標籤關聯表的指紋：兩個資料列互換標籤也必須偵測到"""
+
+import pytest
+
+
+@pytest.fixture
+def tagged(app_db):
+    from models import Segment, Session, Tag
+
+    tags = [Tag(id=1, name='頭痛', category='症狀'), Tag(id=2, name='肌肉緊繃', category='病因'),
+            Tag(id=3, name='落枕', category='症狀'), Tag(id=4, name='姿勢不良', category='病因')]
+    session = Session(id=1, title='課程')
+    # 段落 1: 頭痛 + 肌肉緊繃；段落 2: 落枕 + 姿勢不良
+    session.segments.append(Segment(id=1, title='一', tags=[tags[0], tags[1]]))
+    session.segments.append(Segment(id=2, title='二', tags=[tags[2], tags[3]]))
+    app_db.session.add_all(tags + [session])
+    app_db.session.commit()
+    return app_db
+
+
+def _swap_causes(db):
+    """以原生 SQL 互換兩個段落的病因標籤（模擬其他進程的修改，不經過變更通知）"""
+    with db.engine.begin() as connection:
+        connection.exec_driver_sql("UPDATE segment_tags SET tag_id = -1 WHERE segment_id = 1 AND tag_id = 2")
+        connection.exec_driver_sql("UPDATE segment_tags SET tag_id = 2 WHERE segment_id = 2 AND tag_id = 4")
+        connection.exec_driver_sql("UPDATE segment_tags SET tag_id = 4 WHERE segment_id = 1 AND tag_id = -1")
+
+
+def test_rows_digest_detects_swapped_values(tagged):
+    from models import segment_tags
+    from relation_graph import rows_digest
+
+    columns = (segment_tags.c.segment_id, segment_tags.c.tag_id)
+    before = rows_digest(*columns)
+    _swap_causes(tagged)
+    after = rows_digest(*columns)
+    assert before[0] == after[0] == 4
+    assert before[1] != after[1]
+
+
+def test_cooccurrence_snapshot_invalidated_by_swap(tagged, tmp_path):
+    from relation_graph import TagCooccurrence
+
+    path = str(tmp_path / 'cooccurrence.pickle')
+    cooccurrence = TagCooccurrence(snapshot_path=path)
+    cooccurrence.refresh()
+    assert cooccurrence.neighbors(1) == {2: 1}
+
+    _swap_causes(tagged)
+    reloaded = TagCooccurrence(snapshot_path=path)
+    reloaded.refresh()
+    assert reloaded.neighbors(1) == {4: 1}
+    assert reloaded.neighbors(3) == {2: 1}
+
+
+def test_association_fingerprint_detects_swap(tagged):
+    from relation_graph import TagCooccurrence
+    from tag_associations import TagAssociationStore
+
+    store = TagAssociationStore(TagCooccurrence(snapshot_path=None))
+    store.refresh()
+    assert [c.tag_id for c in store.lookup('symptom_to_cause', [1])] == [2]
+
+    _swap_causes(tagged)
+    # 新進程以指紋核對物化表，發現不一致後全量重建
+    restarted = TagAssociationStore(TagCooccurrence(snapshot_path=None))
+    restarted.refresh()
+    assert restarted.rebuilds == 1
+    assert [c.tag_id for c in restarted.lookup('symptom_to_cause', [1])] == [4]
+
+
+def test_save_applies_pending_changes(tagged, tmp_path):
+    from change_tracking import subscribe, unsubscribe
+    from models import Segment, Tag
+    from relation_graph import TagCooccurrence
+
+    path = str(tmp_path / 'cooccurrence.pickle')
+    cooccurrence = TagCooccurrence(snapshot_path=path)
+    subscribe(cooccurrence.on_change)
+    try:
+        cooccurrence.refresh()
+        # 第一次提交已套用；第二次提交只在等待佇列中
+        first, second = tagged.session.get(Segment, 1), tagged.session.get(Segment, 2)
+        second.tags.append(tagged.session.get(Tag, 2))
+        tagged.session.commit()
+        cooccurrence.refresh()
+        first.tags.append(tagged.session.get(Tag, 3))
+        tagged.session.commit()
+        cooccurrence.save()
+    finally:
+        unsubscribe(cooccurrence.on_change)
+
+    reloaded = TagCooccurrence(snapshot_path=path)
+    reloaded.refresh()
+    rebuilt = TagCooccurrence(snapshot_path=None)
+    rebuilt.refresh()
+    for tag_id in range(1, 5):
+        assert reloaded.neighbors(tag_id) == rebuilt.neighbors(tag_id)
+    assert reloaded.neighbors(1) == {2: 1, 3: 1}
@@ -0,0 +1,98 @@
+"""FTS5 觸發器同步：來源表的新增、修改、刪除需反映到全文索引"""
+
+import sqlite3
+
+import pytest
+from sqlalchemy import create_engine
+
+import fulltext_service
+from fulltext_service import build_match_query, ensure_fulltext_index
+
+
+def _fts5_supported():
+    connection = sqlite3.connect(":memory:")
+    try:
+        connection.execute("CREATE VIRTUAL TABLE probe USING fts5(body)")
+        return True
+    except sqlite3.OperationalError:
+        return False
+    finally:
+        connection.close()
+
+
+pytestmark = pytest.mark.skipif(not _fts5_supported(), reason="SQLite 未編譯 FTS5")
+
+
+@pytest.fixture
+def engine(tmp_path):
+    engine = create_engine(f"sqlite:///{tmp_path / 'fts.db'}")
+    with engine.begin() as connection:
+        connection.exec_driver_sql(
+            "CREATE TABLE sessions (id INTEGER PRIMARY KEY, title TEXT, overview TEXT, is_synced BOOLEAN)"
+        )
+        connection.exec_driver_sql(
+            "CREATE TABLE segments (id INTEGER PRIMARY KEY, title TEXT, content TEXT, is_synced BOOLEAN)"
+        )
+        connection.exec_driver_sql(
+            "INSERT INTO segments (id, title, content) VALUES (1, '肩頸放鬆', '斜方肌緊繃導致頭痛')"
+        )
+    yield engine
+    engine.dispose()
+    fulltext_service._fulltext_ready = False
+
+
+def _matches(engine, query):
+    with engine.connect() as connection:
+        return sorted(rowid for (rowid,) in connection.exec_driver_sql(
+            "SELECT rowid FROM segments_fts WHERE segments_fts MATCH ?", (build_match_query(query),)
+        ))
+
+
+def test_backfill_indexes_existing_rows(engine):
+    assert ensure_fulltext_index(engine)
+    assert _matches(engine, "斜方肌") == [1]
+
+
+def test_triggers_follow_insert_update_delete(engine):
+    assert ensure_fulltext_index(engine)
+    with engine.begin() as connection:
+        connection.exec_driver_sql(
+            "INSERT INTO segments (id, title, content) VALUES (2, '腰部', '腰方肌疼痛')"
+        )
+    assert _matches(engine, "腰方肌") == [2]
+
+    with engine.begin() as connection:
+        connection.exec_driver_sql("UPDATE segments SET content = '膝蓋痠痛' WHERE id = 2")
+    assert _matches(engine, "腰方肌") == []
+    assert _matches(engine, "膝蓋") == [2]
+
+    with engine.begin() as connection:
+        connection.exec_driver_sql("DELETE FROM segments WHERE id = 2")
+    assert _matches(engine, "膝蓋") == []
+    assert _matches(engine, "斜方肌") == [1]
+
+
+def test_unindexed_column_update_keeps_index(engine):
+    assert ensure_fulltext_index(engine)
+    with engine.begin() as connection:
+        connection.exec_driver_sql("UPDATE segments SET is_synced = 1 WHERE id = 1")
+    assert _matches(engine, "斜方肌") == [1]
+
+
+def test_missing_triggers_are_recreated_and_index_rebuilt(engine):
+    assert ensure_fulltext_index(engine)
+    # 模擬 batch_alter_table 重建來源表後觸發器消失
+    with engine.begin() as connection:
+        connection.exec_driver_sql("DROP TRIGGER segments_fts_ai")
+        connection.exec_driver_sql(
+            "INSERT INTO segments (id, title, content) VALUES (3, '足部', '足底疼痛')"
+        )
+    assert _matches(engine, "足底") == []
+
+    assert ensure_fulltext_index(engine)
+    assert _matches(engine, "足底") == [3]
+    with engine.begin() as connection:
+        connection.exec_driver_sql(
+            "INSERT INTO segments (id, title, content) VALUES (4, '手部', '手腕麻木')"
+        )
+    assert _matches(engine, "手腕") == [4]
@@ -0,0 +1,43 @@
+"""伺服器端佈局：節點數超過上限時交由前端模擬"""
+
+import pytest
+
+pytest.importorskip("numpy")
+
+import graph_layout
+from graph_layout import layout_graph, resolve_layout_method
+
+
+def _payload(node_count):
+    nodes = [{'id': f'tag_{i}', 'name': str(i)} for i in range(node_count)]
+    links = [{'source': f'tag_{i}', 'target': f'tag_{i + 1}', 'strength': 1.0} for i in range(node_count - 1)]
+    return {'nodes': nodes, 'links': links}
+
+
+def test_resolve_respects_node_bounds(monkeypatch):
+    monkeypatch.setattr(graph_layout, 'AUTO_LAYOUT_MIN_NODES', 10)
+    monkeypatch.setattr(graph_layout, 'LAYOUT_MAX_NODES', 50)
+    assert resolve_layout_method('auto', 5) is None
+    assert resolve_layout_method('auto', 10) == 'force'
+    assert resolve_layout_method('auto', 50) == 'force'
+    assert resolve_layout_method('auto', 51) is None
+    assert resolve_layout_method('force', 51) is None
+    assert resolve_layout_method('spectral', 20) == 'spectral'
+    with pytest.raises(ValueError):
+        resolve_layout_method('circle', 20)
+
+
+def test_layout_within_budget(monkeypatch):
+    monkeypatch.setattr(graph_layout, 'LAYOUT_MAX_NODES', 50)
+    result = layout_graph(_payload(30), 'force')
+    assert result['layout']['method'] == 'force'
+    assert all(0.0 <= node['x'] <= 1.0 and 0.0 <= node['y'] <= 1.0 for node in result['nodes'])
+
+
+def test_large_graph_left_to_client(monkeypatch):
+    monkeypatch.setattr(graph_layout, 'LAYOUT_MAX_NODES', 50)
+    payload = _payload(60)
+    result = layout_graph(payload, 'force')
+    assert result is payload
+    assert 'layout' not in result
+    assert 'x' not in result['nodes'][0]
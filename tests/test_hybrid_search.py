@@ -0,0 +1,52 @@
+"""HybridSearchEngine：語義一路逾時時取消，並以名額限制同時進行的混合搜尋"""
+
+import threading
+import time
+
+from vector_service import HybridSearchEngine
+
+
+class SlowSemanticEngine(HybridSearchEngine):
+    """語義一路阻塞到 release 被設置，關鍵字一路返回固定結果"""
+
+    def __init__(self, **kwargs):
+        super().__init__(chroma_manager=None, **kwargs)
+        self.release = threading.Event()
+        self.started = threading.Event()
+
+    def _semantic_leg(self, query, limit, filters):
+        self.started.set()
+        self.release.wait(5)
+        return [{"type": "semantic", "score": 1.0, "content_type": "segment",
+                 "content_id": "segment_1", "title": "語義", "content": "", "metadata": {}}]
+
+    def _keyword_leg(self, query, limit, filters):
+        return [{"type": "keyword", "score": 1.0, "content_type": "segment",
+                 "content_id": 2, "title": "關鍵字", "content": "", "metadata": {}}]
+
+
+def test_timeout_returns_keyword_results_and_releases_slot():
+    engine = SlowSemanticEngine(leg_timeout=0.05)
+    started = time.monotonic()
+    results = engine.search("查詢", limit=5)
+    assert time.monotonic() - started < 1
+    assert [result["title"] for result in results] == ["關鍵字"]
+
+    engine.release.set()
+    # 執行中的工作結束後歸還名額
+    for _ in range(100):
+        if engine._slots._value == engine._executor._max_workers:
+            break
+        time.sleep(0.01)
+    assert engine._slots._value == engine._executor._max_workers
+
+
+def test_saturated_slots_run_legs_in_calling_thread():
+    engine = SlowSemanticEngine(leg_timeout=0.05)
+    engine.release.set()
+    for _ in range(engine._executor._max_workers):
+        engine._slots.acquire()
+    results = engine.search("查詢", limit=5)
+    assert {result["title"] for result in results} == {"關鍵字", "語義"}
+    # 名額用完時不提交到線程池
+    assert not engine._executor._threads
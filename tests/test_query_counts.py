@@ -0,0 +1,115 @@
+"""搜尋路徑的 SQL 查詢數不隨資料量增加（避免 N+1 延遲載入）"""
+
+from contextlib import contextmanager
+
+import pytest
+from sqlalchemy import event
+
+QUERY = '頭痛'
+LIMIT = 20
+
+
+@pytest.fixture
+def seeded(app_db):
+    from models import Tag
+
+    tags = {
+        'symptom': Tag(name='頭痛', category='症狀'),
+        'cause': Tag(name='肌肉緊繃', category='病因'),
+        'method': Tag(name='推拿', category='手法'),
+        'location': Tag(name='肩頸', category='位置'),
+    }
+    app_db.session.add_all(tags.values())
+    app_db.session.commit()
+    return tags
+
+
+def _seed(db, tags, start, count):
+    from models import Segment, Session
+
+    for number in range(start, start + count):
+        session = Session(title=f'課程 {number}', overview=f'{QUERY}的處理 {number}', tags=[tags['cause']])
+        for position in range(3):
+            session.segments.append(Segment(
+                title=f'段落 {number}-{position}', content=f'{QUERY} 與推拿 {number}-{position}',
+                segment_type='治療', order_index=position,
+                tags=[tags['symptom'], tags['cause'], tags['method'], tags['location']]
+            ))
+        db.session.add(session)
+    db.session.commit()
+    db.session.expunge_all()
+
+
+@contextmanager
+def _count_queries(engine):
+    statements = []
+
+    def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        statements.append(statement)
+
+    event.listen(engine, 'before_cursor_execute', before_cursor_execute)
+    try:
+        yield statements
+    finally:
+        event.remove(engine, 'before_cursor_execute', before_cursor_execute)
+
+
+def _query_count(db, search):
+    # 先執行一次，讓記憶體索引套用新資料；之後計算穩定狀態的查詢數
+    search()
+    db.session.expunge_all()
+    with _count_queries(db.engine) as statements:
+        results = search()
+    db.session.expunge_all()
+    assert results
+    return len(statements)
+
+
+def _assert_constant(db, tags, search, prepare=lambda: None):
+    _seed(db, tags, 0, 5)
+    prepare()
+    small = _query_count(db, search)
+    _seed(db, tags, 5, 40)
+    prepare()
+    assert _query_count(db, search) == small
+
+
+def test_traditional_search(seeded, app_db):
+    from app import UnifiedSearchService
+
+    service = UnifiedSearchService(cache_size=1)
+    _assert_constant(app_db, seeded, lambda: service._traditional_search(QUERY, LIMIT))
+
+
+def test_hybrid_keyword_leg(seeded, app_db):
+    from vector_service import HybridSearchEngine
+
+    engine = HybridSearchEngine(chroma_manager=None)
+    _assert_constant(app_db, seeded, lambda: engine._keyword_leg(QUERY, LIMIT, None))
+
+
+@pytest.mark.parametrize("context", ['symptom_to_cause', 'cause_to_treatment', 'method_analysis'])
+def test_smart_search(seeded, app_db, association_store, context):
+    from app import execute_smart_search
+    from models import Tag
+
+    def search():
+        matched = Tag.query.filter(Tag.name.in_(['頭痛', '肌肉緊繃', '推拿'])).all()
+        return execute_smart_search(matched, context, QUERY)
+
+    # 關聯表由維護線程更新，不計入請求的查詢數
+    _assert_constant(app_db, seeded, search, prepare=association_store.refresh)
+
+
+def test_method_analysis_endpoint(seeded, app_db, association_store, monkeypatch):
+    import app as flask_app
+
+    # 不在測試中啟動背景索引線程
+    monkeypatch.setattr(flask_app, '_search_indexes_prepared', True)
+    client = flask_app.app.test_client()
+
+    def search():
+        response = client.post('/search', json={'query_type': 'method_analysis', 'method_name': '推拿'})
+        return response.get_json()['results']
+
+    _assert_constant(app_db, seeded, search, prepare=association_store.refresh)
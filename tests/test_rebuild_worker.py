@@ -0,0 +1,15 @@
+"""多進程重建的工作進程初始化：只有 torch 後端才匯入 torch"""
+
+import sys
+
+import vector_service
+
+
+def test_onnx_worker_does_not_import_torch(monkeypatch):
+    # sys.modules 中為 None 的模組在匯入時拋出 ImportError，模擬未安裝 torch
+    monkeypatch.setitem(sys.modules, 'torch', None)
+    monkeypatch.setattr(vector_service.EmbeddingManager, 'ensure_loaded', lambda self: None)
+    monkeypatch.setattr(vector_service, '_worker_embedding_manager', None)
+
+    vector_service._rebuild_worker_init('BAAI/bge-m3', 'onnx-int8', 2)
+    assert vector_service._worker_embedding_manager.backend == 'onnx-int8'
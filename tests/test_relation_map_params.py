@@ -0,0 +1,39 @@
+"""/search relation_map 的 depth / max_nodes / max_links 參數驗證"""
+
+import pytest
+
+
+@pytest.fixture
+def client(app_db, monkeypatch):
+    import app as flask_app
+
+    # 不在測試中啟動背景索引線程
+    monkeypatch.setattr(flask_app, '_search_indexes_prepared', True)
+    return flask_app.app.test_client()
+
+
+@pytest.mark.parametrize("field, value", [
+    ('depth', 'deep'), ('max_nodes', 'many'), ('max_links', [1]), ('max_nodes', 2.5), ('depth', True),
+])
+def test_invalid_values_rejected(client, field, value):
+    response = client.post('/search', json={'query_type': 'relation_map', 'start_point': '頭痛', field: value})
+    assert response.status_code == 400
+    assert field in response.get_json()['error']
+
+
+def test_values_clamped(client, monkeypatch):
+    import app as flask_app
+    from relation_graph import GRAPH_MAX_DEPTH, GRAPH_MAX_LINKS, GRAPH_MAX_NODES
+
+    calls = []
+    monkeypatch.setattr(flask_app, 'build_relation_graph', lambda *args: calls.append(args) or {'nodes': []})
+    for payload in ({'depth': 0, 'max_nodes': -5, 'max_links': '0'},
+                    {'depth': 99, 'max_nodes': 10 ** 6, 'max_links': '999999'},
+                    {}):
+        response = client.post('/search', json={'query_type': 'relation_map', 'start_point': '頭痛', **payload})
+        assert response.status_code == 200
+    assert [call[1:4] for call in calls] == [
+        (1, 1, 1),
+        (GRAPH_MAX_DEPTH, GRAPH_MAX_NODES * 4, GRAPH_MAX_LINKS * 4),
+        (2, GRAPH_MAX_NODES, GRAPH_MAX_LINKS),
+    ]
@@ -0,0 +1,53 @@
+"""UnifiedSearchService 的結果快取：相同查詢命中，任何寫入提交後失效"""
+
+import pytest
+
+
+@pytest.fixture
+def service(app_db):
+    from app import UnifiedSearchService
+    from models import Session
+
+    app_db.session.add_all([
+        Session(id=1, title='肩頸課程', overview='apple stretching'),
+        Session(id=2, title='腰背課程', overview='banana'),
+    ])
+    app_db.session.commit()
+    return UnifiedSearchService(cache_size=16)
+
+
+def _titles(response):
+    return sorted(result['title'] for result in response['results'])
+
+
+def test_repeated_query_is_cached(service):
+    first = service.search('apple', limit=10)
+    assert not first['cached']
+    assert _titles(first) == ['肩頸課程']
+
+    # 空白與大小寫正規化後使用同一個快取條目
+    second = service.search('  APPLE ', limit=10)
+    assert second['cached']
+    assert second['results'] == first['results']
+    assert not service.search('apple', limit=5)['cached']
+
+
+def test_commit_invalidates_cached_results(service, app_db):
+    from models import Session
+
+    assert _titles(service.search('apple', limit=10)) == ['肩頸課程']
+    app_db.session.get(Session, 2).overview = 'apple banana'
+    app_db.session.commit()
+
+    refreshed = service.search('apple', limit=10)
+    assert not refreshed['cached']
+    assert _titles(refreshed) == ['肩頸課程', '腰背課程']
+
+
+def test_filters_are_part_of_the_key(service):
+    from search_filters import SearchFilters
+
+    assert not service.search('apple', limit=10)['cached']
+    filtered = service.search('apple', limit=10, filters=SearchFilters(session_ids=[2]))
+    assert not filtered['cached']
+    assert filtered['results'] == []
@@ -0,0 +1,78 @@
+"""SuggestionIndex：改名後前綴 / 中綴結果更新，只更新時間戳的批量修改不觸發重建"""
+
+import pytest
+
+from change_tracking import subscribe, unsubscribe
+
+
+@pytest.fixture
+def index(app_db):
+    from models import Segment, Session, Tag
+    from suggestion_index import SuggestionIndex
+
+    tags = [Tag(id=1, name='肩頸痠痛', category='症狀'), Tag(id=2, name='頸椎錯位', category='病因'),
+            Tag(id=3, name='推拿', category='手法')]
+    session = Session(id=1, title='肩頸調理課程', tags=[tags[0]])
+    session.segments.append(Segment(id=1, title='觸診', content='', tags=tags[:2]))
+    session.segments.append(Segment(id=2, title='手法', content='', tags=tags[1:]))
+    app_db.session.add_all(tags + [session])
+    app_db.session.commit()
+
+    suggestion_index = SuggestionIndex()
+    subscribe(suggestion_index.on_change)
+    suggestion_index.refresh()
+    yield suggestion_index
+    unsubscribe(suggestion_index.on_change)
+
+
+def _names(results):
+    return [result.text for result in results]
+
+
+def test_prefix_and_infix(index):
+    # 前綴命中在前，中綴命中補齊
+    assert _names(index.search_tags('頸')) == ['頸椎錯位', '肩頸痠痛']
+    assert _names(index.search_tags('痠痛')) == ['肩頸痠痛']
+    assert _names(index.search_tags('頸', categories=['症狀'])) == ['肩頸痠痛']
+    assert index.tag_usage([1, 2, 3]) == {1: 1, 2: 2, 3: 1}
+
+
+def test_rename_updates_prefix_and_infix(index, app_db):
+    from models import Tag
+
+    app_db.session.get(Tag, 1).name = '腰背痠痛'
+    app_db.session.commit()
+
+    assert _names(index.search_tags('肩頸')) == []
+    assert _names(index.search_tags('腰背')) == ['腰背痠痛']
+    assert _names(index.search_tags('背痠')) == ['腰背痠痛']
+    assert _names(index.search_tags('頸')) == ['頸椎錯位']
+
+
+def test_session_rename(index, app_db):
+    from models import Session
+
+    app_db.session.get(Session, 1).title = '腰部放鬆課程'
+    app_db.session.commit()
+    assert _names(index.search_sessions('肩頸')) == []
+    assert _names(index.search_sessions('放鬆')) == ['腰部放鬆課程']
+
+
+def test_touching_tagged_rows_keeps_index(index, app_db):
+    from app import touch_tagged_rows
+
+    touch_tagged_rows(2)
+    app_db.session.commit()
+    # 只更新 updated_at 的批量修改不使索引全量重建
+    assert not index._stale
+    assert _names(index.search_tags('頸椎')) == ['頸椎錯位']
+
+
+def test_bulk_rename_rebuilds(index, app_db):
+    from models import Tag
+
+    Tag.query.filter(Tag.id == 3).update({Tag.name: '按摩'}, synchronize_session=False)
+    app_db.session.commit()
+    assert index._stale
+    assert _names(index.search_tags('按')) == ['按摩']
+    assert _names(index.search_tags('推拿')) == []
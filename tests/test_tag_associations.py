@@ -0,0 +1,192 @@
+"""TagAssociationStore：增量重算與全量重建一致；段落條件下推後返回相同格式"""
+
+import pytest
+
+SYMPTOM, CAUSE, POSTURE, NECK, WAIST, MASSAGE, DOMAIN = range(1, 8)
+
+
+@pytest.fixture
+def seeded(app_db):
+    from models import Segment, Session, Tag
+
+    tags = {
+        SYMPTOM: Tag(id=SYMPTOM, name='頭痛', category='症狀'),
+        CAUSE: Tag(id=CAUSE, name='肌肉緊繃', category='病因'),
+        POSTURE: Tag(id=POSTURE, name='姿勢不良', category='病因'),
+        NECK: Tag(id=NECK, name='肩頸', category='位置'),
+        WAIST: Tag(id=WAIST, name='腰部', category='位置'),
+        MASSAGE: Tag(id=MASSAGE, name='推拿', category='手法'),
+        DOMAIN: Tag(id=DOMAIN, name='骨科', category='領域'),
+    }
+    first = Session(id=1, title='課程 A', tags=[tags[DOMAIN], tags[POSTURE]])
+    first.segments.append(Segment(id=1, title='一', tags=[tags[SYMPTOM], tags[CAUSE], tags[NECK], tags[MASSAGE]]))
+    first.segments.append(Segment(id=2, title='二', tags=[tags[SYMPTOM], tags[WAIST]]))
+    second = Session(id=2, title='課程 B')
+    second.segments.append(Segment(id=3, title='三', tags=[tags[SYMPTOM], tags[CAUSE], tags[WAIST]]))
+    second.segments.append(Segment(id=4, title='四', tags=[tags[CAUSE], tags[MASSAGE]]))
+    app_db.session.add_all(list(tags.values()) + [first, second])
+    app_db.session.commit()
+    return app_db
+
+
+def _table():
+    from models import TagAssociation
+
+    return sorted(
+        (row.relation_type, row.source_tag_id, row.target_tag_id, row.support, row.strength, row.example_segment_ids)
+        for row in TagAssociation.query
+    )
+
+
+def _candidates(store, relation, sources, **kwargs):
+    return [(c.tag_id, c.support, c.strength) for c in store.lookup(relation, sources, **kwargs)]
+
+
+def _edit_tags(db, segment_id, add=(), remove=()):
+    from models import Segment, Tag
+
+    segment = db.session.get(Segment, segment_id)
+    for tag_id in add:
+        segment.tags.append(db.session.get(Tag, tag_id))
+    for tag_id in remove:
+        segment.tags.remove(db.session.get(Tag, tag_id))
+
+
+def _add_segment(db):
+    from models import Segment, Tag
+
+    db.session.add(Segment(id=5, session_id=2, title='五',
+                           tags=[db.session.get(Tag, tag_id) for tag_id in (SYMPTOM, POSTURE, MASSAGE)]))
+
+
+def _recategorize(db):
+    from models import Tag
+
+    db.session.get(Tag, POSTURE).category = '症狀'
+
+
+def _delete_segment(db):
+    from models import Segment
+
+    db.session.delete(db.session.get(Segment, 4))
+
+
+def _tag_session(db):
+    from models import Session, Tag
+
+    session = db.session.get(Session, 2)
+    session.tags.append(db.session.get(Tag, POSTURE))
+
+
+EDITS = [
+    lambda db: _edit_tags(db, 3, add=[POSTURE]),
+    lambda db: _edit_tags(db, 1, remove=[CAUSE]),
+    _add_segment,
+    _tag_session,
+    _recategorize,
+    _delete_segment,
+]
+
+
+def test_initial_rebuild(seeded, association_store):
+    association_store.refresh()
+    assert association_store.rebuilds == 1
+    # 症狀->病因同時計入段落所屬課程的病因標籤
+    assert _candidates(association_store, 'symptom_to_cause', [SYMPTOM]) == [(CAUSE, 2, 0.6667), (POSTURE, 2, 0.6667)]
+    assert _candidates(association_store, 'cause_to_treatment', [CAUSE]) == [(MASSAGE, 2, 0.6667)]
+    assert _candidates(association_store, 'method_to_location', [MASSAGE]) == [(NECK, 1, 0.5)]
+
+
+def test_incremental_recompute_matches_rebuild(seeded, association_store):
+    association_store.refresh()
+    for edit in EDITS:
+        edit(seeded)
+        seeded.session.commit()
+        association_store.refresh()
+        incremental = _table()
+
+        association_store.rebuild()
+        assert incremental == _table()
+    assert association_store.incremental_updates == len(EDITS)
+
+
+def test_lookup_does_not_refresh(seeded, association_store):
+    association_store.refresh()
+    before = _candidates(association_store, 'symptom_to_cause', [SYMPTOM])
+    _edit_tags(seeded, 2, add=[CAUSE])
+    seeded.session.commit()
+    # 請求只讀取物化表，由維護線程套用變更
+    assert _candidates(association_store, 'symptom_to_cause', [SYMPTOM]) == before
+
+    association_store.refresh()
+    assert _candidates(association_store, 'symptom_to_cause', [SYMPTOM])[0] == (CAUSE, 3, 1.0)
+
+
+def test_commit_wakes_maintenance(association_store):
+    from change_tracking import ChangeSet
+
+    association_store.on_change(ChangeSet(upserted={'segment': {1}}))
+    assert association_store._wakeup.is_set()
+
+
+def test_segment_filter_restricts_support(seeded, association_store):
+    from models import Segment, Tag
+    from sqlalchemy import and_
+
+    association_store.refresh()
+    waist = seeded.session.query(Segment.id).filter(
+        Segment.tags.any(and_(Tag.category == '位置', Tag.name == '腰部'))
+    )
+    # 腰部段落為 2、3：頭痛各一次，肌肉緊繃只在段落 3，姿勢不良來自段落 2 的課程
+    assert _candidates(association_store, 'symptom_to_cause', [SYMPTOM], segment_ids=waist) == [
+        (CAUSE, 1, 0.5), (POSTURE, 1, 0.5)
+    ]
+    everything = seeded.session.query(Segment.id)
+    assert (_candidates(association_store, 'symptom_to_cause', [SYMPTOM], segment_ids=everything)
+            == _candidates(association_store, 'symptom_to_cause', [SYMPTOM]))
+
+
+@pytest.mark.parametrize("payload", [
+    {'query_type': 'symptom_to_cause', 'symptom_tags': ['頭痛']},
+    {'query_type': 'symptom_to_cause', 'symptom_tags': ['頭痛'], 'location': '肩頸'},
+    {'query_type': 'cause_to_treatment', 'cause_tags': ['肌肉緊繃']},
+    {'query_type': 'cause_to_treatment', 'cause_tags': ['肌肉緊繃'], 'preferred_domain': '骨科'},
+])
+def test_search_returns_one_shape(seeded, association_store, monkeypatch, payload):
+    import app as flask_app
+
+    # 不在測試中啟動背景索引線程
+    monkeypatch.setattr(flask_app, '_search_indexes_prepared', True)
+    association_store.refresh()
+
+    response = flask_app.app.test_client().post('/search', json=payload)
+    results = response.get_json()['results']
+    assert results
+    for result in results:
+        assert {'candidate_tag', 'support', 'strength', 'example_segment_ids', 'segment_id'} <= set(result)
+        assert result['segment_id'] in result['example_segment_ids']
+    if payload.get('location') or payload.get('preferred_domain'):
+        # 肩頸只有段落 1；骨科只有課程 A（段落 1）帶有肌肉緊繃
+        assert {segment for result in results for segment in result['example_segment_ids']} == {1}
+
+
+def test_incremental_update_clears_fingerprint(seeded, association_store, monkeypatch):
+    from relation_graph import TagCooccurrence
+    from tag_associations import TagAssociationStore
+
+    association_store.refresh()
+    assert association_store._stored_fingerprint() is not None
+
+    digests = []
+    monkeypatch.setattr(association_store, '_fingerprint', lambda: digests.append(1) or 'unused')
+    _edit_tags(seeded, 3, add=[POSTURE])
+    seeded.session.commit()
+    association_store.refresh()
+    # 增量更新不掃描整張關聯表計算指紋，而是清除已保存的指紋
+    assert association_store.incremental_updates == 1 and not digests
+    assert association_store._stored_fingerprint() is None
+
+    restarted = TagAssociationStore(TagCooccurrence(snapshot_path=None))
+    restarted.refresh()
+    assert restarted.rebuilds == 1
+    assert restarted._stored_fingerprint() is not None
@@ -0,0 +1,131 @@
+"""AhoCorasick 與 TagDictionary：重疊匹配、最長匹配，以及新增、移除、重建後的結果"""
+
+import random
+
+import pytest
+
+import tag_matcher
+from change_tracking import subscribe, unsubscribe
+from tag_matcher import AhoCorasick
+
+
+def _brute_force(patterns, text):
+    text = text.lower()
+    return sorted(
+        (start, start + len(pattern), key)
+        for key, pattern in patterns.items()
+        for start in range(len(text) - len(pattern) + 1)
+        if text.startswith(pattern.lower(), start)
+    )
+
+
+def _matches(automaton, text):
+    return sorted(automaton.iter_matches(text))
+
+
+def test_overlapping_matches():
+    automaton = AhoCorasick()
+    patterns = {1: '肩頸', 2: '頸痛', 3: '肩頸痛', 4: '痛'}
+    for key, pattern in patterns.items():
+        automaton.add(key, pattern)
+    assert _matches(automaton, '左肩頸痛') == [(1, 3, 1), (1, 4, 3), (2, 4, 2), (3, 4, 4)]
+
+
+def test_case_insensitive():
+    automaton = AhoCorasick()
+    automaton.add('tmj', 'TMJ')
+    assert _matches(automaton, 'tmj 與 Tmj') == [(0, 3, 'tmj'), (6, 9, 'tmj')]
+
+
+def test_add_remove_matches_brute_force():
+    rng = random.Random(0)
+    alphabet = 'abcd'
+    automaton = AhoCorasick()
+    patterns = {}
+    for step in range(300):
+        key = rng.randrange(40)
+        if rng.random() < 0.3:
+            automaton.remove(key)
+            patterns.pop(key, None)
+        else:
+            pattern = ''.join(rng.choice(alphabet) for _ in range(rng.randint(1, 4)))
+            automaton.add(key, pattern)
+            patterns[key] = pattern
+        if step % 25 == 0:
+            text = ''.join(rng.choice(alphabet) for _ in range(60))
+            assert _matches(automaton, text) == _brute_force(patterns, text)
+
+
+def test_rebuild_after_removals(monkeypatch):
+    monkeypatch.setattr(tag_matcher, 'REBUILD_AFTER_REMOVALS', 3)
+    automaton = AhoCorasick()
+    patterns = {key: pattern for key, pattern in enumerate(['推拿', '拿捏', '按摩', '摩擦', '肩頸'])}
+    for key, pattern in patterns.items():
+        automaton.add(key, pattern)
+    nodes = len(automaton._goto)
+
+    for key in (0, 2, 4):
+        automaton.remove(key)
+        del patterns[key]
+    # 第三次移除觸發重建，回收已刪除模式的節點
+    assert automaton._removed == 0
+    assert len(automaton._goto) < nodes
+    text = '推拿捏按摩擦肩頸'
+    assert _matches(automaton, text) == _brute_force(patterns, text)
+
+    automaton.add(9, '肩頸')
+    assert (6, 8, 9) in _matches(automaton, text)
+
+
+@pytest.fixture
+def dictionary(app_db):
+    from models import Tag
+    from tag_matcher import TagDictionary
+
+    app_db.session.add_all([
+        Tag(id=1, name='肩頸', category='位置'), Tag(id=2, name='頸痛', category='症狀'),
+        Tag(id=3, name='肩頸痛', category='症狀'), Tag(id=4, name='推拿', category='手法'),
+    ])
+    app_db.session.commit()
+    tag_dictionary = TagDictionary()
+    subscribe(tag_dictionary.on_change)
+    tag_dictionary.refresh()
+    yield tag_dictionary
+    unsubscribe(tag_dictionary.on_change)
+
+
+def _found(mentions):
+    return [(mention.name, mention.start, mention.end) for mention in mentions]
+
+
+def test_longest_only(dictionary):
+    text = '肩頸痛可用推拿'
+    assert _found(dictionary.find(text)) == [('肩頸痛', 0, 3), ('推拿', 5, 7)]
+    assert sorted(_found(dictionary.find(text, longest_only=False))) == [
+        ('推拿', 5, 7), ('肩頸', 0, 2), ('肩頸痛', 0, 3), ('頸痛', 1, 3)
+    ]
+    assert _found(dictionary.find(text, categories=['手法'])) == [('推拿', 5, 7)]
+
+
+def test_rename_and_delete(dictionary, app_db):
+    from models import Tag
+
+    app_db.session.get(Tag, 3).name = '落枕'
+    app_db.session.delete(app_db.session.get(Tag, 4))
+    app_db.session.commit()
+
+    assert _found(dictionary.find('肩頸痛可用推拿')) == [('肩頸', 0, 2)]
+    assert _found(dictionary.find('落枕')) == [('落枕', 0, 2)]
+
+
+def test_bulk_update_of_unindexed_column_keeps_dictionary(dictionary, app_db):
+    from models import Tag
+
+    Tag.query.filter(Tag.id == 1).update({Tag.color: '#ffffff'}, synchronize_session=False)
+    app_db.session.commit()
+    assert not dictionary._stale
+
+    Tag.query.filter(Tag.id == 1).update({Tag.name: '肩膀'}, synchronize_session=False)
+    app_db.session.commit()
+    assert dictionary._stale
+    assert _found(dictionary.find('肩膀與肩頸痛')) == [('肩膀', 0, 2), ('肩頸痛', 3, 6)]
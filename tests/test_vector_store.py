@@ -0,0 +1,103 @@
+"""NumpyVectorStore 的過濾查詢：倒排索引的結果需與逐行比對一致"""
+
+import pytest
+
+np = pytest.importorskip("numpy")
+
+from vector_store import NumpyVectorStore, matches_where
+
+DIM = 16
+
+
+def _metadata(index):
+    metadata = {
+        "type": "session" if index % 5 == 0 else "segment",
+        "session_id": index % 7,
+        "segment_type": ["診斷", "治療", "理論"][index % 3],
+        "date_ts": 1_700_000_000 + (index % 11) * 86400,
+        "title": f"文檔 {index}",
+    }
+    for tag_id in (index % 4, index % 9):
+        metadata[f"tag_{tag_id}"] = True
+    return metadata
+
+
+@pytest.fixture
+def store(tmp_path):
+    rng = np.random.default_rng(0)
+    store = NumpyVectorStore(str(tmp_path))
+    count = 300
+    store.upsert(
+        ids=[f"doc_{i}" for i in range(count)],
+        embeddings=rng.standard_normal((count, DIM)).astype(np.float32),
+        documents=[f"內容 {i}" for i in range(count)],
+        metadatas=[_metadata(i) for i in range(count)]
+    )
+    return store
+
+
+WHERE_CLAUSES = [
+    {"type": "segment"},
+    {"session_id": {"$in": [1, 3]}},
+    {"segment_type": {"$ne": "理論"}},
+    {"session_id": {"$nin": [0, 2, 4]}},
+    {"date_ts": {"$gte": 1_700_000_000 + 3 * 86400}},
+    {"$and": [{"type": "segment"}, {"date_ts": {"$lt": 1_700_000_000 + 5 * 86400}}]},
+    {"$or": [{"tag_1": True}, {"tag_8": True}]},
+    {"$and": [{"tag_2": True}, {"$or": [{"session_id": 1}, {"segment_type": "診斷"}]}]},
+    # 缺少欄位的行視為 None，需退回逐行比對
+    {"tag_3": {"$ne": True}},
+]
+
+
+def _expected(store, query, where, k):
+    """不過濾取回全部結果，再以 matches_where 篩選"""
+    hits = store.query(query, store.count())
+    return [hit[0] for hit in hits if matches_where(hit[3], where)][:k]
+
+
+def _assert_filtered_matches_unfiltered(store, seed=1):
+    query = np.random.default_rng(seed).standard_normal(DIM).astype(np.float32)
+    for where in WHERE_CLAUSES:
+        filtered = [hit[0] for hit in store.query(query, 10, where=where)]
+        assert filtered == _expected(store, query, where, 10), where
+
+
+def test_filtered_query_matches_unfiltered(store):
+    _assert_filtered_matches_unfiltered(store)
+
+
+def test_filtered_query_after_upsert_and_delete(store):
+    _assert_filtered_matches_unfiltered(store)
+
+    rng = np.random.default_rng(2)
+    # 覆寫既有文檔的元數據（倒排索引需移除舊值），並追加新文檔
+    changed = [f"doc_{i}" for i in range(0, 60, 3)] + [f"doc_new_{i}" for i in range(20)]
+    store.upsert(
+        ids=changed,
+        embeddings=rng.standard_normal((len(changed), DIM)).astype(np.float32),
+        documents=[""] * len(changed),
+        metadatas=[_metadata(i + 1000) for i in range(len(changed))]
+    )
+    store.delete(ids=[f"doc_{i}" for i in range(100, 140)])
+    store.delete(where={"session_id": 6})
+
+    assert not any(hit[3]["session_id"] == 6 for hit in store.query(np.ones(DIM), store.count()))
+    _assert_filtered_matches_unfiltered(store, seed=3)
+
+
+def test_filtered_query_after_compact(store):
+    store.delete(ids=[f"doc_{i}" for i in range(0, 300, 2)])
+    store.compact()
+    _assert_filtered_matches_unfiltered(store, seed=4)
+
+
+def test_interface_is_abstract():
+    from vector_store import VectorStore
+
+    class Incomplete(VectorStore):
+        def count(self):
+            return 0
+
+    with pytest.raises(TypeError):
+        Incomplete()
@@ -4,20 +4,86 @@
 """
 
 import os
+import time
+import sqlite3
+import hashlib
 import logging
+import threading
+import multiprocessing
+from array import array
 from typing import List, Dict, Tuple, Optional, Any
-from dataclasses import dataclass
-import chromadb
-from chromadb.config import Settings
-from sentence_transformers import SentenceTransformer
+from dataclasses import dataclass, replace
+from importlib.util import find_spec
 import jieba
 import re
+import json
+from datetime import datetime
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeoutError
+from sqlalchemy import bindparam, or_
+from sqlalchemy.orm import joinedload, selectinload
+from caching import LRUCache
+from search_filters import SearchFilters, tag_metadata_key, date_to_timestamp
+from fulltext_service import highlight
+from bm25_index import keyword_search_rows
+from change_tracking import bump_data_version
+from vector_store import VectorStore, DEFAULT_VECTOR_STORE_BACKEND, create_vector_store
 from models import Session, Segment, db
 
 # 配置日誌
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+# 批量重建索引時每批處理的文檔數
+DEFAULT_SYNC_BATCH_SIZE = int(os.environ.get('VECTOR_SYNC_BATCH_SIZE', 64))
+
+# 文本預處理規則的版本號；修改 _preprocess_text 或分塊規則時需遞增，使舊的快取失效
+PREPROCESS_VERSION = 2
+
+# 單一向量文本的最大長度（字元）
+MAX_EMBED_CHARS = 1024
+
+# 長段落的分塊大小與相鄰分塊的重疊長度（字元）
+CHUNK_MAX_CHARS = int(os.environ.get('VECTOR_CHUNK_MAX_CHARS', 400))
+CHUNK_OVERLAP_CHARS = int(os.environ.get('VECTOR_CHUNK_OVERLAP_CHARS', 80))
+# 語義搜尋時的過量取回倍數，彌補同一段落多個分塊合併後的結果數
+CHUNK_OVERFETCH = 3
+
+# 句子邊界：中文句末標點、換行，或英文句點後的空白
+_SENTENCE_BOUNDARY = re.compile(r'(?<=[。！？!?；;\n])|(?<=\.\s)')
+
+# 混合搜尋：語義一路的工作線程數（即同時並行的混合搜尋數）、語義一路逾時（秒），以及倒數排名融合的 k 值與各路權重
+HYBRID_SEARCH_WORKERS = int(os.environ.get('HYBRID_SEARCH_WORKERS', 4))
+HYBRID_LEG_TIMEOUT = float(os.environ.get('HYBRID_SEARCH_LEG_TIMEOUT', 5.0))
+HYBRID_RRF_K = int(os.environ.get('HYBRID_RRF_K', 60))
+HYBRID_SEMANTIC_WEIGHT = float(os.environ.get('HYBRID_SEMANTIC_WEIGHT', 1.0))
+HYBRID_KEYWORD_WEIGHT = float(os.environ.get('HYBRID_KEYWORD_WEIGHT', 1.0))
+
+# 孤立向量對帳時每次 delete 呼叫的文檔數
+RECONCILE_DELETE_BATCH_SIZE = int(os.environ.get('VECTOR_RECONCILE_BATCH_SIZE', 500))
+
+# 嵌入向量快取的最大條目數
+DEFAULT_EMBEDDING_CACHE_SIZE = int(os.environ.get('EMBEDDING_CACHE_MAX_ENTRIES', 50000))
+
+# 查詢向量快取的容量與存活時間（秒）
+QUERY_CACHE_SIZE = int(os.environ.get('QUERY_EMBEDDING_CACHE_SIZE', 1024))
+QUERY_CACHE_TTL = float(os.environ.get('QUERY_EMBEDDING_CACHE_TTL', 3600))
+
+# 嵌入模型推理後端：torch（預設）/ onnx / onnx-int8
+EMBEDDING_BACKENDS = ("torch", "onnx", "onnx-int8")
+DEFAULT_EMBEDDING_BACKEND = os.environ.get('EMBEDDING_BACKEND', 'torch')
+# 匯出的 ONNX 模型存放目錄，以及 int8 動態量化的指令集配置（arm64 / avx2 / avx512 / avx512_vnni）
+ONNX_MODEL_DIR = os.environ.get('ONNX_MODEL_DIR', './onnx_models')
+ONNX_QUANTIZATION_CONFIG = os.environ.get('ONNX_QUANTIZATION_CONFIG', 'avx2')
+
+# 模型預熱完成後是否自動執行一次增量同步
+SYNC_ON_WARMUP = os.environ.get('VECTOR_SYNC_ON_STARTUP', '1') == '1'
+
+
+def vector_dependencies_available() -> bool:
+    """檢查向量搜尋依賴是否已安裝（不實際導入，避免在啟動時載入 torch）"""
+    store_module = "numpy" if DEFAULT_VECTOR_STORE_BACKEND == "numpy" else "chromadb"
+    return all(find_spec(name) is not None for name in (store_module, "sentence_transformers"))
+
 @dataclass
 class SearchResult:
     """搜尋結果數據類"""
@@ -28,19 +94,163 @@ class SearchResult:
     score: float
     metadata: Dict[str, Any]
 
+class EmbeddingCache:
+    """
+    持久化嵌入向量快取
+    
+    以 (模型名稱, 預處理版本, 預處理後文本的雜湊) 為鍵，將向量以 float32 存入 SQLite。
+    超過容量時按最近使用時間淘汰最舊的條目。
+    """
+    
+    # SQLite 單次查詢的參數數量上限（保守值）
+    _MAX_VARIABLES = 500
+    
+    def __init__(self, path: str, max_entries: int = DEFAULT_EMBEDDING_CACHE_SIZE):
+        self.path = path
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._lock = threading.Lock()
+        
+        directory = os.path.dirname(os.path.abspath(path))
+        os.makedirs(directory, exist_ok=True)
+        
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS embeddings ("
+            " key TEXT PRIMARY KEY,"
+            " vector BLOB NOT NULL,"
+            " last_used REAL NOT NULL)"
+        )
+        self._conn.execute(
+            "CREATE INDEX IF NOT EXISTS ix_embeddings_last_used ON embeddings (last_used)"
+        )
+        self._conn.commit()
+        self._size = self._conn.execute("SELECT COUNT(*) FROM embeddings").fetchone()[0]
+    
+    @staticmethod
+    def make_key(model_name: str, text: str) -> str:
+        """生成快取鍵"""
+        raw = f"{model_name}\0{PREPROCESS_VERSION}\0{text}".encode('utf-8')
+        return hashlib.sha256(raw).hexdigest()
+    
+    def get_many(self, keys: List[str]) -> Dict[str, List[float]]:
+        """批量讀取快取，返回命中的 {key: vector}"""
+        found = {}
+        unique_keys = list(dict.fromkeys(keys))
+        
+        with self._lock:
+            now = time.time()
+            for start in range(0, len(unique_keys), self._MAX_VARIABLES):
+                chunk = unique_keys[start:start + self._MAX_VARIABLES]
+                placeholders = ",".join("?" * len(chunk))
+                rows = self._conn.execute(
+                    f"SELECT key, vector FROM embeddings WHERE key IN ({placeholders})", chunk
+                ).fetchall()
+                for key, blob in rows:
+                    vector = array('f')
+                    vector.frombytes(blob)
+                    found[key] = vector.tolist()
+                
+                if rows:
+                    hit_keys = [key for key, _ in rows]
+                    self._conn.execute(
+                        f"UPDATE embeddings SET last_used = ? WHERE key IN ({','.join('?' * len(hit_keys))})",
+                        [now, *hit_keys]
+                    )
+            self._conn.commit()
+            
+            hit_count = sum(1 for key in keys if key in found)
+            self.hits += hit_count
+            self.misses += len(keys) - hit_count
+        
+        return found
+    
+    def put_many(self, items: Dict[str, List[float]]):
+        """批量寫入快取，必要時淘汰最舊的條目"""
+        if not items:
+            return
+        
+        with self._lock:
+            now = time.time()
+            inserted = 0
+            for key, vector in items.items():
+                cursor = self._conn.execute(
+                    "INSERT OR IGNORE INTO embeddings (key, vector, last_used) VALUES (?, ?, ?)",
+                    (key, array('f', vector).tobytes(), now)
+                )
+                inserted += cursor.rowcount
+            self._size += inserted
+            
+            if self._size > self.max_entries:
+                # 一次多淘汰 10%，避免每次寫入都觸發淘汰
+                overflow = self._size - int(self.max_entries * 0.9)
+                cursor = self._conn.execute(
+                    "DELETE FROM embeddings WHERE key IN ("
+                    " SELECT key FROM embeddings ORDER BY last_used LIMIT ?)",
+                    (overflow,)
+                )
+                # 以實際刪除的列數更新計數（其他寫入者可能已改變表的大小）
+                self._size -= cursor.rowcount
+                self.evictions += cursor.rowcount
+            
+            self._conn.commit()
+    
+    def clear(self):
+        """清空快取"""
+        with self._lock:
+            self._conn.execute("DELETE FROM embeddings")
+            self._conn.commit()
+            self._size = 0
+    
+    def stats(self) -> Dict[str, Any]:
+        """獲取快取統計"""
+        lookups = self.hits + self.misses
+        return {
+            "path": self.path,
+            "entries": self._size,
+            "max_entries": self.max_entries,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+            "evictions": self.evictions
+        }
+
+
 class EmbeddingManager:
     """嵌入模型管理器"""
     
-    def __init__(self, model_name: str = "BAAI/bge-m3"):
+    def __init__(self, model_name: str = "BAAI/bge-m3", cache: Optional[EmbeddingCache] = None,
+                 backend: Optional[str] = None):
         self.model_name = model_name
+        self.backend = backend or DEFAULT_EMBEDDING_BACKEND
+        if self.backend not in EMBEDDING_BACKENDS:
+            raise ValueError(f"不支援的嵌入後端: {self.backend}（可選 {', '.join(EMBEDDING_BACKENDS)}）")
         self.model = None
-        self._load_model()
+        self.cache = cache
+        self._load_lock = threading.Lock()
+    
+    @property
+    def model_id(self) -> str:
+        """模型識別碼：不同後端產生的向量略有差異，快取需分開"""
+        if self.backend == "torch":
+            return self.model_name
+        return f"{self.model_name}#{self.backend}"
+    
+    def ensure_loaded(self):
+        """確保模型已載入（首次呼叫時載入，之後直接返回）"""
+        if self.model is not None:
+            return
+        with self._load_lock:
+            if self.model is None:
+                self._load_model()
     
     def _load_model(self):
         """載入嵌入模型"""
         try:
-            logger.info(f"正在載入嵌入模型: {self.model_name}")
-            self.model = SentenceTransformer(self.model_name)
+            logger.info(f"正在載入嵌入模型: {self.model_name}（{self.backend}）")
+            self.model = self._create_model(self.model_name)
             logger.info("嵌入模型載入成功")
         except Exception as e:
             logger.error(f"載入嵌入模型失敗: {e}")
@@ -48,23 +258,83 @@ class EmbeddingManager:
             fallback_model = "shibing624/text2vec-base-chinese"
             logger.info(f"嘗試載入回退模型: {fallback_model}")
             try:
-                self.model = SentenceTransformer(fallback_model)
+                self.model = self._create_model(fallback_model)
                 self.model_name = fallback_model
                 logger.info("回退模型載入成功")
             except Exception as e2:
                 logger.error(f"回退模型也載入失敗: {e2}")
                 raise e2
     
-    def encode(self, texts: List[str]) -> List[List[float]]:
-        """將文本編碼為向量"""
-        if not self.model:
-            raise RuntimeError("嵌入模型未載入")
+    def _create_model(self, model_name: str):
+        """依後端建立 SentenceTransformer 模型"""
+        from sentence_transformers import SentenceTransformer
+        
+        if self.backend == "torch":
+            return SentenceTransformer(model_name)
+        
+        # ONNX Runtime 後端需要 sentence-transformers>=3.2 與 optimum[onnxruntime]
+        if self.backend == "onnx":
+            return SentenceTransformer(model_name, backend="onnx")
         
+        return self._load_quantized_onnx_model(model_name)
+    
+    def _load_quantized_onnx_model(self, model_name: str):
+        """載入 int8 動態量化的 ONNX 模型；首次使用時匯出並量化，之後直接從本地目錄載入"""
+        from sentence_transformers import SentenceTransformer, export_dynamic_quantized_onnx_model
+        
+        export_dir = os.path.join(ONNX_MODEL_DIR, model_name.replace("/", "__"))
+        file_name = f"onnx/model_qint8_{ONNX_QUANTIZATION_CONFIG}.onnx"
+        
+        if not os.path.exists(os.path.join(export_dir, file_name)):
+            logger.info(f"匯出並量化 ONNX 模型到 {export_dir}（{ONNX_QUANTIZATION_CONFIG}）")
+            onnx_model = SentenceTransformer(model_name, backend="onnx")
+            onnx_model.save(export_dir)
+            export_dynamic_quantized_onnx_model(
+                onnx_model,
+                quantization_config=ONNX_QUANTIZATION_CONFIG,
+                model_name_or_path=export_dir
+            )
+        
+        return SentenceTransformer(export_dir, backend="onnx", model_kwargs={"file_name": file_name})
+    
+    def encode(self, texts: List[str], batch_size: int = 32,
+               use_cache: bool = True) -> List[List[float]]:
+        """將文本編碼為向量；命中快取的文本不會經過模型"""
         # 預處理文本
         processed_texts = [self._preprocess_text(text) for text in texts]
         
+        if not use_cache or self.cache is None:
+            return self._encode_processed(processed_texts, batch_size)
+        
+        keys = [EmbeddingCache.make_key(self.model_id, text) for text in processed_texts]
+        vectors = self.cache.get_many(keys)
+        
+        # 只編碼未命中的文本（同批內重複的文本只編碼一次）
+        pending = {}
+        for key, text in zip(keys, processed_texts):
+            if key not in vectors:
+                pending.setdefault(key, text)
+        
+        if pending:
+            encoded = self._encode_processed(list(pending.values()), batch_size)
+            new_vectors = dict(zip(pending.keys(), encoded))
+            self.cache.put_many(new_vectors)
+            vectors.update(new_vectors)
+        
+        return [vectors[key] for key in keys]
+    
+    def _encode_processed(self, processed_texts: List[str], batch_size: int) -> List[List[float]]:
+        """以模型編碼已預處理的文本"""
+        self.ensure_loaded()
+        if not self.model:
+            raise RuntimeError("嵌入模型未載入")
+        
         try:
-            embeddings = self.model.encode(processed_texts, normalize_embeddings=True)
+            embeddings = self.model.encode(
+                processed_texts,
+                batch_size=batch_size,
+                normalize_embeddings=True
+            )
             return embeddings.tolist()
         except Exception as e:
             logger.error(f"文本編碼失敗: {e}")
@@ -78,172 +348,275 @@ class EmbeddingManager:
         # 移除過多的空白字符
         text = re.sub(r'\s+', ' ', text.strip())
         
-        # 限制長度，避免過長文本影響性能
-        if len(text) > 512:
-            text = text[:512]
+        # 限制長度，避免過長文本影響性能（長段落已在建立文檔時分塊）
+        if len(text) > MAX_EMBED_CHARS:
+            text = text[:MAX_EMBED_CHARS]
         
         return text
 
 
+def split_into_chunks(text: str, max_chars: int = CHUNK_MAX_CHARS,
+                      overlap: int = CHUNK_OVERLAP_CHARS) -> List[str]:
+    """
+    按句子邊界將長文本切成相互重疊的分塊
+    
+    分塊盡量在句子邊界結束，下一個分塊以前一分塊結尾不超過 overlap 字元的句子開頭；
+    單一句子超過 max_chars 時按長度硬切。
+    """
+    text = text.strip() if text else ""
+    if len(text) <= max_chars:
+        return [text] if text else []
+    
+    step = max(1, max_chars - overlap)
+    pieces = []
+    for sentence in _SENTENCE_BOUNDARY.split(text):
+        if not sentence.strip():
+            continue
+        while len(sentence) > max_chars:
+            pieces.append(sentence[:max_chars])
+            sentence = sentence[step:]
+        pieces.append(sentence)
+    
+    chunks, current, current_len = [], [], 0
+    for piece in pieces:
+        if current and current_len + len(piece) > max_chars:
+            chunks.append("".join(current).strip())
+            # 保留結尾的句子作為下一分塊的重疊部分
+            carry, carry_len = [], 0
+            for previous in reversed(current):
+                if carry_len + len(previous) > overlap:
+                    break
+                carry.insert(0, previous)
+                carry_len += len(previous)
+            if carry_len + len(piece) > max_chars:
+                carry, carry_len = [], 0
+            current, current_len = carry, carry_len
+        current.append(piece)
+        current_len += len(piece)
+    
+    if current:
+        chunks.append("".join(current).strip())
+    return [chunk for chunk in chunks if chunk]
+
+
+def _filter_metadata(row_date, tags) -> Dict[str, Any]:
+    """
+    供 where 子句過濾的結構化元數據
+    
+    Chroma 元數據不支援列表，每個標籤以 tag_<id>: True 的布林欄位表示；
+    日期以 Unix 時間戳 date_ts 表示，以便範圍比較。沒有值的欄位不寫入。
+    """
+    metadata: Dict[str, Any] = {tag_metadata_key(tag.id): True for tag in tags}
+    timestamp = date_to_timestamp(row_date)
+    if timestamp is not None:
+        metadata["date_ts"] = timestamp
+    return metadata
+
+
+def build_session_documents(session: Session) -> List[Tuple[str, str, Dict[str, Any]]]:
+    """將課程轉換為 [(doc_id, content, metadata)]，沒有概述時返回空列表"""
+    if not session.overview:
+        return []
+    
+    doc_id = f"session_{session.id}"
+    content = f"{session.title}\n\n{session.overview}"
+    metadata = {
+        "type": "session",
+        "session_id": session.id,
+        "title": session.title,
+        "date": session.date.isoformat() if session.date else None,
+        "tags": ",".join([tag.name for tag in session.tags]),
+        "tag_categories": ",".join([tag.category for tag in session.tags]),
+        **_filter_metadata(session.date, session.tags)
+    }
+    return [(doc_id, content, metadata)]
+
+
+def build_segment_documents(segment: Segment) -> List[Tuple[str, str, Dict[str, Any]]]:
+    """
+    將段落轉換為分塊文檔列表，每個分塊一個向量
+    
+    文檔 ID 為 segment_<段落ID>#<分塊序號>，元數據中記錄所屬段落與分塊位置；
+    沒有內容時返回空列表。
+    """
+    if not segment.content:
+        return []
+    
+    chunks = split_into_chunks(segment.content)
+    base_metadata = {
+        "type": "segment",
+        "segment_id": segment.id,
+        "session_id": segment.session_id,
+        "segment_type": segment.segment_type,
+        "title": segment.title or "",
+        "session_title": segment.session.title if segment.session else "",
+        "tags": ",".join([tag.name for tag in segment.tags]),
+        "tag_categories": ",".join([tag.category for tag in segment.tags]),
+        "chunk_count": len(chunks),
+        **_filter_metadata(segment.session.date if segment.session else None, segment.tags)
+    }
+    
+    documents = []
+    for index, chunk in enumerate(chunks):
+        # 每個分塊都帶上段落標題，保留上下文
+        content = f"{segment.title or ''}\n\n{chunk}"
+        documents.append((f"segment_{segment.id}#{index}", content, {**base_metadata, "chunk_index": index}))
+    return documents
+
+
 class ChromaManager:
-    """Chroma 向量數據庫管理器"""
+    """向量數據庫管理器（存儲後端見 vector_store，預設為 Chroma）"""
     
-    def __init__(self, persist_directory: str = "./chroma_db"):
+    def __init__(self, persist_directory: str = "./chroma_db", store_backend: Optional[str] = None):
         self.persist_directory = persist_directory
-        self.client = None
-        self.collection = None
-        self.embedding_manager = EmbeddingManager()
+        self.store_backend = store_backend or DEFAULT_VECTOR_STORE_BACKEND
+        self.store: Optional[VectorStore] = None
+        self.embedding_manager = EmbeddingManager(
+            cache=EmbeddingCache(os.path.join(persist_directory, "embedding_cache.sqlite3"))
+        )
+        # 查詢文本 -> 向量；鍵包含模型識別碼，更換模型後舊條目自然失效
+        self.query_cache = LRUCache(max_size=QUERY_CACHE_SIZE, ttl=QUERY_CACHE_TTL)
         self._init_client()
     
     def _init_client(self):
-        """初始化 Chroma 客戶端"""
+        """初始化向量存儲"""
         try:
-            # 確保持久化目錄存在
-            os.makedirs(self.persist_directory, exist_ok=True)
-            
-            # 初始化 Chroma 客戶端
-            self.client = chromadb.PersistentClient(path=self.persist_directory)
-            
-            # 獲取或創建集合
-            self.collection = self.client.get_or_create_collection(
-                name="knowledge_base",
-                metadata={"description": "知識管理系統的語義搜尋集合"}
-            )
-            
-            logger.info(f"Chroma 客戶端初始化成功，集合大小: {self.collection.count()}")
+            self.store = create_vector_store(self.persist_directory, self.store_backend)
+            logger.info(f"向量存儲（{self.store_backend}）初始化成功，集合大小: {self.store.count()}")
             
         except Exception as e:
-            logger.error(f"Chroma 客戶端初始化失敗: {e}")
+            logger.error(f"向量存儲初始化失敗: {e}")
             raise
     
+    def reset_collection(self):
+        """清空向量集合（更換嵌入模型後需要重建）"""
+        self.store.reset()
+        logger.info("向量集合已重建")
+    
     def add_session(self, session: Session):
         """添加課程到向量數據庫"""
-        if not session.overview:
+        documents = build_session_documents(session)
+        if not documents:
             return
         
         try:
-            # 準備文檔數據
-            doc_id = f"session_{session.id}"
-            content = f"{session.title}\n\n{session.overview}"
-            
-            # 準備元數據
-            metadata = {
-                "type": "session",
-                "session_id": session.id,
-                "title": session.title,
-                "date": session.date.isoformat() if session.date else None,
-                "tags": ",".join([tag.name for tag in session.tags]),
-                "tag_categories": ",".join([tag.category for tag in session.tags])
-            }
-            
-            # 生成嵌入向量
-            embeddings = self.embedding_manager.encode([content])
-            
-            # 添加到 Chroma
-            self.collection.upsert(
-                ids=[doc_id],
-                embeddings=embeddings,
-                documents=[content],
-                metadatas=[metadata]
-            )
-            
+            self.upsert_documents(documents)
             logger.info(f"課程 {session.id} 已添加到向量數據庫")
-            
         except Exception as e:
             logger.error(f"添加課程到向量數據庫失敗: {e}")
     
     def add_segment(self, segment: Segment):
-        """添加段落到向量數據庫"""
-        if not segment.content:
+        """添加段落到向量數據庫（先移除舊分塊，避免分塊數減少時殘留）"""
+        documents = build_segment_documents(segment)
+        if not documents:
             return
         
         try:
-            # 準備文檔數據
-            doc_id = f"segment_{segment.id}"
-            content = f"{segment.title or ''}\n\n{segment.content}"
-            
-            # 準備元數據
-            metadata = {
-                "type": "segment",
-                "segment_id": segment.id,
-                "session_id": segment.session_id,
-                "segment_type": segment.segment_type,
-                "title": segment.title or "",
-                "session_title": segment.session.title if segment.session else "",
-                "tags": ",".join([tag.name for tag in segment.tags]),
-                "tag_categories": ",".join([tag.category for tag in segment.tags])
-            }
-            
-            # 生成嵌入向量
-            embeddings = self.embedding_manager.encode([content])
-            
-            # 添加到 Chroma
-            self.collection.upsert(
-                ids=[doc_id],
-                embeddings=embeddings,
-                documents=[content],
-                metadatas=[metadata]
-            )
-            
-            logger.info(f"段落 {segment.id} 已添加到向量數據庫")
-            
+            self.delete_rows("segment", [segment.id])
+            self.upsert_documents(documents)
+            logger.info(f"段落 {segment.id} 已添加到向量數據庫（{len(documents)} 個分塊）")
         except Exception as e:
             logger.error(f"添加段落到向量數據庫失敗: {e}")
     
-    def remove_session(self, session_id: int):
-        """從向量數據庫移除課程"""
-        try:
-            doc_id = f"session_{session_id}"
-            self.collection.delete(ids=[doc_id])
-            logger.info(f"課程 {session_id} 已從向量數據庫移除")
-        except Exception as e:
-            logger.error(f"移除課程失敗: {e}")
+    def delete_rows(self, content_type: str, row_ids: List[int]):
+        """移除資料列的所有向量（段落以 segment_id 刪除其全部分塊）"""
+        if not row_ids:
+            return
+        if content_type == "segment":
+            self.store.delete(where={"segment_id": {"$in": list(row_ids)}})
+        else:
+            self.store.delete(ids=[f"{content_type}_{row_id}" for row_id in row_ids])
     
-    def remove_segment(self, segment_id: int):
-        """從向量數據庫移除段落"""
-        try:
-            doc_id = f"segment_{segment_id}"
-            self.collection.delete(ids=[doc_id])
-            logger.info(f"段落 {segment_id} 已從向量數據庫移除")
-        except Exception as e:
-            logger.error(f"移除段落失敗: {e}")
+    def upsert_documents(self, documents: List[Tuple[str, str, Dict[str, Any]]],
+                         batch_size: int = DEFAULT_SYNC_BATCH_SIZE) -> int:
+        """
+        批量寫入文檔：一次編碼整批文本，並以單次 upsert 寫入 Chroma
+        
+        Args:
+            documents: (doc_id, content, metadata) 列表
+            batch_size: 模型編碼時的批次大小
+        
+        Returns:
+            寫入的文檔數
+        """
+        if not documents:
+            return 0
+        
+        ids = [doc_id for doc_id, _, _ in documents]
+        contents = [content for _, content, _ in documents]
+        metadatas = [metadata for _, _, metadata in documents]
+        
+        embeddings = self.embedding_manager.encode(contents, batch_size=batch_size)
+        self.store.upsert(
+            ids=ids,
+            embeddings=embeddings,
+            documents=contents,
+            metadatas=metadatas
+        )
+        return len(ids)
+    
+    def delete_sessions(self, session_ids: List[int]):
+        """以單次 where 刪除移除課程及其所有段落分塊的向量"""
+        if not session_ids:
+            return
+        self.store.delete(where={"session_id": {"$in": list(session_ids)}})
+        logger.info(f"已從向量數據庫移除 {len(session_ids)} 個課程及其段落")
+    
+    def delete_session(self, session_id: int):
+        """從向量數據庫移除課程（包括其段落）"""
+        self.delete_sessions([session_id])
+    
+    def delete_segment(self, segment_id: int):
+        """從向量數據庫移除段落的所有分塊"""
+        self.delete_rows("segment", [segment_id])
     
     def semantic_search(self, query: str, limit: int = 10, 
-                       content_type: Optional[str] = None) -> List[SearchResult]:
-        """語義搜尋"""
+                       content_type: Optional[str] = None,
+                       filters: Optional[SearchFilters] = None) -> List[SearchResult]:
+        """
+        語義搜尋
+        
+        Args:
+            query: 搜尋查詢
+            limit: 結果限制
+            content_type: 只搜尋指定類型（session / segment）
+            filters: 結構化過濾條件，直接下推到向量存儲的 where 子句
+        """
         try:
-            # 生成查詢向量
-            query_embeddings = self.embedding_manager.encode([query])
+            # 生成查詢向量（重複查詢直接使用快取）
+            query_embedding = self.encode_query(query)
             
             # 準備搜尋條件
-            where_conditions = {}
             if content_type:
-                where_conditions["type"] = content_type
+                filters = replace(filters, content_type=content_type) if filters else SearchFilters(content_type=content_type)
+            where_conditions = filters.to_where() if filters else None
             
-            # 執行搜尋
-            results = self.collection.query(
-                query_embeddings=query_embeddings,
-                n_results=limit,
-                where=where_conditions if where_conditions else None
+            # 執行搜尋（過量取回分塊，合併後仍有足夠的段落）
+            hits = self.store.query(
+                query_embedding,
+                n_results=limit * CHUNK_OVERFETCH,
+                where=where_conditions
             )
             
-            # 轉換結果格式
-            search_results = []
-            if results['ids'] and results['ids'][0]:
-                for i, doc_id in enumerate(results['ids'][0]):
-                    metadata = results['metadatas'][0][i]
-                    distance = results['distances'][0][i] if results['distances'] and results['distances'][0] else 0.0
-                    score = 1 - distance  # 轉換為相似度分數
-                    
-                    result = SearchResult(
-                        content_id=doc_id,
-                        content_type=metadata.get('type', 'unknown'),
-                        title=metadata.get('title', ''),
-                        content=results['documents'][0][i] if results['documents'] else '',
-                        score=score,
-                        metadata=metadata
-                    )
-                    search_results.append(result)
+            # 轉換結果格式：同一段落的多個分塊只保留分數最高者
+            best_results: Dict[str, SearchResult] = {}
+            for doc_id, distance, document, metadata in hits:
+                score = 1 - distance  # 轉換為相似度分數
+                content_type, row_id = parse_doc_id(doc_id)
+                content_id = f"{content_type}_{row_id}"
+                
+                if content_id in best_results and best_results[content_id].score >= score:
+                    continue
+                best_results[content_id] = SearchResult(
+                    content_id=content_id,
+                    content_type=metadata.get('type', 'unknown'),
+                    title=metadata.get('title', ''),
+                    content=document or '',
+                    score=score,
+                    metadata=metadata
+                )
+            
+            search_results = sorted(best_results.values(), key=lambda r: r.score, reverse=True)[:limit]
             
             logger.info(f"語義搜尋完成，找到 {len(search_results)} 個結果")
             return search_results
@@ -252,14 +625,30 @@ class ChromaManager:
             logger.error(f"語義搜尋失敗: {e}")
             return []
     
+    def encode_query(self, query: str) -> List[float]:
+        """編碼查詢文本，使用記憶體中的 LRU 快取避免重複推理"""
+        embedding_manager = self.embedding_manager
+        key = (embedding_manager.model_id, embedding_manager._preprocess_text(query))
+        embedding = self.query_cache.get(key)
+        if embedding is None:
+            # 查詢不寫入持久化快取，避免擠掉文檔向量
+            embedding = embedding_manager.encode([query], use_cache=False)[0]
+            self.query_cache.set(key, embedding)
+        return embedding
+    
     def get_collection_stats(self) -> Dict[str, Any]:
         """獲取集合統計信息"""
         try:
-            count = self.collection.count()
+            count = self.store.count()
+            cache = self.embedding_manager.cache
             return {
                 "total_documents": count,
+                "vector_store": self.store.stats(),
                 "model_name": self.embedding_manager.model_name,
-                "persist_directory": self.persist_directory
+                "embedding_backend": self.embedding_manager.backend,
+                "persist_directory": self.persist_directory,
+                "embedding_cache": cache.stats() if cache else None,
+                "query_cache": self.query_cache.stats()
             }
         except Exception as e:
             logger.error(f"獲取統計信息失敗: {e}")
@@ -267,13 +656,22 @@ class ChromaManager:
 
 
 class HybridSearchEngine:
-    """混合搜尋引擎：結合關鍵字搜尋和語義搜尋"""
+    """混合搜尋引擎：並行執行關鍵字搜尋和語義搜尋，以倒數排名融合（RRF）合併結果"""
     
-    def __init__(self, chroma_manager: ChromaManager):
+    def __init__(self, chroma_manager: ChromaManager, rrf_k: int = HYBRID_RRF_K,
+                 semantic_weight: float = HYBRID_SEMANTIC_WEIGHT,
+                 keyword_weight: float = HYBRID_KEYWORD_WEIGHT,
+                 leg_timeout: float = HYBRID_LEG_TIMEOUT):
         self.chroma_manager = chroma_manager
+        self.rrf_k = rrf_k
+        self.weights = {"semantic": semantic_weight, "keyword": keyword_weight}
+        self.leg_timeout = leg_timeout
+        self._executor = ThreadPoolExecutor(max_workers=HYBRID_SEARCH_WORKERS, thread_name_prefix="hybrid-search")
+        # 每個進行中的混合搜尋佔用一個工作線程名額
+        self._slots = threading.BoundedSemaphore(HYBRID_SEARCH_WORKERS)
     
     def search(self, query: str, search_type: str = "hybrid", 
-               limit: int = 10) -> List[Dict[str, Any]]:
+               limit: int = 10, filters: Optional[SearchFilters] = None) -> List[Dict[str, Any]]:
         """
         混合搜尋
         
@@ -281,61 +679,104 @@ class HybridSearchEngine:
             query: 搜尋查詢
             search_type: 搜尋類型 ("semantic", "keyword", "hybrid")
             limit: 結果限制
+            filters: 結構化過濾條件，語義與關鍵字兩路使用相同的條件
         """
-        results = []
+        if search_type == "semantic":
+            return self._semantic_leg(query, limit, filters)[:limit]
+        if search_type == "keyword":
+            return self._keyword_leg(query, limit, filters)[:limit]
         
-        if search_type in ["semantic", "hybrid"]:
-            # 語義搜尋
-            semantic_results = self.chroma_manager.semantic_search(query, limit)
-            for result in semantic_results:
-                results.append({
-                    "type": "semantic",
-                    "score": result.score,
-                    "content_type": result.content_type,
-                    "content_id": result.content_id,
-                    "title": result.title,
-                    "content": result.content[:200] + "..." if len(result.content) > 200 else result.content,
-                    "metadata": result.metadata
-                })
+        # 語義一路交給工作線程，關鍵字一路在呼叫端線程（已有應用上下文）執行，總延遲約為較慢的一路。
+        # 同時進行的混合搜尋數以名額限制：名額用完時兩路依序執行，不在線程池中排隊堆積
+        if not self._slots.acquire(blocking=False):
+            legs = {"keyword": self._safe_leg("keyword", self._keyword_leg, query, limit, filters),
+                    "semantic": self._safe_leg("semantic", self._semantic_leg, query, limit, filters)}
+            return self._reciprocal_rank_fusion(legs)[:limit]
         
-        if search_type in ["keyword", "hybrid"]:
-            # 關鍵字搜尋（使用現有的 SQL 搜尋）
-            keyword_results = self._keyword_search(query, limit)
-            for result in keyword_results:
-                results.append({
-                    "type": "keyword",
-                    "score": result.get("score", 0.5),
-                    "content_type": result["type"],
-                    "content_id": result["id"],
-                    "title": result["title"],
-                    "content": result["content"],
-                    "metadata": result.get("metadata", {})
-                })
+        deadline = time.monotonic() + self.leg_timeout
+        try:
+            future = self._executor.submit(self._semantic_leg, query, limit, filters)
+        except Exception:
+            self._slots.release()
+            raise
+        future.add_done_callback(lambda _: self._slots.release())
         
-        # 去重和排序
-        if search_type == "hybrid":
-            results = self._merge_and_rank_results(results)
+        legs: Dict[str, List[Dict[str, Any]]] = {
+            "keyword": self._safe_leg("keyword", self._keyword_leg, query, limit, filters)
+        }
+        try:
+            legs["semantic"] = future.result(timeout=max(0.0, deadline - time.monotonic()))
+        except FutureTimeoutError:
+            # 尚未開始的工作直接取消；已在執行的工作完成後釋放名額
+            future.cancel()
+            logger.warning(f"semantic 搜尋超過 {self.leg_timeout} 秒，本次結果不含此路")
+            legs["semantic"] = []
+        except Exception as e:
+            logger.error(f"semantic 搜尋失敗: {e}")
+            legs["semantic"] = []
         
-        return results[:limit]
+        return self._reciprocal_rank_fusion(legs)[:limit]
+    
+    @staticmethod
+    def _safe_leg(leg: str, func, *args) -> List[Dict[str, Any]]:
+        try:
+            return func(*args)
+        except Exception as e:
+            logger.error(f"{leg} 搜尋失敗: {e}")
+            return []
+    
+    def _semantic_leg(self, query: str, limit: int,
+                      filters: Optional[SearchFilters]) -> List[Dict[str, Any]]:
+        """語義搜尋一路，結果依相似度排序"""
+        return [
+            {
+                "type": "semantic",
+                "score": result.score,
+                "content_type": result.content_type,
+                "content_id": result.content_id,
+                "title": result.title,
+                "content": result.content[:200] + "..." if len(result.content) > 200 else result.content,
+                "metadata": result.metadata
+            }
+            for result in self.chroma_manager.semantic_search(query, limit, filters=filters)
+        ]
+    
+    def _keyword_leg(self, query: str, limit: int,
+                     filters: Optional[SearchFilters]) -> List[Dict[str, Any]]:
+        """關鍵字搜尋一路（使用現有的 SQL 搜尋），結果依相關度排序"""
+        return [
+            {
+                "type": "keyword",
+                "score": result.get("score", 0.5),
+                "content_type": result["type"],
+                "content_id": result["id"],
+                "title": result["title"],
+                "content": result["content"],
+                "highlight": result.get("highlight"),
+                "metadata": result.get("metadata", {})
+            }
+            for result in self._keyword_search(query, limit, filters)
+        ]
     
-    def _keyword_search(self, query: str, limit: int) -> List[Dict[str, Any]]:
-        """關鍵字搜尋（基於現有的 SQL 搜尋）"""
+    def _keyword_search(self, query: str, limit: int,
+                        filters: Optional[SearchFilters] = None) -> List[Dict[str, Any]]:
+        """關鍵字搜尋（全文索引或 BM25 索引，過濾條件轉為 SQL 條件），結果依相關度排序"""
         results = []
+        filters = filters or SearchFilters()
         
         try:
             # 搜尋課程
-            sessions = Session.query.filter(
-                Session.title.contains(query) | 
-                Session.overview.contains(query)
-            ).limit(limit // 2).all()
+            session_query = filters.apply_to_session_query(Session.query)
+            sessions = keyword_search_rows(Session, query, limit, session_query) if session_query is not None else []
             
-            for session in sessions:
+            for session, relevance in sessions:
                 results.append({
                     "type": "session",
                     "id": f"session_{session.id}",
                     "title": session.title,
                     "content": session.overview or "",
-                    "score": 0.8,
+                    "score": relevance,
+                    "highlight": highlight(session.overview, query),
                     "metadata": {
                         "session_id": session.id,
                         "date": session.date.isoformat() if session.date else None
@@ -343,18 +784,18 @@ class HybridSearchEngine:
                 })
             
             # 搜尋段落
-            segments = Segment.query.filter(
-                Segment.title.contains(query) | 
-                Segment.content.contains(query)
-            ).limit(limit // 2).all()
+            # 所屬課程以一次 IN 查詢載入，避免每筆段落各查詢一次課程標題
+            segment_query = filters.apply_to_segment_query(Segment.query.options(selectinload(Segment.session)))
+            segments = keyword_search_rows(Segment, query, limit, segment_query) if segment_query is not None else []
             
-            for segment in segments:
+            for segment, relevance in segments:
                 results.append({
                     "type": "segment",
                     "id": f"segment_{segment.id}",
                     "title": segment.title or "",
                     "content": segment.content or "",
-                    "score": 0.7,
+                    "score": relevance,
+                    "highlight": highlight(segment.content, query),
                     "metadata": {
                         "segment_id": segment.id,
                         "session_id": segment.session_id,
@@ -365,44 +806,144 @@ class HybridSearchEngine:
         except Exception as e:
             logger.error(f"關鍵字搜尋失敗: {e}")
         
-        return results
-    
-    def _merge_and_rank_results(self, results: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
-        """合併和排序混合搜尋結果"""
-        # 簡單的去重邏輯：基於 content_id
-        seen_ids = set()
-        merged_results = []
-        
-        # 按分數排序
+        # 課程與段落依相關度交錯排序，供排名融合使用
         results.sort(key=lambda x: x["score"], reverse=True)
+        return results[:limit]
+    
+    def _reciprocal_rank_fusion(self, legs: Dict[str, List[Dict[str, Any]]]) -> List[Dict[str, Any]]:
+        """
+        倒數排名融合：每一路第 r 名貢獻 weight / (k + r)
         
-        for result in results:
-            content_id = result["content_id"]
-            if content_id not in seen_ids:
-                seen_ids.add(content_id)
-                merged_results.append(result)
+        兩路的原始分數尺度不同（餘弦相似度 vs 關鍵字分數），只使用排名合併；
+        融合分數除以理論最大值，落在 0~1 之間。
+        """
+        fused: Dict[str, Dict[str, Any]] = {}
+        for leg, results in legs.items():
+            weight = self.weights.get(leg, 1.0)
+            for rank, result in enumerate(results, start=1):
+                content_id = result["content_id"]
+                entry = fused.get(content_id)
+                if entry is None:
+                    entry = fused[content_id] = {**result, "score": 0.0, "ranks": {}}
+                elif entry["type"] != leg:
+                    entry["type"] = "hybrid"
+                    if not entry.get("highlight") and result.get("highlight"):
+                        entry["highlight"] = result["highlight"]
+                entry["score"] += weight / (self.rrf_k + rank)
+                entry["ranks"][leg] = rank
         
-        return merged_results
+        max_score = sum(self.weights.get(leg, 1.0) for leg in legs) / (self.rrf_k + 1)
+        merged = sorted(fused.values(), key=lambda x: x["score"], reverse=True)
+        for result in merged:
+            result["score"] = round(result["score"] / max_score, 4) if max_score > 0 else 0.0
+        return merged
 
 
 # 全局實例（單例模式）
 _chroma_manager: Optional[ChromaManager] = None
 _hybrid_search_engine: Optional[HybridSearchEngine] = None
+_singleton_lock = threading.Lock()
 
 def get_chroma_manager() -> ChromaManager:
     """獲取 Chroma 管理器實例"""
     global _chroma_manager
     if _chroma_manager is None:
-        _chroma_manager = ChromaManager()
+        with _singleton_lock:
+            if _chroma_manager is None:
+                _chroma_manager = ChromaManager()
     return _chroma_manager
 
 def get_hybrid_search_engine() -> HybridSearchEngine:
     """獲取混合搜尋引擎實例"""
     global _hybrid_search_engine
     if _hybrid_search_engine is None:
-        _hybrid_search_engine = HybridSearchEngine(get_chroma_manager())
+        chroma_manager = get_chroma_manager()
+        with _singleton_lock:
+            if _hybrid_search_engine is None:
+                _hybrid_search_engine = HybridSearchEngine(chroma_manager)
     return _hybrid_search_engine
 
+
+class VectorWarmup:
+    """
+    向量搜尋預熱器
+    
+    在背景線程中開啟 Chroma 客戶端並載入嵌入模型，讓 Web 伺服器不必等待 torch 載入即可回應。
+    預熱完成前，搜尋應降級為關鍵字模式。
+    """
+    
+    def __init__(self):
+        self.state = "idle"  # idle / loading / ready / failed
+        self.started_at: Optional[datetime] = None
+        self.load_seconds: Optional[float] = None
+        self.error: Optional[str] = None
+        self._lock = threading.Lock()
+        self._thread: Optional[threading.Thread] = None
+    
+    def start(self, app=None) -> bool:
+        """啟動背景預熱（重複呼叫無副作用），返回是否為本次啟動"""
+        with self._lock:
+            if self.state != "idle":
+                return False
+            self.state = "loading"
+            self.started_at = datetime.utcnow()
+        
+        self._thread = threading.Thread(target=self._run, args=(app,), name="vector-warmup", daemon=True)
+        self._thread.start()
+        return True
+    
+    def _run(self, app):
+        started = time.perf_counter()
+        try:
+            chroma_manager = get_chroma_manager()
+            chroma_manager.embedding_manager.ensure_loaded()
+            get_hybrid_search_engine()
+        except Exception as e:
+            self.load_seconds = round(time.perf_counter() - started, 3)
+            self.error = str(e)
+            self.state = "failed"
+            logger.error(f"向量搜尋預熱失敗: {e}")
+            return
+        
+        self.load_seconds = round(time.perf_counter() - started, 3)
+        self.state = "ready"
+        logger.info(f"向量搜尋預熱完成，耗時 {self.load_seconds} 秒")
+        
+        # 補上預熱期間及上次關閉後的資料變更
+        if SYNC_ON_WARMUP and app is not None:
+            with app.app_context():
+                sync_existing_data(full=False)
+    
+    def is_ready(self) -> bool:
+        return self.state == "ready"
+    
+    def status(self) -> Dict[str, Any]:
+        return {
+            "state": self.state,
+            "started_at": self.started_at.isoformat() if self.started_at else None,
+            "load_seconds": self.load_seconds,
+            "error": self.error
+        }
+
+
+_warmup = VectorWarmup()
+
+def start_vector_warmup(app=None) -> bool:
+    """在背景線程中預熱向量搜尋（傳入 app 時，預熱後會執行一次增量同步）"""
+    return _warmup.start(app)
+
+def is_vector_ready() -> bool:
+    """模型和 Chroma 客戶端是否已就緒"""
+    return _warmup.is_ready()
+
+def get_warmup_status() -> Dict[str, Any]:
+    """獲取預熱狀態"""
+    return _warmup.status()
+
+def get_chroma_manager_if_ready() -> Optional[ChromaManager]:
+    """預熱完成時返回 Chroma 管理器，否則返回 None（不會觸發同步載入）"""
+    return _chroma_manager if is_vector_ready() else None
+
 def initialize_vector_db():
     """初始化向量數據庫"""
     try:
@@ -418,25 +959,476 @@ def initialize_vector_db():
         logger.error(f"向量數據庫初始化失敗: {e}")
         return False
 
-def sync_existing_data():
-    """同步現有數據到向量數據庫"""
+def _iter_row_batches(query, id_column, batch_size: int):
+    """以主鍵分頁（keyset pagination）逐批讀取資料列"""
+    last_id = 0
+    while True:
+        rows = query.filter(id_column > last_id).order_by(id_column).limit(batch_size).all()
+        if not rows:
+            break
+        yield rows
+        last_id = rows[-1].id
+
+
+def document_hash(documents: List[Tuple[str, str, Dict[str, Any]]]) -> str:
+    """計算資料列所有文檔（內容 + 元數據）的雜湊；沒有文檔時返回空字串"""
+    if not documents:
+        return ""
+    raw = json.dumps([PREPROCESS_VERSION, documents], ensure_ascii=False, sort_keys=True)
+    return hashlib.sha256(raw.encode('utf-8')).hexdigest()
+
+
+def parse_doc_id(doc_id: str) -> Tuple[str, Optional[int]]:
+    """將向量文檔 ID（如 session_3、segment_12#0）解析為 (內容類型, 資料列 ID)"""
+    content_type, _, row_part = doc_id.partition('_')
+    try:
+        return content_type, int(row_part.split('#', 1)[0])
+    except ValueError:
+        return content_type, None
+
+
+def _stale_filter(model):
+    """資料列自上次同步後有變更（或從未同步）的條件"""
+    return or_(
+        model.vector_synced_at.is_(None),
+        model.updated_at > model.vector_synced_at
+    )
+
+
+def _session_sync_query():
+    return Session.query.options(selectinload(Session.tags))
+
+
+def _segment_sync_query():
+    return Segment.query.options(
+        selectinload(Segment.tags),
+        joinedload(Segment.session)
+    )
+
+
+def _mark_synced(model, marks: List[Dict[str, Any]], synced_at: datetime):
+    """記錄資料列的同步時間和內容雜湊（不觸發 updated_at 的自動更新）"""
+    if not marks:
+        return
+    table = model.__table__
+    statement = table.update().where(table.c.id == bindparam('row_id')).values(
+        vector_hash=bindparam('row_hash'),
+        vector_synced_at=synced_at,
+        updated_at=table.c.updated_at
+    )
+    db.session.execute(statement, marks)
+    db.session.commit()
+
+
+def _index_rows(chroma_manager: 'ChromaManager', rows, model, build_documents,
+                content_type: str, batch_size: int, synced_at: datetime,
+                force: bool, stats: Dict[str, Any]):
+    """
+    索引一批資料列：內容雜湊未變的資料列只更新同步狀態，
+    其餘的移除舊向量後批量編碼並 upsert，沒有內容的資料列只移除其向量
+    """
+    documents, changed_ids, marks = [], [], []
+    for row in rows:
+        row_documents = build_documents(row)
+        digest = document_hash(row_documents)
+        marks.append({'row_id': row.id, 'row_hash': digest})
+        
+        if not force and digest == (row.vector_hash or ""):
+            stats["unchanged"] += 1
+            continue
+        
+        changed_ids.append(row.id)
+        if row_documents:
+            documents.extend(row_documents)
+            stats[f"{content_type}s"] += 1
+        else:
+            stats["removed"] += 1
+    
+    # 一次刪除整批資料列的舊向量（包括分塊數減少後多出的分塊）
+    chroma_manager.delete_rows(content_type, changed_ids)
+    chroma_manager.upsert_documents(documents, batch_size)
+    
+    _mark_synced(model, marks, synced_at)
+    stats["batches"] += 1
+
+
+def _sync_rows(chroma_manager: 'ChromaManager', query, model, build_documents,
+               content_type: str, batch_size: int, synced_at: datetime,
+               force: bool, stats: Dict[str, Any]):
+    """逐批同步查詢結果中的所有資料列"""
+    for rows in _iter_row_batches(query, model.id, batch_size):
+        _index_rows(chroma_manager, rows, model, build_documents, content_type,
+                    batch_size, synced_at, force, stats)
+
+
+def apply_index_changes(changes: Dict[Tuple[str, int], str],
+                        batch_size: Optional[int] = None) -> Dict[str, Any]:
+    """
+    套用一批索引事件
+    
+    Args:
+        changes: {(內容類型, 資料列 ID): 'upsert' 或 'delete'}，同一資料列只保留最後一次操作
+        batch_size: 模型編碼時的批次大小
+    
+    Returns:
+        處理統計；失敗時拋出異常，由呼叫方決定重試
+    """
+    batch_size = batch_size or DEFAULT_SYNC_BATCH_SIZE
+    chroma_manager = get_chroma_manager()
+    synced_at = datetime.utcnow()
+    stats = {"sessions": 0, "segments": 0, "unchanged": 0, "removed": 0, "batches": 0}
+    
+    targets = {
+        "session": (Session, _session_sync_query, build_session_documents),
+        "segment": (Segment, _segment_sync_query, build_segment_documents)
+    }
+    for content_type, (model, make_query, build_documents) in targets.items():
+        upsert_ids = [row_id for (kind, row_id), operation in changes.items()
+                      if kind == content_type and operation == 'upsert']
+        delete_ids = [row_id for (kind, row_id), operation in changes.items()
+                      if kind == content_type and operation == 'delete']
+        
+        if upsert_ids:
+            rows = make_query().filter(model.id.in_(upsert_ids)).all()
+            # 事件入列後資料列已被刪除
+            found = {row.id for row in rows}
+            delete_ids.extend(row_id for row_id in upsert_ids if row_id not in found)
+            
+            _index_rows(chroma_manager, rows, model, build_documents, content_type,
+                        batch_size, synced_at, False, stats)
+        
+        if delete_ids:
+            # 刪除課程時一併移除其段落的向量（段落元數據帶有 session_id）
+            if content_type == "session":
+                chroma_manager.delete_sessions(delete_ids)
+            else:
+                chroma_manager.delete_rows(content_type, delete_ids)
+            stats["removed"] += len(delete_ids)
+    
+    # 向量索引在提交之後才更新，需讓先前快取的搜尋結果失效
+    if stats["sessions"] or stats["segments"] or stats["removed"]:
+        bump_data_version()
+    return stats
+
+
+def find_deleted_doc_ids(chroma_manager: 'ChromaManager') -> List[str]:
+    """找出資料庫中已不存在的課程或段落所遺留的向量文檔 ID"""
+    existing = {
+        "session": {row_id for (row_id,) in db.session.query(Session.id)},
+        "segment": {row_id for (row_id,) in db.session.query(Segment.id)}
+    }
+    indexed_ids = chroma_manager.store.ids()
+    
+    deleted = []
+    for doc_id in indexed_ids:
+        content_type, row_id = parse_doc_id(doc_id)
+        if row_id not in existing.get(content_type, set()):
+            deleted.append(doc_id)
+    return deleted
+
+
+def reconcile_orphans(batch_size: Optional[int] = None, dry_run: bool = False) -> Dict[str, Any]:
+    """
+    比對資料庫 ID 與向量集合 ID，分批刪除孤立的向量
+    
+    Args:
+        batch_size: 每次 delete 呼叫的文檔數
+        dry_run: 只統計不刪除
+    
+    Returns:
+        {"indexed": 集合文檔數, "orphans": 孤立文檔數, "removed": 已刪除數, "batches": delete 次數}
+    """
+    batch_size = batch_size or RECONCILE_DELETE_BATCH_SIZE
+    chroma_manager = get_chroma_manager()
+    started = time.perf_counter()
+    
+    orphan_ids = find_deleted_doc_ids(chroma_manager)
+    stats = {
+        "indexed": chroma_manager.store.count(),
+        "orphans": len(orphan_ids),
+        "removed": 0,
+        "batches": 0,
+        "dry_run": dry_run
+    }
+    
+    if not dry_run:
+        for start in range(0, len(orphan_ids), batch_size):
+            chunk = orphan_ids[start:start + batch_size]
+            chroma_manager.store.delete(ids=chunk)
+            stats["removed"] += len(chunk)
+            stats["batches"] += 1
+    
+    stats["elapsed_seconds"] = round(time.perf_counter() - started, 3)
+    if orphan_ids:
+        logger.info(f"孤立向量對帳：發現 {len(orphan_ids)} 個，移除 {stats['removed']} 個")
+    return stats
+
+
+def count_stale_rows() -> Dict[str, int]:
+    """試運行：統計需要重新同步的資料列數量，不做任何寫入"""
+    chroma_manager = get_chroma_manager()
+    return {
+        "sessions": Session.query.filter(_stale_filter(Session)).count(),
+        "segments": Segment.query.filter(_stale_filter(Segment)).count(),
+        "deleted": len(find_deleted_doc_ids(chroma_manager))
+    }
+
+
+def sync_existing_data(batch_size: Optional[int] = None, full: bool = True) -> Dict[str, Any]:
+    """
+    同步現有數據到向量數據庫
+    
+    以分頁方式讀取課程和段落（預先載入標籤），每批只做一次編碼和一次 upsert。
+    增量模式（full=False）只處理新增、修改過的資料列，並移除已刪除資料列的向量。
+    
+    Args:
+        batch_size: 每批處理的資料列數
+        full: True 時重新寫入所有資料列；False 時依同步水位只處理變更
+    
+    Returns:
+        同步統計（處理數量、耗時、每秒文檔數）
+    """
+    batch_size = batch_size or DEFAULT_SYNC_BATCH_SIZE
+    stats = {
+        "mode": "full" if full else "incremental",
+        "sessions": 0,
+        "segments": 0,
+        "unchanged": 0,
+        "removed": 0,
+        "batches": 0,
+        "elapsed_seconds": 0.0,
+        "docs_per_second": 0.0
+    }
+    
     try:
-        logger.info("開始同步現有數據...")
+        logger.info(f"開始同步現有數據（{stats['mode']}，批次大小 {batch_size}）...")
         chroma_manager = get_chroma_manager()
+        started = time.perf_counter()
+        # 以同步開始時間作為水位：同步期間被修改的資料列會在下次同步時處理
+        synced_at = datetime.utcnow()
+        
+        session_query = _session_sync_query()
+        segment_query = _segment_sync_query()
+        if not full:
+            session_query = session_query.filter(_stale_filter(Session))
+            segment_query = segment_query.filter(_stale_filter(Segment))
         
-        # 同步所有課程
-        sessions = Session.query.all()
-        for session in sessions:
-            if session.overview:
-                chroma_manager.add_session(session)
+        _sync_rows(chroma_manager, session_query, Session, build_session_documents,
+                   "session", batch_size, synced_at, full, stats)
+        _sync_rows(chroma_manager, segment_query, Segment, build_segment_documents,
+                   "segment", batch_size, synced_at, full, stats)
         
-        # 同步所有段落
-        segments = Segment.query.all()
-        for segment in segments:
-            if segment.content:
-                chroma_manager.add_segment(segment)
+        # 移除已刪除資料列的向量
+        stats["removed"] += reconcile_orphans()["removed"]
         
-        logger.info(f"數據同步完成，處理了 {len(sessions)} 個課程和 {len(segments)} 個段落")
+        elapsed = time.perf_counter() - started
+        total = stats["sessions"] + stats["segments"]
+        stats["elapsed_seconds"] = round(elapsed, 3)
+        stats["docs_per_second"] = round(total / elapsed, 2) if elapsed > 0 else 0.0
+        
+        logger.info(
+            f"數據同步完成，處理了 {stats['sessions']} 個課程和 {stats['segments']} 個段落，"
+            f"未變更 {stats['unchanged']} 個，移除 {stats['removed']} 個，"
+            f"耗時 {stats['elapsed_seconds']} 秒（{stats['docs_per_second']} 文檔/秒）"
+        )
         
     except Exception as e:
+        db.session.rollback()
         logger.error(f"數據同步失敗: {e}")
+        stats["error"] = str(e)
+    
+    return stats
+
+
+# 多進程重建：每個工作進程持有自己的模型副本
+_worker_embedding_manager: Optional[EmbeddingManager] = None
+
+def _rebuild_worker_init(model_name: str, backend: str, threads: int):
+    """工作進程初始化：限制線程數並載入模型（ONNX 後端不需要安裝 torch）"""
+    global _worker_embedding_manager
+    if backend == "torch":
+        import torch
+        torch.set_num_threads(threads)
+    _worker_embedding_manager = EmbeddingManager(model_name, backend=backend)
+    _worker_embedding_manager.ensure_loaded()
+
+
+def _rebuild_worker_encode(batch: Tuple[List[str], List[str]]) -> Tuple[List[str], List[List[float]], str]:
+    """工作進程：編碼一批文檔，返回 (doc_ids, 向量, 實際使用的模型識別碼)"""
+    doc_ids, contents = batch
+    embeddings = _worker_embedding_manager.encode(contents, batch_size=len(contents), use_cache=False)
+    return doc_ids, embeddings, _worker_embedding_manager.model_id
+
+
+def rebuild_index_parallel(workers: Optional[int] = None, threads_per_worker: Optional[int] = None,
+                           batch_size: Optional[int] = None, reset: bool = True,
+                           progress=None) -> Dict[str, Any]:
+    """
+    以多個工作進程重新編碼全部文檔
+    
+    主進程讀取資料庫並切分批次，工作進程各自載入模型編碼，
+    結果匯集回主進程由單一寫入者 upsert 到集合。
+    
+    Args:
+        workers: 工作進程數，預設為 CPU 核心數
+        threads_per_worker: 每個工作進程的 torch 線程數，預設平均分配核心
+        batch_size: 每批文檔數
+        reset: 是否先清空集合（更換模型時必須）
+        progress: 進度回呼 progress(已完成數, 總數, 每秒文檔數)
+    
+    Returns:
+        重建統計
+    """
+    cpu_count = os.cpu_count() or 1
+    workers = max(1, workers or cpu_count)
+    threads_per_worker = max(1, threads_per_worker or cpu_count // workers)
+    batch_size = batch_size or DEFAULT_SYNC_BATCH_SIZE
+    
+    chroma_manager = get_chroma_manager()
+    embedding_manager = chroma_manager.embedding_manager
+    if reset:
+        chroma_manager.reset_collection()
+    
+    # 在主進程中讀取資料並切分批次（資料庫只在主進程存取）
+    synced_at = datetime.utcnow()
+    documents: Dict[str, Tuple[str, Dict[str, Any]]] = {}
+    marks = {Session: [], Segment: []}
+    batches: List[Tuple[List[str], List[str]]] = []
+    
+    sources = [
+        (Session, _session_sync_query(), build_session_documents, "session"),
+        (Segment, _segment_sync_query(), build_segment_documents, "segment")
+    ]
+    for model, query, build_documents, content_type in sources:
+        for rows in _iter_row_batches(query, model.id, batch_size):
+            batch_ids, batch_contents = [], []
+            for row in rows:
+                row_documents = build_documents(row)
+                marks[model].append({'row_id': row.id, 'row_hash': document_hash(row_documents)})
+                for doc_id, content, metadata in row_documents:
+                    documents[doc_id] = (content, metadata)
+                    batch_ids.append(doc_id)
+                    batch_contents.append(content)
+            if not reset:
+                # 不清空集合時，先移除這批資料列的舊向量
+                chroma_manager.delete_rows(content_type, [row.id for row in rows])
+            if batch_ids:
+                batches.append((batch_ids, batch_contents))
+    
+    total = len(documents)
+    stats = {
+        "workers": workers,
+        "threads_per_worker": threads_per_worker,
+        "documents": total,
+        "batches": len(batches),
+        "elapsed_seconds": 0.0,
+        "docs_per_second": 0.0
+    }
+    logger.info(f"開始多進程重建：{total} 個文檔，{len(batches)} 批，{workers} 個工作進程")
+    
+    started = time.perf_counter()
+    written = 0
+    context = multiprocessing.get_context("spawn")
+    with context.Pool(workers, initializer=_rebuild_worker_init,
+                      initargs=(embedding_manager.model_name, embedding_manager.backend,
+                                threads_per_worker)) as pool:
+        for doc_ids, embeddings, worker_model_id in pool.imap_unordered(_rebuild_worker_encode, batches):
+            contents = [documents[doc_id][0] for doc_id in doc_ids]
+            chroma_manager.store.upsert(
+                ids=doc_ids,
+                embeddings=embeddings,
+                documents=contents,
+                metadatas=[documents[doc_id][1] for doc_id in doc_ids]
+            )
+            
+            # 將結果寫入嵌入快取，之後的增量同步可直接命中
+            if embedding_manager.cache and worker_model_id == embedding_manager.model_id:
+                embedding_manager.cache.put_many({
+                    EmbeddingCache.make_key(worker_model_id, embedding_manager._preprocess_text(content)): vector
+                    for content, vector in zip(contents, embeddings)
+                })
+            
+            written += len(doc_ids)
+            if progress:
+                elapsed = time.perf_counter() - started
+                progress(written, total, written / elapsed if elapsed > 0 else 0.0)
+    
+    for model, model_marks in marks.items():
+        _mark_synced(model, model_marks, synced_at)
+    
+    elapsed = time.perf_counter() - started
+    stats["elapsed_seconds"] = round(elapsed, 3)
+    stats["docs_per_second"] = round(written / elapsed, 2) if elapsed > 0 else 0.0
+    logger.info(f"多進程重建完成，寫入 {written} 個文檔，{stats['docs_per_second']} 文檔/秒")
+    return stats
+
+
+def _current_rss_mb() -> Optional[float]:
+    """當前進程的常駐記憶體（MB）；無法取得時返回 None"""
+    try:
+        with open("/proc/self/statm") as f:
+            resident_pages = int(f.read().split()[1])
+        return resident_pages * os.sysconf("SC_PAGE_SIZE") / (1024 * 1024)
+    except (OSError, ValueError, AttributeError):
+        pass
+    try:
+        import resource
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        # macOS 以位元組為單位，Linux 以 KB 為單位
+        return peak / (1024 * 1024) if os.uname().sysname == "Darwin" else peak / 1024
+    except (ImportError, AttributeError):
+        return None
+
+
+def benchmark_embedding_backend(backend: str, model_name: str, texts: List[str],
+                                repeats: int = 20) -> Dict[str, Any]:
+    """
+    測量單一後端的載入時間、單句查詢延遲、批量吞吐量與常駐記憶體
+    
+    應在獨立進程中執行，使記憶體數據不受其他後端影響。
+    """
+    rss_before = _current_rss_mb()
+    started = time.perf_counter()
+    manager = EmbeddingManager(model_name, backend=backend)
+    manager.ensure_loaded()
+    load_seconds = time.perf_counter() - started
+    
+    # 單句延遲（模擬語義查詢）
+    latencies = []
+    for i in range(repeats):
+        query = texts[i % len(texts)]
+        t0 = time.perf_counter()
+        manager.encode([query], use_cache=False)
+        latencies.append((time.perf_counter() - t0) * 1000)
+    latencies.sort()
+    
+    # 批量吞吐量與輸出向量（供一致性比較）
+    t0 = time.perf_counter()
+    embeddings = manager.encode(texts, use_cache=False)
+    batch_seconds = time.perf_counter() - t0
+    rss_after = _current_rss_mb()
+    
+    return {
+        "backend": backend,
+        "model_name": manager.model_name,
+        "load_seconds": round(load_seconds, 3),
+        "query_latency_ms_p50": round(latencies[len(latencies) // 2], 2),
+        "query_latency_ms_p95": round(latencies[int(len(latencies) * 0.95) - 1], 2),
+        "batch_docs_per_second": round(len(texts) / batch_seconds, 2) if batch_seconds > 0 else 0.0,
+        "rss_mb": round(rss_after, 1) if rss_after is not None else None,
+        "model_rss_mb": round(rss_after - rss_before, 1) if None not in (rss_before, rss_after) else None,
+        "embeddings": embeddings
+    }
+
+
+def cosine_parity(reference: List[List[float]], candidate: List[List[float]]) -> Dict[str, float]:
+    """比較兩組已正規化向量的逐條餘弦相似度"""
+    similarities = []
+    for ref, cand in zip(reference, candidate):
+        dot = sum(a * b for a, b in zip(ref, cand))
+        norm = (sum(a * a for a in ref) ** 0.5) * (sum(b * b for b in cand) ** 0.5)
+        similarities.append(dot / norm if norm else 0.0)
+    return {
+        "mean_cosine": round(sum(similarities) / len(similarities), 6) if similarities else 0.0,
+        "min_cosine": round(min(similarities), 6) if similarities else 0.0
+    }
@@ -0,0 +1,672 @@
+"""
+向量存儲模組
+定義 ChromaManager 背後的向量存儲介面，提供兩種實作：
+
+- ChromaVectorStore：chromadb.PersistentClient（SQLite + HNSW）
+- NumpyVectorStore：進程內的記憶體映射 .npy 矩陣，適合中小型知識庫，
+  以一次向量化內積加 argpartition 回答 top-k 查詢
+"""
+
+import os
+import json
+import time
+import sqlite3
+import logging
+import threading
+from abc import ABC, abstractmethod
+from typing import List, Dict, Tuple, Optional, Any, Iterable
+
+logger = logging.getLogger(__name__)
+
+# 向量存儲後端：chroma（預設）/ numpy
+VECTOR_STORE_BACKENDS = ("chroma", "numpy")
+DEFAULT_VECTOR_STORE_BACKEND = os.environ.get('VECTOR_STORE_BACKEND', 'chroma')
+# NumPy 後端的矩陣精度：float32（預設）/ float16（記憶體減半，分數有微小誤差）
+DEFAULT_NUMPY_STORE_DTYPE = os.environ.get('VECTOR_STORE_DTYPE', 'float32')
+
+COLLECTION_NAME = "knowledge_base"
+
+# 查詢結果：(doc_id, distance, document, metadata)
+QueryHit = Tuple[str, float, str, Dict[str, Any]]
+
+
+def matches_where(metadata: Dict[str, Any], where: Optional[Dict[str, Any]]) -> bool:
+    """
+    以 Chroma 的 where 語法判斷元數據是否符合條件
+
+    支援欄位等值簡寫、$eq / $ne / $gt / $gte / $lt / $lte / $in / $nin，以及 $and / $or 組合
+    """
+    if not where:
+        return True
+
+    for key, condition in where.items():
+        if key == "$and":
+            if not all(matches_where(metadata, clause) for clause in condition):
+                return False
+            continue
+        if key == "$or":
+            if not any(matches_where(metadata, clause) for clause in condition):
+                return False
+            continue
+
+        value = metadata.get(key)
+        if not isinstance(condition, dict):
+            condition = {"$eq": condition}
+        for operator, operand in condition.items():
+            if operator == "$eq":
+                ok = value == operand
+            elif operator == "$ne":
+                ok = value != operand
+            elif operator == "$in":
+                ok = value in operand
+            elif operator == "$nin":
+                ok = value not in operand
+            elif value is None:
+                ok = False
+            elif operator == "$gt":
+                ok = value > operand
+            elif operator == "$gte":
+                ok = value >= operand
+            elif operator == "$lt":
+                ok = value < operand
+            elif operator == "$lte":
+                ok = value <= operand
+            else:
+                raise ValueError(f"不支援的 where 運算子: {operator}")
+            if not ok:
+                return False
+    return True
+
+
+class VectorStore(ABC):
+    """向量存儲介面；距離為正規化向量間的平方歐氏距離（與 Chroma 預設的 l2 空間一致）"""
+
+    backend = ""
+
+    @abstractmethod
+    def count(self) -> int:
+        """文檔數"""
+
+    @abstractmethod
+    def ids(self) -> List[str]:
+        """所有文檔 ID"""
+
+    @abstractmethod
+    def upsert(self, ids: List[str], embeddings: List[List[float]],
+               documents: List[str], metadatas: List[Dict[str, Any]]):
+        """新增或更新文檔"""
+
+    @abstractmethod
+    def delete(self, ids: Optional[List[str]] = None, where: Optional[Dict[str, Any]] = None):
+        """依 ID 或元數據條件刪除文檔"""
+
+    @abstractmethod
+    def query(self, embedding: List[float], n_results: int,
+              where: Optional[Dict[str, Any]] = None) -> List[QueryHit]:
+        """返回距離由小到大排序的 top-k 結果"""
+
+    @abstractmethod
+    def reset(self):
+        """清空全部文檔（更換嵌入模型後需要重建）"""
+
+    def compact(self) -> Dict[str, Any]:
+        """回收已刪除文檔佔用的空間；不需要壓縮的後端直接返回"""
+        return {}
+
+    def stats(self) -> Dict[str, Any]:
+        return {"backend": self.backend, "documents": self.count()}
+
+
+class ChromaVectorStore(VectorStore):
+    """基於 chromadb.PersistentClient 的向量存儲"""
+
+    backend = "chroma"
+
+    def __init__(self, persist_directory: str):
+        import chromadb
+
+        self.persist_directory = persist_directory
+        self.client = chromadb.PersistentClient(path=persist_directory)
+        self.collection = self._get_collection()
+
+    def _get_collection(self):
+        return self.client.get_or_create_collection(
+            name=COLLECTION_NAME,
+            metadata={"description": "知識管理系統的語義搜尋集合"}
+        )
+
+    def count(self) -> int:
+        return self.collection.count()
+
+    def ids(self) -> List[str]:
+        return self.collection.get(include=[])['ids']
+
+    def upsert(self, ids, embeddings, documents, metadatas):
+        self.collection.upsert(ids=ids, embeddings=embeddings, documents=documents, metadatas=metadatas)
+
+    def delete(self, ids=None, where=None):
+        if ids is not None and not ids:
+            return
+        self.collection.delete(ids=ids, where=where)
+
+    def query(self, embedding, n_results, where=None) -> List[QueryHit]:
+        results = self.collection.query(
+            query_embeddings=[embedding],
+            n_results=n_results,
+            where=where or None
+        )
+        if not results['ids'] or not results['ids'][0]:
+            return []
+
+        distances = results['distances'][0] if results['distances'] else None
+        documents = results['documents'][0] if results['documents'] else None
+        return [
+            (doc_id,
+             distances[i] if distances else 0.0,
+             documents[i] if documents else '',
+             results['metadatas'][0][i])
+            for i, doc_id in enumerate(results['ids'][0])
+        ]
+
+    def reset(self):
+        self.client.delete_collection(name=COLLECTION_NAME)
+        self.collection = self._get_collection()
+
+
+class NumpyVectorStore(VectorStore):
+    """
+    進程內向量存儲
+
+    正規化後的向量存於記憶體映射的 vectors.npy（容量不足時倍增），
+    文檔 ID、矩陣行號、文本和元數據存於同目錄的 SQLite。
+    刪除只標記行號為空，由 compact() 重寫矩陣回收空間。
+    """
+
+    backend = "numpy"
+
+    # 初始容量（行數）
+    INITIAL_CAPACITY = 1024
+    # float16 矩陣每次轉換為 float32 計算的行數
+    QUERY_BLOCK_ROWS = 65536
+    # 快取的 where 條件數
+    WHERE_CACHE_SIZE = 64
+
+    def __init__(self, persist_directory: str, dtype: str = DEFAULT_NUMPY_STORE_DTYPE):
+        import numpy as np
+
+        if dtype not in ("float32", "float16"):
+            raise ValueError(f"不支援的向量精度: {dtype}")
+
+        self._np = np
+        self.dtype = np.dtype(dtype)
+        self.directory = os.path.join(persist_directory, "numpy_store")
+        self.matrix_path = os.path.join(self.directory, "vectors.npy")
+        os.makedirs(self.directory, exist_ok=True)
+
+        self._lock = threading.RLock()
+        self._conn = sqlite3.connect(os.path.join(self.directory, "documents.sqlite3"),
+                                     check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS documents (
+                id TEXT PRIMARY KEY,
+                row INTEGER NOT NULL,
+                document TEXT,
+                metadata TEXT
+            )
+        """)
+        self._conn.commit()
+
+        self._matrix = None
+        # where 條件 -> (資料版本, 符合的行號)，任何寫入都會遞增版本
+        self._where_cache: Dict[str, Tuple[int, Any]] = {}
+        # 元數據倒排索引：欄位 -> 值 -> 行號集合；欄位第一次出現在 where 中時建立，之後隨寫入增量維護。
+        # 值為 None 的欄位含有無法索引的值（如列表），該欄位的條件退回逐行比對
+        self._postings: Dict[str, Optional[Dict[Any, set]]] = {}
+        self._version = 0
+        self._load()
+
+    def _load(self):
+        """載入 ID 對照表與矩陣"""
+        np = self._np
+
+        self._row_of: Dict[str, int] = {}
+        self._metadata: Dict[int, Dict[str, Any]] = {}
+        for doc_id, row, metadata in self._conn.execute("SELECT id, row, metadata FROM documents"):
+            self._row_of[doc_id] = row
+            self._metadata[row] = json.loads(metadata) if metadata else {}
+
+        # 已使用的行數（含已刪除的空行）
+        self._size = max(self._row_of.values()) + 1 if self._row_of else 0
+        self._doc_ids: List[Optional[str]] = [None] * self._size
+        for doc_id, row in self._row_of.items():
+            self._doc_ids[row] = doc_id
+
+        if os.path.exists(self.matrix_path):
+            self._matrix = np.lib.format.open_memmap(self.matrix_path, mode='r+')
+            if self._matrix.dtype != self.dtype:
+                logger.warning(f"向量矩陣精度為 {self._matrix.dtype}，與設定的 {self.dtype} 不同，將沿用現有精度")
+                self.dtype = self._matrix.dtype
+
+        self._live = np.zeros(self._size, dtype=bool)
+        self._live[list(self._row_of.values())] = True
+        self._postings = {}
+        self._version += 1
+
+    def _ensure_capacity(self, rows: int, dim: int):
+        """確保矩陣至少有 rows 行；容量不足時以倍增的新檔案取代"""
+        np = self._np
+
+        if self._matrix is not None and self._matrix.shape[1] != dim:
+            raise ValueError(f"向量維度 {dim} 與現有矩陣的 {self._matrix.shape[1]} 不同，請先重建索引")
+
+        capacity = self._matrix.shape[0] if self._matrix is not None else 0
+        if rows <= capacity:
+            return
+
+        new_capacity = max(self.INITIAL_CAPACITY, capacity * 2, rows)
+        self._replace_matrix(new_capacity, dim, source_rows=np.arange(self._size))
+
+    def _replace_matrix(self, capacity: int, dim: int, source_rows):
+        """以新容量重寫矩陣檔案，source_rows 依序複製到新矩陣的開頭"""
+        np = self._np
+
+        tmp_path = self.matrix_path + ".tmp"
+        matrix = np.lib.format.open_memmap(tmp_path, mode='w+', dtype=self.dtype, shape=(capacity, dim))
+        if self._matrix is not None and len(source_rows):
+            for start in range(0, len(source_rows), self.QUERY_BLOCK_ROWS):
+                block = source_rows[start:start + self.QUERY_BLOCK_ROWS]
+                matrix[start:start + len(block)] = self._matrix[block]
+        matrix.flush()
+        del matrix
+
+        self._matrix = None
+        os.replace(tmp_path, self.matrix_path)
+        self._matrix = np.lib.format.open_memmap(self.matrix_path, mode='r+')
+
+    def _normalize(self, embeddings):
+        np = self._np
+        vectors = np.asarray(embeddings, dtype=np.float32)
+        if vectors.ndim == 1:
+            vectors = vectors[None, :]
+        norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+        norms[norms == 0] = 1.0
+        return vectors / norms
+
+    def count(self) -> int:
+        return len(self._row_of)
+
+    def ids(self) -> List[str]:
+        with self._lock:
+            return list(self._row_of)
+
+    def upsert(self, ids, embeddings, documents, metadatas):
+        if not ids:
+            return
+        np = self._np
+        vectors = self._normalize(embeddings)
+
+        with self._lock:
+            # 已存在的 ID 覆寫原行，新 ID 依序追加
+            rows = []
+            next_row = self._size
+            for doc_id in ids:
+                row = self._row_of.get(doc_id)
+                if row is None:
+                    row = next_row
+                    next_row += 1
+                rows.append(row)
+
+            self._ensure_capacity(next_row, vectors.shape[1])
+            self._matrix[rows] = vectors.astype(self.dtype)
+            self._matrix.flush()
+
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO documents (id, row, document, metadata) VALUES (?, ?, ?, ?)",
+                [(doc_id, row, document, json.dumps(metadata, ensure_ascii=False))
+                 for doc_id, row, document, metadata in zip(ids, rows, documents, metadatas)]
+            )
+            self._conn.commit()
+
+            if next_row > self._size:
+                self._live = np.concatenate([self._live, np.zeros(next_row - self._size, dtype=bool)])
+                self._doc_ids.extend([None] * (next_row - self._size))
+                self._size = next_row
+            for doc_id, row, metadata in zip(ids, rows, metadatas):
+                self._unindex_row(row)
+                self._row_of[doc_id] = row
+                self._doc_ids[row] = doc_id
+                self._metadata[row] = dict(metadata)
+                self._live[row] = True
+                self._index_row(row)
+            self._version += 1
+
+    def delete(self, ids=None, where=None):
+        with self._lock:
+            if where:
+                matched = self._matching_rows(where)
+                targets = [self._doc_ids[row] for row in matched.tolist()]
+                if ids is not None:
+                    requested = set(ids)
+                    targets = [doc_id for doc_id in targets if doc_id in requested]
+            elif ids is not None:
+                targets = [doc_id for doc_id in ids if doc_id in self._row_of]
+            else:
+                targets = list(self._row_of)
+            if not targets:
+                return
+
+            self._conn.executemany("DELETE FROM documents WHERE id = ?", [(doc_id,) for doc_id in targets])
+            self._conn.commit()
+            for doc_id in targets:
+                row = self._row_of.pop(doc_id)
+                self._unindex_row(row)
+                self._metadata.pop(row, None)
+                self._doc_ids[row] = None
+                self._live[row] = False
+            self._version += 1
+
+    def _scores(self, query, rows=None):
+        """計算查詢向量與所有已使用行（或指定行）的內積"""
+        np = self._np
+        if rows is not None:
+            return self._matrix[rows].astype(np.float32, copy=False) @ query
+        if self.dtype == np.float32:
+            return self._matrix[:self._size] @ query
+        
+        # float16 沒有 BLAS 支援，分塊轉為 float32 計算
+        scores = np.empty(self._size, dtype=np.float32)
+        for start in range(0, self._size, self.QUERY_BLOCK_ROWS):
+            end = min(start + self.QUERY_BLOCK_ROWS, self._size)
+            scores[start:end] = self._matrix[start:end].astype(np.float32) @ query
+        return scores
+
+    @staticmethod
+    def _indexable(value) -> bool:
+        return isinstance(value, (str, int, float, bool)) and value == value
+
+    def _index_row(self, row: int):
+        """把一行的元數據加入已建立的倒排索引"""
+        metadata = self._metadata[row]
+        for key, values in self._postings.items():
+            if values is None or key not in metadata:
+                continue
+            value = metadata[key]
+            if self._indexable(value):
+                values.setdefault(value, set()).add(row)
+            elif value is not None:
+                self._postings[key] = None
+
+    def _unindex_row(self, row: int):
+        metadata = self._metadata.get(row)
+        if not metadata:
+            return
+        for key, values in self._postings.items():
+            if values is None or key not in metadata:
+                continue
+            rows = values.get(metadata[key])
+            if rows is not None:
+                rows.discard(row)
+                if not rows:
+                    del values[metadata[key]]
+
+    def _field_postings(self, key: str) -> Optional[Dict[Any, set]]:
+        """欄位的倒排索引（第一次使用時以一次掃描建立）；含有無法索引的值時返回 None"""
+        if key not in self._postings:
+            values: Dict[Any, set] = {}
+            for row, metadata in self._metadata.items():
+                value = metadata.get(key)
+                if value is None:
+                    continue
+                if not self._indexable(value):
+                    values = None
+                    break
+                values.setdefault(value, set()).add(row)
+            self._postings[key] = values
+        return self._postings[key]
+
+    def _rows_mask(self, rows: Iterable[int]):
+        np = self._np
+        mask = np.zeros(self._size, dtype=bool)
+        rows = list(rows)
+        if rows:
+            mask[np.fromiter(rows, dtype=np.int64, count=len(rows))] = True
+        return mask
+
+    def _where_mask(self, where: Dict[str, Any]):
+        """
+        以倒排索引的集合運算求出符合 where 的行（布林遮罩，未與存活行相交）
+
+        遇到無法以索引回答的條件（比較 None、欄位含有列表等）時返回 None，由呼叫端逐行比對
+        """
+        np = self._np
+        mask = np.ones(self._size, dtype=bool)
+        for key, condition in where.items():
+            if key in ("$and", "$or"):
+                masks = [self._where_mask(clause) for clause in condition]
+                if any(clause_mask is None for clause_mask in masks):
+                    return None
+                if key == "$and":
+                    for clause_mask in masks:
+                        mask &= clause_mask
+                else:
+                    mask &= np.logical_or.reduce(masks) if masks else np.zeros(self._size, dtype=bool)
+                continue
+
+            postings = self._field_postings(key)
+            if postings is None:
+                return None
+            if not isinstance(condition, dict):
+                condition = {"$eq": condition}
+            for operator, operand in condition.items():
+                if operator in ("$eq", "$ne"):
+                    operands = [operand]
+                elif operator in ("$in", "$nin"):
+                    operands = list(operand)
+                elif operator in ("$gt", "$gte", "$lt", "$lte"):
+                    operands = None
+                else:
+                    raise ValueError(f"不支援的 where 運算子: {operator}")
+
+                if operands is not None:
+                    # 缺少欄位的行在 matches_where 中視為 None，倒排索引不記錄這些行
+                    if any(value is None for value in operands):
+                        return None
+                    matched = self._rows_mask(
+                        row for value in operands if self._indexable(value) for row in postings.get(value, ())
+                    )
+                    mask &= ~matched if operator in ("$ne", "$nin") else matched
+                    continue
+
+                # 範圍條件只需檢查不同的值（例如日期），而不是每一行
+                compare = {
+                    "$gt": lambda value: value > operand, "$gte": lambda value: value >= operand,
+                    "$lt": lambda value: value < operand, "$lte": lambda value: value <= operand,
+                }[operator]
+                try:
+                    selected = [value for value in postings if compare(value)]
+                except TypeError:
+                    return None
+                mask &= self._rows_mask(row for value in selected for row in postings[value])
+        return mask
+
+    def _matching_rows(self, where: Dict[str, Any]):
+        """符合 where 條件的存活行號（遞增排序）"""
+        np = self._np
+        mask = self._where_mask(where)
+        if mask is None:
+            return np.fromiter(
+                (row for row in np.flatnonzero(self._live) if matches_where(self._metadata[row], where)),
+                dtype=np.int64
+            )
+        return np.flatnonzero(mask & self._live)
+
+    def _candidate_rows(self, where: Dict[str, Any]):
+        """符合 where 條件的行號；同一條件在資料未變更前重複使用"""
+        key = json.dumps(where, sort_keys=True)
+        cached = self._where_cache.get(key)
+        if cached is not None and cached[0] == self._version:
+            return cached[1]
+
+        rows = self._matching_rows(where)
+        if len(self._where_cache) >= self.WHERE_CACHE_SIZE:
+            self._where_cache.pop(next(iter(self._where_cache)))
+        self._where_cache[key] = (self._version, rows)
+        return rows
+
+    def query(self, embedding, n_results, where=None) -> List[QueryHit]:
+        np = self._np
+        with self._lock:
+            if not self._row_of or n_results <= 0:
+                return []
+
+            query = self._normalize(embedding)[0]
+            if where:
+                # 候選行由倒排索引的集合運算求出，只對這些行計算內積
+                rows = self._candidate_rows(where)
+                if len(rows) == 0:
+                    return []
+                scores = self._scores(query, rows)
+            else:
+                rows = np.flatnonzero(self._live)
+                scores = self._scores(query)[rows] if len(rows) < self._size else self._scores(query)
+
+            k = min(n_results, len(rows))
+            top = np.argpartition(-scores, k - 1)[:k] if k < len(scores) else np.arange(len(scores))
+            top = top[np.argsort(-scores[top])]
+
+            top_rows = [int(rows[i]) for i in top]
+            doc_ids = [self._doc_ids[row] for row in top_rows]
+            documents = self._fetch_documents(doc_ids)
+            # 正規化向量的平方歐氏距離 = 2 - 2 * cos
+            return [
+                (doc_id, float(2.0 - 2.0 * scores[i]), documents.get(doc_id, ''), self._metadata[row])
+                for doc_id, i, row in zip(doc_ids, top, top_rows)
+            ]
+
+    def _fetch_documents(self, doc_ids: List[str]) -> Dict[str, str]:
+        placeholders = ",".join("?" * len(doc_ids))
+        return dict(self._conn.execute(
+            f"SELECT id, document FROM documents WHERE id IN ({placeholders})", doc_ids
+        ))
+
+    def reset(self):
+        with self._lock:
+            self._conn.execute("DELETE FROM documents")
+            self._conn.commit()
+            self._matrix = None
+            if os.path.exists(self.matrix_path):
+                os.remove(self.matrix_path)
+            self._load()
+
+    def compact(self) -> Dict[str, Any]:
+        """把存活的行搬到矩陣開頭並重寫 ID 對照表，回收已刪除行的空間"""
+        np = self._np
+        with self._lock:
+            before = self._size
+            if self._matrix is None or before == len(self._row_of):
+                return {"rows_before": before, "rows_after": before, "reclaimed": 0}
+
+            live_rows = np.flatnonzero(self._live)
+            capacity = max(self.INITIAL_CAPACITY, len(live_rows))
+            self._replace_matrix(capacity, self._matrix.shape[1], source_rows=live_rows)
+
+            new_row = {int(old): new for new, old in enumerate(live_rows)}
+            self._conn.executemany(
+                "UPDATE documents SET row = ? WHERE id = ?",
+                [(new_row[row], doc_id) for doc_id, row in self._row_of.items()]
+            )
+            self._conn.commit()
+            self._load()
+
+            logger.info(f"向量矩陣壓縮完成：{before} → {self._size} 行")
+            return {"rows_before": before, "rows_after": self._size, "reclaimed": before - self._size}
+
+    def stats(self) -> Dict[str, Any]:
+        capacity = self._matrix.shape[0] if self._matrix is not None else 0
+        return {
+            "backend": self.backend,
+            "documents": self.count(),
+            "dtype": str(self.dtype),
+            "rows_used": self._size,
+            "deleted_rows": self._size - self.count(),
+            "capacity": capacity,
+            "matrix_mb": round(self._matrix.nbytes / (1024 * 1024), 2) if self._matrix is not None else 0.0
+        }
+
+
+def create_vector_store(persist_directory: str, backend: Optional[str] = None) -> VectorStore:
+    """依設定建立向量存儲"""
+    backend = backend or DEFAULT_VECTOR_STORE_BACKEND
+    if backend not in VECTOR_STORE_BACKENDS:
+        raise ValueError(f"不支援的向量存儲後端: {backend}（可選 {', '.join(VECTOR_STORE_BACKENDS)}）")
+
+    os.makedirs(persist_directory, exist_ok=True)
+    if backend == "numpy":
+        return NumpyVectorStore(persist_directory)
+    return ChromaVectorStore(persist_directory)
+
+
+def _random_unit_vectors(count: int, dim: int, seed: int):
+    import numpy as np
+    vectors = np.random.default_rng(seed).standard_normal((count, dim), dtype=np.float32)
+    return vectors / np.linalg.norm(vectors, axis=1, keepdims=True)
+
+
+def build_benchmark_store(backend: str, directory: str, size: int, dim: int,
+                          batch_size: int = 5000) -> float:
+    """以隨機向量填充測試用的存儲，返回寫入耗時（秒）"""
+    store = create_vector_store(directory, backend)
+    started = time.perf_counter()
+    for start in range(0, size, batch_size):
+        count = min(batch_size, size - start)
+        vectors = _random_unit_vectors(count, dim, seed=start)
+        store.upsert(
+            ids=[f"segment_{start + i}" for i in range(count)],
+            embeddings=vectors.tolist() if backend == "chroma" else vectors,
+            documents=[""] * count,
+            metadatas=[{"type": "segment", "segment_id": start + i} for i in range(count)]
+        )
+    return time.perf_counter() - started
+
+
+def measure_benchmark_store(backend: str, directory: str, dim: int,
+                            queries: int = 100, top_k: int = 10) -> Dict[str, Any]:
+    """在全新進程中開啟存儲，測量冷啟動、查詢延遲與常駐記憶體"""
+    from vector_service import _current_rss_mb
+
+    rss_before = _current_rss_mb()
+    started = time.perf_counter()
+    store = create_vector_store(directory, backend)
+    store.count()
+    cold_start = time.perf_counter() - started
+
+    latencies = []
+    for vector in _random_unit_vectors(queries, dim, seed=2 ** 31):
+        started = time.perf_counter()
+        store.query(vector.tolist(), top_k)
+        latencies.append((time.perf_counter() - started) * 1000)
+    latencies.sort()
+
+    rss_after = _current_rss_mb()
+    return {
+        "cold_start_seconds": round(cold_start, 3),
+        "query_latency_ms_p50": round(latencies[len(latencies) // 2], 2),
+        "query_latency_ms_p95": round(latencies[min(len(latencies) - 1, int(len(latencies) * 0.95))], 2),
+        "rss_mb": round(rss_after, 1) if rss_after is not None else None,
+        "rss_delta_mb": round(rss_after - rss_before, 1) if rss_after is not None and rss_before is not None else None
+    }
+
+
+def iter_benchmark_sizes(sizes: str) -> Iterable[int]:
+    """解析 "10000,100000" 形式的規模列表（支援 10k / 1m 縮寫）"""
+    for item in sizes.split(','):
+        item = item.strip().lower()
+        if not item:
+            continue
+        multiplier = 1
+        if item.endswith('k'):
+            item, multiplier = item[:-1], 1000
+        elif item.endswith('m'):
+            item, multiplier = item[:-1], 1000000
+        yield int(float(item) * multiplier)